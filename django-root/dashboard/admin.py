@@ -1,15 +1,23 @@
 from django.contrib import admin
+from django.db import transaction
 
 from dashboard.models import CourseOffering
 from dashboard.models import CourseRepeatingEvent
 from dashboard.models import CourseSingleEvent
 from dashboard.models import CourseSubmissionEvent
 from dashboard.models import LMSServer
+from olap.tasks import update_course_weeks_task
 
 
 @admin.register(CourseOffering)
 class CourseOfferingAdmin(admin.ModelAdmin):
-    readonly_fields = ('last_activity_at',)
+    readonly_fields = ('last_activity_at', 'data_version', 'import_generation', 'updated_at')
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'start_date' in form.changed_data:
+            # The activity's course weeks count from the start date, so are recalculated once it's saved
+            transaction.on_commit(lambda: update_course_weeks_task.delay(obj.pk))
 
 
 admin.site.register(LMSServer)
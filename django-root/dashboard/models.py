@@ -49,9 +49,12 @@ class CourseOffering(models.Model):
     start_date = models.DateField(help_text='Start date must be on a Monday')
     no_weeks = models.IntegerField()
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)  # Also moved on by changes to the offering's events
     lms_type = models.CharField(max_length=50, choices=LMS_TYPE_CHOICES, default=LMS_TYPE_BLACKBOARD)
     last_activity_at = models.DateTimeField(blank=True, null=True)  # The last recorded page visit, submission attempt or summary post
     is_importing = models.BooleanField(default=False)
+    data_version = models.IntegerField(default=0)  # The version of the OLAP data shown.  See olap.models.OfferingDataQuerySet
+    import_generation = models.IntegerField(default=0)  # Counts the changes to the OLAP data.  See bump_import_generation
     lms_server = models.ForeignKey(LMSServer, null=True, blank=True, help_text='If empty, then this course offering will not be able to be imported')
 
     class Meta:
@@ -95,6 +98,16 @@ class CourseOffering(models.Model):
             end_date.day
         ), local_tz)
 
+    def bump_import_generation(self):
+        """
+        Records that the offering's OLAP data has changed (by an import, or its sessions being rebuilt).  Caches of the
+        data are kept by generation, as an import that replaces rows can leave the data version and last_activity_at as
+        they were.  It's only changed here, so the importer and tasks save the fields they change with update_fields,
+        which can't set it back from a copy of the offering loaded before an import.
+        """
+        CourseOffering.objects.filter(pk=self.pk).update(import_generation=models.F('import_generation') + 1)
+        self.refresh_from_db(fields=['import_generation'])
+
     def get_last_activity_date(self):
         last_activity_at = self.last_activity_at
         if not last_activity_at:
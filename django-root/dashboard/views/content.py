@@ -36,7 +36,7 @@ class ResourcePageView(TemplateView):
         context = super().get_context_data(**kwargs)
 
         resource_id = kwargs.get('pk')
-        page = get_object_or_404(Page, pk=resource_id, course_offering=self.request.course_offering)
+        page = get_object_or_404(Page.objects.for_offering(self.request.course_offering), pk=resource_id)
 
         initial_data = {
             'course_id': self.request.course_offering.id,
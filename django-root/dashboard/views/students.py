@@ -42,7 +42,7 @@ class StudentDetailView(TemplateView):
         context = super().get_context_data(**kwargs)
 
         student_id = kwargs.get('pk')
-        student = get_object_or_404(LMSUser, pk=student_id, course_offering=self.request.course_offering)
+        student = get_object_or_404(LMSUser.objects.for_offering(self.request.course_offering), pk=student_id)
 
         initial_data = {
             'course_id': self.request.course_offering.id,
@@ -2,17 +2,27 @@ from functools import wraps
 
 from django.http.response import HttpResponseForbidden
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 
 from dashboard.models import CourseOffering
 
 
-# This wrapper applies course ownership rules to the wrapped URLs
-def course_access_url_wrapper(view_func):
+# This wrapper applies course ownership rules to the wrapped URLs.  Given etag_func and/or last_modified_func (called
+# with the request, once request.course_offering is set, and the view's arguments), it also answers conditional GETs
+# with 304 Not Modified before the view runs, and has browsers revalidate its responses each time they're used.
+def course_access_url_wrapper(view_func, etag_func=None, last_modified_func=None):
+    if etag_func or last_modified_func:
+        view_func = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view_func)
+
     @wraps(view_func)
     def course_access_func(request, course_id, *args, **kwargs):
         request.course_offering = get_object_or_404(CourseOffering, pk=course_id)
         if request.user.has_perm('dashboard.is_course_offering_owner', request.course_offering):
-            return view_func(request, *args, **kwargs)
+            response = view_func(request, *args, **kwargs)
+            if etag_func or last_modified_func:
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
         else:
             return HttpResponseForbidden("You don't have access to this course.")
 
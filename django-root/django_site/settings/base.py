@@ -467,6 +467,13 @@ LOGGING = {
             'propagate': False,
         },
 
+        # loads and size of the OLAP views' visit cache in each process
+        'olap.visit_cache': {
+            'handlers': ['file_debug'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+
         # todo: what is this used for?
         'net': {
             'handlers': [
@@ -577,6 +584,33 @@ CELERY_BEAT_SCHEDULE = {
 
 CLOOP_IMPORT_ADMINS = []
 CLOOP_IMPORT_ERRORS_SAMPLE_SIZE = 100
+# Number of processes that parse activity files during an import.  None starts one per CPU; 0 parses in the importing
+# process.  (Processes of Celery's default prefork pool can't start others, so run the import worker with --pool=solo.)
+CLOOP_IMPORT_PARSE_WORKERS = None
+# Import activity a chunk at a time as pandas DataFrames, rather than row by row.  (See the benchmark_activity_import
+# management command to compare the two on an import file.)
+CLOOP_IMPORT_COLUMNAR_ACTIVITY = False
+# Bytes read at a time from import files (and each file within them)
+CLOOP_IMPORT_READ_BUFFER_SIZE = 1024 * 1024
+# Files within an import file up to this size (uncompressed, in bytes) are read into memory once, rather than streamed
+CLOOP_IMPORT_MEMORY_MEMBER_SIZE = 64 * 1024 * 1024
+# Load posts, submission attempts and visits into MySQL with LOAD DATA LOCAL INFILE rather than batched INSERTs.  This
+# needs local_infile enabled on the server, and DATABASES['default']['OPTIONS']['local_infile'] = 1.
+CLOOP_IMPORT_LOAD_DATA = False
+# Bytes of page visits each web process keeps as numpy arrays for the OLAP views (see olap.visit_cache)
+CLOOP_OLAP_VISIT_CACHE_BYTES = 256 * 1024 * 1024
+# Directory the importer writes snapshots of offerings' activity to, for web processes to share (see olap.snapshots).
+# None leaves each process loading the activity from the database.
+DATA_SNAPSHOT_DIR = None
+# The cache (an alias in CACHES) that the OLAP views' responses are kept in, and for how many seconds (see
+# olap.response_cache).  None doesn't cache them.  It must be shared by the web processes (eg. memcached or redis), so
+# a local memory cache is refused.
+CLOOP_OLAP_RESPONSE_CACHE = None
+CLOOP_OLAP_RESPONSE_CACHE_TIMEOUT = 24 * 60 * 60
+# Whether an offering's OLAP responses are computed after an import, to warm the response cache (see olap.warming), and
+# how many at a time.  Only done if CLOOP_OLAP_RESPONSE_CACHE is set.
+CLOOP_OLAP_WARM_RESPONSES = False
+CLOOP_OLAP_WARM_CONCURRENCY = 4
 
 RESOURCE_NUM_HISTOGRAM_BINS = 10
 COURSE_WEEK_NUM_HISTOGRAM_BINS = 10
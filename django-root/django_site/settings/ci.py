@@ -40,6 +40,10 @@ TESTING = True
 # _db_options = DATABASES['default']['OPTIONS']
 # _db_options['init_command'] = _db_options['init_command'].replace('storage_engine', 'default_storage_engine')
 
+# For the importer's LOAD DATA LOCAL INFILE tests; the server must have local_infile enabled too
+if _strtobool(get_env_setting('DB_LOCAL_INFILE', '0')):
+    DATABASES['default']['OPTIONS']['local_infile'] = 1
+
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Logging
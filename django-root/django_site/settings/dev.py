@@ -143,6 +143,7 @@ CELERY_TASK_EAGER_PROPAGATES = True
 DATA_IMPORT_DIR = _Path(PROJECT_DIR, 'data_imports')
 DATA_PROCESSING_DIR = _Path(PROJECT_DIR, 'data')
 DATA_ERROR_LOGS_DIR = _Path(PROJECT_DIR, 'import_errors')
+DATA_SNAPSHOT_DIR = _Path(PROJECT_DIR, 'snapshots')
 
 CLOOP_IMPORT_ADMINS = ['dev@localhost']
 
@@ -22,6 +22,7 @@ BODY_ENV_CLASS = 'env-staging'
 DATA_IMPORT_DIR = _Path(get_env_setting('DATA_IMPORT_DIR'))
 DATA_PROCESSING_DIR = _Path(get_env_setting('DATA_PROCESSING_DIR'))
 DATA_ERROR_LOGS_DIR = _Path(get_env_setting('DATA_ERROR_LOGS_DIR'))
+DATA_SNAPSHOT_DIR = get_env_setting('DATA_SNAPSHOT_DIR', '') or None
 
 
 # ----------------------------------------------------------------------------------------------------------------------
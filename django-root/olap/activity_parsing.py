@@ -0,0 +1,253 @@
+"""
+    Parsing and validation of LMS activity rows, separate from resolving them against the database
+
+    Nothing here touches the database, so chunks of an activity file can be parsed in worker processes while the
+    importer writes the chunks parsed before them.  A chunk is parsed either row by row into a ParsedActivity, or into
+    a pandas DataFrame for the importer's columnar mode.
+"""
+from array import array
+from collections import namedtuple
+import csv
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+import io
+import re
+
+from django.utils import dateparse
+from django.utils import timezone
+import numpy as np
+import pandas as pd
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+ONE_MICROSECOND = timedelta(microseconds=1)
+MICROSECONDS_PER_SECOND = 1000000
+
+# The status of an activity timestamp, from check_timestamp
+TIMESTAMP_VALID = 0
+TIMESTAMP_OUTSIDE_OFFERING = 1  # Parsed, but outside the course offering's start/end
+TIMESTAMP_INVALID_FORMAT = 2
+TIMESTAMP_INVALID_DATETIME = 3
+
+
+def to_epoch_microseconds(value):
+    """
+    Returns the number of microseconds between the epoch and the aware datetime value
+    """
+    return (value - EPOCH) // ONE_MICROSECOND
+
+
+def from_epoch_microseconds(microseconds):
+    return EPOCH + timedelta(microseconds=microseconds)
+
+
+class TimestampParser(object):
+    """
+    Parses timestamps into microseconds since the epoch.
+
+    Blackboard exports timestamps as YYYY-MM-DD(T| )HH:MM:SS[.ffffff](Z|+HH:MM|-HH:MM).  These are taken apart by
+    slicing, and each part is looked up by its text: the date and the fraction and UTC offset suffix in caches, the time
+    of day in tables.  So a timestamp mostly costs a few dict lookups.  Other timestamps are left to
+    dateparse.parse_datetime.  Like parse_datetime, parse returns None for a timestamp in an unknown format, and raises
+    ValueError for a well formatted but invalid one.
+    """
+    TIMESTAMP_RE = re.compile(
+        r'(?P<year>\d{4})-(?P<month>\d{2})-(?P<day>\d{2})[T ](?P<hour>\d{2}):(?P<minute>\d{2}):(?P<second>\d{2})'
+        r'(?:\.(?P<microsecond>\d{6}))?(?P<offset>Z|(?P<sign>[+-])(?P<offset_hours>\d{2})(?::?(?P<offset_minutes>\d{2}))?)$'
+    )
+    # Microseconds since midnight by 'THH:MM:' (or ' HH:MM:'), and by 'SS'
+    MINUTES = {
+        '{}{:02d}:{:02d}:'.format(separator, hour, minute): (hour * 60 + minute) * 60 * MICROSECONDS_PER_SECOND
+        for separator in 'T ' for hour in range(24) for minute in range(60)
+    }
+    SECONDS = {'{:02d}'.format(second): second * MICROSECONDS_PER_SECOND for second in range(60)}
+    # A cache is emptied once it holds this many entries
+    MAX_CACHE_SIZE = 100000
+
+    def __init__(self):
+        # Microseconds since the epoch of the start of each day, keyed by 'YYYY-MM-DD'
+        self._days = {}
+        # Microseconds to add for each fraction and UTC offset, keyed by eg. '.000000+11:00'
+        self._suffixes = {}
+
+    def parse(self, timestamp):
+        try:
+            return self._days[timestamp[:10]] + self.MINUTES[timestamp[10:17]] + self.SECONDS[timestamp[17:19]] + self._suffixes[timestamp[19:]]
+        except KeyError:
+            return self._parse_uncached(timestamp)
+
+    def _parse_uncached(self, timestamp):
+        match = self.TIMESTAMP_RE.match(timestamp)
+        if match is None:
+            value = dateparse.parse_datetime(timestamp)
+            return None if value is None else to_epoch_microseconds(value)
+
+        fields = match.groupdict()
+        hour, minute, second = int(fields['hour']), int(fields['minute']), int(fields['second'])
+        offset_minutes = 0 if fields['offset'] == 'Z' else int(fields['offset_hours']) * 60 + int(fields['offset_minutes'] or 0)
+        # Invalid values raise ValueError, as they do for parse_datetime
+        day = date(int(fields['year']), int(fields['month']), int(fields['day']))
+        if hour > 23 or minute > 59 or second > 59 or offset_minutes >= 24 * 60:
+            raise ValueError('Timestamp {} is out of range'.format(timestamp))
+
+        day_start = (day - EPOCH.date()).days * 24 * 60 * 60 * MICROSECONDS_PER_SECOND
+        if fields['sign'] == '-':
+            offset_minutes = -offset_minutes
+        suffix = int(fields['microsecond'] or 0) - offset_minutes * 60 * MICROSECONDS_PER_SECOND
+        self._cache(self._days, timestamp[:10], day_start)
+        self._cache(self._suffixes, timestamp[19:], suffix)
+        return day_start + ((hour * 60 + minute) * 60 + second) * MICROSECONDS_PER_SECOND + suffix
+
+    def _cache(self, cache, key, value):
+        if len(cache) >= self.MAX_CACHE_SIZE:
+            cache.clear()
+        cache[key] = value
+
+
+# Kept for the life of the process, so a worker parsing several chunks reuses its caches
+parse_timestamp = TimestampParser().parse
+
+
+def check_timestamp(timestamp, window):
+    """
+    Returns a (TIMESTAMP_* status, microseconds since the epoch) tuple for timestamp, checking it against window, a
+    (start, end) tuple of the course offering's bounds in microseconds since the epoch.  The time is 0 if the timestamp
+    couldn't be parsed.
+    """
+    try:
+        activity_time = parse_timestamp(timestamp)
+    except ValueError:
+        return TIMESTAMP_INVALID_DATETIME, 0
+    if activity_time is None:
+        return TIMESTAMP_INVALID_FORMAT, 0
+    if activity_time < window[0] or activity_time > window[1]:
+        return TIMESTAMP_OUTSIDE_OFFERING, activity_time
+    return TIMESTAMP_VALID, activity_time
+
+
+def _column_number(digits, first, last):
+    # The numbers written in columns first to last of a matrix of digits
+    return digits[:, first:last].astype(np.int64).dot(10 ** np.arange(last - first - 1, -1, -1))
+
+
+def check_timestamp_column(timestamps, window):
+    """
+    check_timestamp for a Series of timestamps, as (statuses, times) numpy arrays.
+
+    Timestamps laid out as Blackboard exports them (YYYY-MM-DD(T| )HH:MM:SS[.ffffff](Z|+HH:MM|-HH:MM)) are checked
+    with array arithmetic on a matrix of their characters' code points.  The rest, and any with out of range parts,
+    are checked one at a time with check_timestamp, so the results are the same as it gives.
+    """
+    count = len(timestamps)
+    statuses = np.full(count, TIMESTAMP_VALID, dtype=np.int8)
+    times = np.zeros(count, dtype=np.int64)
+    if not count:
+        return statuses, times
+
+    # One column more than the longest layout, so longer timestamps don't pass for it once truncated
+    chars = np.array(timestamps.tolist(), dtype='U33').view(np.uint32).reshape(count, 33)
+    # Unsigned, so characters before '0' wrap around to large numbers too
+    digits = chars - np.uint32(ord('0'))
+    is_digit = digits < 10
+    rows = np.arange(count)[:, None]
+
+    has_fraction = chars[:, 19] == ord('.')
+    suffix_start = np.where(has_fraction, 26, 19)
+    # Z or an offset, then the end of the timestamp, moved to the start of their own arrays
+    suffix_columns = suffix_start[:, None] + np.arange(7)
+    suffix_chars = chars[rows, suffix_columns]
+    suffix_digits = digits[rows, suffix_columns]
+    is_utc = (suffix_chars[:, 0] == ord('Z')) & (suffix_chars[:, 1] == 0)
+    is_offset = (
+        ((suffix_chars[:, 0] == ord('+')) | (suffix_chars[:, 0] == ord('-'))) & (suffix_chars[:, 3] == ord(':')) & (suffix_chars[:, 6] == 0)
+        & is_digit[rows, suffix_columns[:, [1, 2, 4, 5]]].all(axis=1)
+    )
+    well_formed = (
+        is_digit[:, [0, 1, 2, 3, 5, 6, 8, 9, 11, 12, 14, 15, 17, 18]].all(axis=1)
+        & (chars[:, 4] == ord('-')) & (chars[:, 7] == ord('-')) & ((chars[:, 10] == ord('T')) | (chars[:, 10] == ord(' ')))
+        & (chars[:, 13] == ord(':')) & (chars[:, 16] == ord(':'))
+        & (~has_fraction | is_digit[:, 20:26].all(axis=1)) & (is_utc | is_offset)
+    )
+
+    year, month, day = _column_number(digits, 0, 4), _column_number(digits, 5, 7), _column_number(digits, 8, 10)
+    hour, minute, second = _column_number(digits, 11, 13), _column_number(digits, 14, 16), _column_number(digits, 17, 19)
+    offset_minutes = np.where(is_utc, 0, _column_number(suffix_digits, 1, 3) * 60 + _column_number(suffix_digits, 4, 6))
+    valid_month = well_formed & (year >= 1) & (month >= 1) & (month <= 12)
+    months = np.where(valid_month, (year - 1970) * 12 + month - 1, 0).astype('datetime64[M]')
+    month_days = ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+    vectorised = np.flatnonzero(
+        valid_month & (day >= 1) & (day <= month_days) & (hour < 24) & (minute < 60) & (second < 60) & (offset_minutes < 24 * 60)
+    )
+
+    epoch_days = months.astype('datetime64[D]').astype(np.int64)[vectorised] + day[vectorised] - 1
+    offset_minutes = np.where(suffix_chars[vectorised, 0] == ord('-'), -offset_minutes[vectorised], offset_minutes[vectorised])
+    microseconds = np.where(has_fraction[vectorised], _column_number(digits[vectorised], 20, 26), 0)
+    times[vectorised] = (
+        (((epoch_days * 24 + hour[vectorised]) * 60 + minute[vectorised] - offset_minutes) * 60 + second[vectorised]) * MICROSECONDS_PER_SECOND
+        + microseconds
+    )
+    outside = (times[vectorised] < window[0]) | (times[vectorised] > window[1])
+    statuses[vectorised[outside]] = TIMESTAMP_OUTSIDE_OFFERING
+
+    others = np.ones(count, dtype=bool)
+    others[vectorised] = False
+    for index in np.flatnonzero(others):
+        statuses[index], times[index] = check_timestamp(timestamps.iat[index], window)
+    return statuses, times
+
+
+class ParsedActivity(namedtuple('ParsedActivity', ['user_keys', 'content_keys', 'forum_keys', 'visit_times', 'timestamp_statuses', 'bad_timestamps'])):
+    """
+    Activity rows, held column by column.  The keys are kept as read.  visit_times is an array of the visit times in
+    microseconds since the epoch, and timestamp_statuses an array of the TIMESTAMP_* status of each row's timestamp.
+    The timestamps of rows whose status isn't TIMESTAMP_VALID are kept as read in bad_timestamps, by row index, for
+    error messages.
+    """
+    __slots__ = ()
+
+    def rows(self):
+        """
+        Returns an iterator of (user_key, content_key, forum_key, visit_time, timestamp_status) tuples
+        """
+        return zip(self.user_keys, self.content_keys, self.forum_keys, self.visit_times, self.timestamp_statuses)
+
+
+def parse_activity_rows(rows, window):
+    """
+    Parses the timestamps of activity rows (dicts, as read by csv.DictReader) and checks them against window, a
+    (start, end) tuple of the course offering's bounds in microseconds since the epoch.  Returns a ParsedActivity.
+    """
+    parsed = ParsedActivity([], [], [], array('q'), array('b'), {})
+    for index, row in enumerate(rows):
+        parsed.user_keys.append(row['user_key'])
+        parsed.content_keys.append(row['content_key'])
+        parsed.forum_keys.append(row['forum_key'])
+
+        status, visit_time = check_timestamp(row['timestamp'], window)
+        parsed.visit_times.append(visit_time)
+        parsed.timestamp_statuses.append(status)
+        if status != TIMESTAMP_VALID:
+            parsed.bad_timestamps[index] = row['timestamp']
+    return parsed
+
+
+def parse_activity_chunk(chunk, fieldnames, window):
+    """
+    Parses chunk, UTF-8 encoded lines of a '|' delimited activity file with the given fieldnames, with
+    parse_activity_rows.  Suits a worker process: the arguments and the result are all picklable.
+    """
+    rows = csv.DictReader(io.StringIO(chunk.decode('UTF-8'), newline=''), fieldnames=fieldnames, delimiter='|')
+    return parse_activity_rows(rows, window)
+
+
+def parse_activity_frame(chunk, fieldnames, window):
+    """
+    As parse_activity_chunk, but returns a DataFrame, with the user_key, content_key, forum_key and timestamp columns
+    as read, and the visit_time and timestamp_status of each row from check_timestamp_column.
+    """
+    activity = pd.read_csv(
+        io.BytesIO(chunk), sep='|', names=fieldnames, usecols=['user_key', 'content_key', 'forum_key', 'timestamp'],
+        header=None, dtype=str, keep_default_na=False, encoding='UTF-8',
+    )
+    activity['timestamp_status'], activity['visit_time'] = check_timestamp_column(activity['timestamp'], window)
+    return activity
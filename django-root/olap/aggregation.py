@@ -0,0 +1,99 @@
+"""
+    Aggregation of LMS activity for the OLAP views
+
+    The pageset and studentset views tabulate visits, posts or attempts by page or student and by course week.  These
+    helpers count them with a fixed number of GROUP BY queries, rather than queries per page or student, read the
+    counts from the summaries kept by olap.cubes, or count the visits cached by olap.visit_cache.
+"""
+from decimal import Decimal
+
+from django.db.models import Count
+from django.db.models import Sum
+import numpy as np
+
+from olap.visit_cache import count_distinct
+
+
+def count_by_bin(rows, events, dimension, no_bins, bin_field='course_week', measure=None):
+    """
+    Counts events (a PageVisit, SummaryPost or SubmissionAttempt queryset) for each of rows (dicts, or a values()
+    queryset, with the 'id' of a Page or LMSUser) in each bin, with one query grouped by dimension ('page' or
+    'lms_user') and bin_field.  Bins run from 0 to no_bins - 1; events in other bins count towards the totals but not
+    the bins, and events of anything not in rows are ignored.
+
+    With measure, events is instead a cube (eg. PageActivityByWeek; see olap.cubes), and its measure field (eg.
+    'visits') is summed.
+
+    Each row is given its counts by bin as 'weeks', their sum as 'total' and its 'percent' of the total.  Returns the
+    totals by bin followed by the total, as the totals_by_week of CoursePagesetAndTotalsSerializer and
+    StudentsetAndTotalsSerializer.
+    """
+    counts_by_row = {row['id']: [0] * no_bins for row in rows}
+    totals_by_bin = [0] * no_bins
+    total = 0
+    aggregate = Count('id') if measure is None else Sum(measure)
+    grouped_counts = events.values_list(dimension, bin_field).annotate(count=aggregate).order_by()
+    for row_id, bin_number, count in grouped_counts:
+        counts = counts_by_row.get(row_id)
+        if counts is None:
+            continue
+        total += count
+        if 0 <= bin_number < no_bins:
+            counts[bin_number] += count
+            totals_by_bin[bin_number] += count
+
+    for row in rows:
+        row['weeks'] = counts_by_row[row['id']]
+        row['total'] = sum(row['weeks'])
+    _set_percents(rows, total)
+    totals_by_bin.append(total)
+    return totals_by_bin
+
+
+def count_distinct_users_by_bin(rows, visits, no_bins):
+    """
+    As count_by_bin, but counts the distinct students to visit each of rows (dicts of pages with an 'id') in each
+    course week, from visits (the olap.visit_cache.OfferingVisits of their offering).  Only visits in weeks 0 to
+    no_bins - 1 are counted, so each row's total, and the total after the totals by bin, are the distinct students
+    across its weeks.
+    """
+    row_ids = [row['id'] for row in rows]
+    visit_rows = visits.page_positions(row_ids)[visits.page_index]
+    counted = (visit_rows >= 0) & (visits.course_week >= 0) & (visits.course_week < no_bins)
+    visit_rows = visit_rows[counted]
+    bins = visits.course_week[counted].astype(np.int64)
+    users = visits.user_index[counted]
+
+    counts_by_row = count_distinct(visit_rows * no_bins + bins, users, len(row_ids) * no_bins).reshape(-1, no_bins)
+    row_totals = count_distinct(visit_rows, users, len(row_ids))
+    totals_by_bin = count_distinct(bins, users, no_bins).tolist()
+    total = len(np.unique(users))
+
+    for row, row_counts, row_total in zip(rows, counts_by_row.tolist(), row_totals.tolist()):
+        row['weeks'] = row_counts
+        row['total'] = row_total
+    _set_percents(rows, total)
+    totals_by_bin.append(total)
+    return totals_by_bin
+
+
+def _set_percents(rows, total):
+    for row in rows:
+        row['percent'] = Decimal(row['total'] * 100 / total) if total else 0
+
+
+def split_by_weekday(rows, weekday_counts, no_bins, day_of_week, bin_field='course_week'):
+    """
+    Splits the visits of each of rows (dicts with an 'id') in each bin into those before day_of_week (Monday is 0) and
+    those on or after it, from weekday_counts (a PageVisitsByWeekday or LMSUserVisitsByWeekday queryset).  Returns a
+    dict of [[before, after] for each bin from 0 to no_bins - 1] by row id.
+    """
+    pairs_by_row = {row['id']: [[0, 0] for i in range(no_bins)] for row in rows}
+    counts = weekday_counts.filter(**{'{}__range'.format(bin_field): (0, no_bins - 1)}).values_list(
+        weekday_counts.model.dimension, bin_field, 'local_weekday', 'visits',
+    )
+    for row_id, bin_number, weekday, visits in counts:
+        pairs = pairs_by_row.get(row_id)
+        if pairs is not None:
+            pairs[bin_number][0 if weekday < day_of_week else 1] += visits
+    return pairs_by_row
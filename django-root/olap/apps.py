@@ -3,3 +3,9 @@ from django.apps import AppConfig
 
 class OlapConfig(AppConfig):
     name = 'olap'
+
+    def ready(self):
+        # Connects the signals that record changes to offerings' events
+        from olap.response_cache import get_response_cache
+        # Refuses a cache that isn't shared now, rather than on the first request
+        get_response_cache()
@@ -0,0 +1,265 @@
+"""
+    Bulk database helpers used by the LMS importer
+
+    Django 1.11 has no QuerySet.bulk_update, so these build the batched statements themselves.
+"""
+import itertools
+import tempfile
+
+from django.db import connection
+from django.db.models import Case
+from django.db.models import ForeignKey
+from django.db.models import Value
+from django.db.models import When
+
+BULK_UPDATE_BATCH_SIZE = 500
+BULK_ASSIGN_BATCH_SIZE = 5000
+BULK_INSERT_BATCH_SIZE = 1000
+
+# Characters escaped in a LOAD DATA file (with its default FIELDS ESCAPED BY '\\')
+LOAD_DATA_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\0': '\\0'})
+
+# INSERT statement that skips rows clashing with a unique constraint, by database vendor
+INSERT_IGNORE_SQL = {
+    'mysql': 'INSERT IGNORE INTO {table} ({columns}) VALUES {values}',
+    'sqlite': 'INSERT OR IGNORE INTO {table} ({columns}) VALUES {values}',
+    'postgresql': 'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT DO NOTHING',
+}
+
+
+def _max_batch_size(params_per_obj, batch_size):
+    # Keep within the bound parameter limit of the backend (this only bites on sqlite)
+    return max(1, min(batch_size, connection.ops.bulk_batch_size([None] * params_per_obj, [None] * batch_size)))
+
+
+def bulk_create_batch_size(model, batch_size):
+    """
+    Returns batch_size capped to what the backend can insert in one statement.  (An explicit batch_size given to
+    QuerySet.bulk_create overrides the backend's own limit.)
+    """
+    return _max_batch_size(len(model._meta.concrete_fields), batch_size)
+
+
+def bulk_insert_ignore(model, objs, batch_size=BULK_INSERT_BATCH_SIZE, load_data=False):
+    """
+    Inserts objs, skipping any that duplicate another of objs or a row already in the table, going by the model's
+    first unique_together constraint.  Duplicates within a batch are removed in memory; clashes with existing rows are
+    left to the database's insert-ignore support.  Returns a (inserted, duplicates) tuple of row counts.
+
+    On MySQL, INSERT IGNORE also turns other errors (eg. bad foreign keys) into warnings, so objs should already be
+    valid.  Unlike bulk_create, the objects' pks are not set.  If load_data, objs are loaded with bulk_load_ignore_values
+    where the database supports it.
+    """
+    fields = [field for field in model._meta.concrete_fields if not field.auto_created]
+    rows = ([field.pre_save(obj, True) for field in fields] for obj in objs)
+    return bulk_insert_ignore_values(model, [field.attname for field in fields], rows, batch_size, load_data=load_data)
+
+
+def bulk_insert_ignore_values(model, field_names, rows, batch_size=BULK_INSERT_BATCH_SIZE, prepared=False, load_data=False):
+    """
+    As bulk_insert_ignore, but for rows of values for field_names (names or attnames) rather than model instances.
+    The model's other fields are given their defaults.  field_names must include the fields of the model's first
+    unique_together constraint.  If prepared, the values are already as the database takes them (as returned by
+    Field.get_db_prep_save), so aren't converted again.  If load_data and the database is MySQL, the rows are loaded
+    with bulk_load_ignore_values instead of being inserted in batches.
+    """
+    if load_data and connection.vendor == 'mysql':
+        return bulk_load_ignore_values(model, field_names, rows, prepared=prepared)
+
+    qn = connection.ops.quote_name
+    opts = model._meta
+    given_fields = [opts.get_field(field_name) for field_name in field_names]
+    default_fields = [field for field in opts.concrete_fields if not field.auto_created and field not in given_fields]
+    default_values = [field.get_db_prep_save(field.get_default(), connection=connection) for field in default_fields]
+    fields = given_fields + default_fields
+    unique_indexes = [given_fields.index(opts.get_field(field_name)) for field_name in opts.unique_together[0]]
+    batch_size = _max_batch_size(len(fields), batch_size)
+    sql = INSERT_IGNORE_SQL[connection.vendor].format(
+        table=qn(opts.db_table),
+        columns=', '.join(qn(field.column) for field in fields),
+        values='{values}',
+    )
+    row_placeholders = '({})'.format(', '.join(['%s'] * len(fields)))
+
+    if not prepared:
+        rows = ([field.get_db_prep_save(value, connection=connection) for field, value in zip(given_fields, row)] for row in rows)
+    rows = list(rows)
+    inserted = 0
+    duplicates = 0
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = {}
+            for row in rows[start:start + batch_size]:
+                batch.setdefault(tuple(row[index] for index in unique_indexes), row)
+            params = [value for row in batch.values() for value in itertools.chain(row, default_values)]
+            cursor.execute(sql.format(values=', '.join([row_placeholders] * len(batch))), params)
+            inserted += cursor.rowcount
+            duplicates += min(len(rows) - start, batch_size) - cursor.rowcount
+    return inserted, duplicates
+
+
+def bulk_load_ignore_values(model, field_names, rows, prepared=False):
+    """
+    As bulk_insert_ignore_values, but for MySQL only, and much faster for many rows: they are written to a temporary
+    tab separated file, loaded into a staging table with LOAD DATA LOCAL INFILE, and then copied into the model's table
+    with one INSERT IGNORE ... SELECT.  Needs local_infile enabled on the server, and 'local_infile': 1 in the
+    database's OPTIONS.  Returns a (inserted, duplicates) tuple of row counts.
+    """
+    qn = connection.ops.quote_name
+    opts = model._meta
+    given_fields = [opts.get_field(field_name) for field_name in field_names]
+    default_fields = [field for field in opts.concrete_fields if not field.auto_created and field not in given_fields]
+    default_values = [field.get_db_prep_save(field.get_default(), connection=connection) for field in default_fields]
+    table = qn(opts.db_table)
+    staging_table = qn('{}_load'.format(opts.db_table))
+    given_columns = ', '.join(qn(field.column) for field in given_fields)
+
+    if not prepared:
+        rows = ([field.get_db_prep_save(value, connection=connection) for field, value in zip(given_fields, row)] for row in rows)
+    with tempfile.NamedTemporaryFile('w', encoding='UTF-8', newline='', suffix='.tsv') as rows_file:
+        loaded = 0
+        for row in rows:
+            rows_file.write(load_data_line(row))
+            loaded += 1
+        rows_file.flush()
+        if not loaded:
+            return 0, 0
+
+        with connection.cursor() as cursor:
+            # A staging table without the indexes (CREATE TEMPORARY TABLE doesn't implicitly commit)
+            cursor.execute('CREATE TEMPORARY TABLE {} SELECT {} FROM {} LIMIT 0'.format(staging_table, given_columns, table))
+            try:
+                cursor.execute(
+                    "LOAD DATA LOCAL INFILE %s INTO TABLE {} CHARACTER SET utf8mb4 "
+                    "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({})".format(staging_table, given_columns),
+                    [rows_file.name],
+                )
+                cursor.execute('INSERT IGNORE INTO {table} ({columns}) SELECT {given_columns}{defaults} FROM {staging}'.format(
+                    table=table,
+                    columns=', '.join(qn(field.column) for field in given_fields + default_fields),
+                    given_columns=given_columns,
+                    defaults=''.join(', %s' for _ in default_fields),
+                    staging=staging_table,
+                ), default_values)
+                inserted = cursor.rowcount
+            finally:
+                cursor.execute('DROP TEMPORARY TABLE {}'.format(staging_table))
+    return inserted, loaded - inserted
+
+
+def bulk_insert_select(model, field_names, queryset):
+    """
+    Inserts the rows of queryset (a values_list queryset, whose columns are the values of field_names in order) with
+    one INSERT ... SELECT, so they are never fetched.  Returns the number of rows inserted.
+    """
+    qn = connection.ops.quote_name
+    opts = model._meta
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute('INSERT INTO {} ({}) {}'.format(
+            qn(opts.db_table),
+            ', '.join(qn(opts.get_field(field_name).column) for field_name in field_names),
+            sql,
+        ), params)
+        return cursor.rowcount
+
+
+def load_data_line(values):
+    """
+    Returns a line of a LOAD DATA file (with its default tab separated format) for values, as returned by
+    Field.get_db_prep_save
+    """
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append('\\N')
+        else:
+            if isinstance(value, bool):
+                value = int(value)
+            fields.append(str(value).translate(LOAD_DATA_ESCAPES))
+    return '\t'.join(fields) + '\n'
+
+
+def bulk_update(model, objs, field_names, batch_size=BULK_UPDATE_BATCH_SIZE):
+    """
+    Saves field_names for each of objs, using one UPDATE ... SET field = CASE pk WHEN ... statement per batch.
+    Returns the number of rows updated.
+    """
+    objs = list(objs)
+    fields = [model._meta.get_field(field_name) for field_name in field_names]
+    batch_size = _max_batch_size(2 * len(fields) + 1, batch_size)
+    updated = 0
+    for start in range(0, len(objs), batch_size):
+        batch = objs[start:start + batch_size]
+        updates = {}
+        for field in fields:
+            output_field = field.target_field if isinstance(field, ForeignKey) else field
+            whens = [When(pk=obj.pk, then=Value(getattr(obj, field.attname))) for obj in batch]
+            updates[field.attname] = Case(*whens, output_field=output_field)
+        updated += model.objects.filter(pk__in=[obj.pk for obj in batch]).update(**updates)
+    return updated
+
+
+def bulk_assign(model, field_name, pks_by_value, batch_size=BULK_ASSIGN_BATCH_SIZE):
+    """
+    Sets field_name to each value of pks_by_value on the rows whose pks are listed against it.
+    Rows are updated with one UPDATE ... SET field = CASE WHEN pk IN (...) statement per batch of batch_size pks.
+    Returns the number of rows updated.
+    """
+    field = model._meta.get_field(field_name)
+    output_field = field.target_field if isinstance(field, ForeignKey) else field
+    # Each pk is bound twice (in the CASE and the WHERE), and each value once
+    batch_size = _max_batch_size(3, batch_size)
+    updated = 0
+    whens = []
+    batch_pks = []
+
+    def flush():
+        return model.objects.filter(pk__in=batch_pks).update(**{field.attname: Case(*whens, output_field=output_field)})
+
+    for value, pks in pks_by_value.items():
+        pks = list(pks)
+        for start in range(0, len(pks), batch_size):
+            group = pks[start:start + batch_size]
+            if len(batch_pks) + len(group) > batch_size:
+                updated += flush()
+                whens = []
+                batch_pks = []
+            whens.append(When(pk__in=group, then=Value(value)))
+            batch_pks.extend(group)
+    if batch_pks:
+        updated += flush()
+    return updated
+
+
+def bulk_assign_by_pk(model, field_name, pks, values, batch_size=BULK_ASSIGN_BATCH_SIZE):
+    """
+    Sets field_name to values[i] on the row whose pk is pks[i].  Suits many distinct values, where bulk_assign's CASE
+    would grow too long: the pairs are loaded into a temporary table, then every row is updated with one joined UPDATE.
+    Returns the number of rows updated.
+    """
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    pk_column = qn(model._meta.pk.column)
+    column = qn(model._meta.get_field(field_name).column)
+    staging_table = qn('{}_assign_{}'.format(model._meta.db_table, field_name))
+
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE {} (pk BIGINT PRIMARY KEY, value BIGINT)'.format(staging_table))
+        try:
+            pairs = list(zip(pks, values))
+            for start in range(0, len(pairs), batch_size):
+                cursor.executemany('INSERT INTO {} (pk, value) VALUES (%s, %s)'.format(staging_table), pairs[start:start + batch_size])
+
+            if connection.vendor == 'mysql':
+                cursor.execute('UPDATE {table} INNER JOIN {staging} ON {table}.{pk} = {staging}.pk SET {table}.{column} = {staging}.value'.format(
+                    table=table, staging=staging_table, pk=pk_column, column=column,
+                ))
+            else:
+                cursor.execute('UPDATE {table} SET {column} = (SELECT value FROM {staging} WHERE {staging}.pk = {table}.{pk}) WHERE {pk} IN (SELECT pk FROM {staging})'.format(
+                    table=table, staging=staging_table, pk=pk_column, column=column,
+                ))
+            return cursor.rowcount
+        finally:
+            # A plain DROP TABLE would implicitly commit on MySQL
+            cursor.execute('DROP {}TABLE {}'.format('TEMPORARY ' if connection.vendor == 'mysql' else '', staging_table))
@@ -0,0 +1,72 @@
+"""
+    Summaries of LMS activity kept alongside it
+
+    The summaries are cubes of counts of the activity in each of their cells (eg. by page, course week and weekday),
+    stored when an import finishes so that views can read them instead of the activity.
+"""
+from django.db.models import Count
+
+from olap.bulk import bulk_create_batch_size
+from olap.bulk import BULK_INSERT_BATCH_SIZE
+from olap.bulk import bulk_insert_select
+from olap.models import LMSUserActivityByWeek
+from olap.models import LMSUserVisitsByWeekday
+from olap.models import PageActivityByWeek
+from olap.models import PageVisit
+from olap.models import PageVisitsByWeekday
+from olap.models import SubmissionAttempt
+from olap.models import SummaryPost
+from olap.time_dimensions import time_dimensions
+
+WEEKDAY_CUBES = (PageVisitsByWeekday, LMSUserVisitsByWeekday)
+
+# The fields of each week cube, as the activity they're counted from and how
+WEEK_CUBE_COUNTS = {
+    PageActivityByWeek: (
+        (PageVisit, {'visits': Count('id'), 'users': Count('lms_user', distinct=True)}),
+        (SummaryPost, {'posts': Count('id')}),
+        (SubmissionAttempt, {'attempts': Count('id')}),
+    ),
+    LMSUserActivityByWeek: (
+        (PageVisit, {'visits': Count('id')}),
+        (SummaryPost, {'posts': Count('id')}),
+        (SubmissionAttempt, {'attempts': Count('id')}),
+    ),
+}
+
+CUBES = WEEKDAY_CUBES + tuple(WEEK_CUBE_COUNTS)
+
+
+def update_cubes(course_offering, data_version=None, since=None):
+    """
+    Summarises the activity in the given version of course_offering's data (by default the published version) into
+    CUBES.  With since, only activity after since is new (as in a delta import), so only the weeks from since's are
+    summarised again; otherwise the cubes are rebuilt.
+    """
+    if data_version is None:
+        data_version = course_offering.data_version
+    from_week = None if since is None else time_dimensions(course_offering, since)['course_week']
+
+    def for_update(queryset):
+        queryset = queryset.for_offering(course_offering, data_version)
+        return queryset if from_week is None else queryset.filter(course_week__gte=from_week)
+
+    for model in WEEKDAY_CUBES:
+        for_update(model.objects).delete()
+        # The visits are counted with an INSERT ... SELECT, so they are never fetched
+        field_names = ['course_offering', 'data_version', model.dimension, 'course_week', 'local_weekday']
+        visits = for_update(PageVisit.objects).values_list(*field_names).annotate(visits=Count('id')).order_by()
+        bulk_insert_select(model, field_names + ['visits'], visits)
+
+    for model, activity_counts in WEEK_CUBE_COUNTS.items():
+        # There are few enough cells to merge the counts of each kind of activity in memory
+        cells = {}
+        for activity_model, counts in activity_counts:
+            for cell_counts in for_update(activity_model.objects).values(model.dimension, 'course_week').annotate(**counts).order_by():
+                key = (cell_counts.pop(model.dimension), cell_counts.pop('course_week'))
+                if key not in cells:
+                    cells[key] = model(course_offering=course_offering, data_version=data_version, course_week=key[1], **{model.dimension + '_id': key[0]})
+                for name, count in cell_counts.items():
+                    setattr(cells[key], name, count)
+        for_update(model.objects).delete()
+        model.objects.bulk_create(cells.values(), batch_size=bulk_create_batch_size(model, BULK_INSERT_BATCH_SIZE))
@@ -1,16 +1,49 @@
+from collections import Counter
+from collections import defaultdict
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 import csv
 from datetime import datetime
+import functools
+import hashlib
 import io
 import itertools
+import multiprocessing
+import os
+import time
 from zipfile import ZipFile
 
 from django.conf import settings
 from django.core.mail import send_mail
+from django.db import connection
+from django.db import transaction
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Q
 from django.db.utils import IntegrityError
-from django.utils import dateparse
+import numpy as np
+import pandas as pd
 from unipath import Path
 
 from dashboard.models import CourseOffering
+from olap.activity_parsing import check_timestamp
+from olap.activity_parsing import from_epoch_microseconds
+from olap.activity_parsing import parse_activity_chunk
+from olap.activity_parsing import parse_activity_frame
+from olap.activity_parsing import parse_activity_rows
+from olap.activity_parsing import TIMESTAMP_INVALID_DATETIME
+from olap.activity_parsing import TIMESTAMP_INVALID_FORMAT
+from olap.activity_parsing import TIMESTAMP_OUTSIDE_OFFERING
+from olap.activity_parsing import TIMESTAMP_VALID
+from olap.activity_parsing import to_epoch_microseconds
+from olap.bulk import bulk_create_batch_size
+from olap.bulk import bulk_insert_ignore
+from olap.bulk import bulk_insert_ignore_values
+from olap.bulk import bulk_update
+from olap.cubes import CUBES
+from olap.cubes import update_cubes
+from olap.models import ImportCheckpoint
 from olap.models import LMSSession
 from olap.models import LMSUser
 from olap.models import Page
@@ -28,6 +61,13 @@ from olap.models import SummarySessionAverageLengthByDayInWeek
 from olap.models import SummarySessionAveragePagesPerSessionByDayInWeek
 from olap.models import SummarySessionsByDayInWeek
 from olap.models import SummaryUniquePageViewsByDayInWeek
+from olap.sessions import Sessionizer
+from olap.snapshots import remove_snapshots
+from olap.snapshots import rename_snapshot
+from olap.snapshots import write_snapshot
+from olap.time_dimensions import time_dimension_columns
+from olap.time_dimensions import TIME_DIMENSION_FIELDS
+from olap.time_dimensions import time_dimensions
 
 
 class LMSImportError(Exception):
@@ -50,32 +90,63 @@ class LMSImportDataError(LMSImportError):
         self.errors = errors
 
 
+class MeteredReader(io.RawIOBase):
+    """
+    Reads a binary file, such as a zip file member, adding the bytes read and the seconds spent reading them to stats
+    """
+
+    def __init__(self, raw, stats):
+        self._raw = raw
+        self._stats = stats
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        started_at = time.perf_counter()
+        count = self._raw.readinto(buffer)
+        self._stats['seconds'] += time.perf_counter() - started_at
+        self._stats['bytes'] += count
+        return count
+
+    def close(self):
+        self._raw.close()
+        super().close()
+
+
 class ImportLmsData(object):
     SESSION_LENGTH_MINS = 40
 
     staff_list = []
     sitetree = {}
 
-    def __init__(self, course_offering, file_path, just_clear=False):
+    def __init__(self, course_offering, file_path, just_clear=False, delta=False, shadow=False):
         self.just_clear = just_clear
+        self.delta = delta
+        # A shadow import loads the whole file into a new version of the offering's data, and only publishes it (for
+        # the dashboards to read) once the import is complete.  Otherwise the published version is imported into, and
+        # the activity added isn't read until the import moves the offering's last_activity_at on past it.
+        self.shadow = shadow
         self.course_import_path = file_path
         self.course_offering = course_offering
+        # The version of the offering's data being worked on, or None for the published version
+        self.data_version = None
 
     def set_latest_activity(self):
         latest_activity = []
 
         try:
-            latest_activity.append(PageVisit.objects.filter(page__course_offering=self.course_offering).latest('visited_at').visited_at)
+            latest_activity.append(PageVisit.objects.for_offering(self.course_offering).latest('visited_at').visited_at)
         except PageVisit.DoesNotExist:
             pass
 
         try:
-            latest_activity.append(SubmissionAttempt.objects.filter(page__course_offering=self.course_offering).latest('attempted_at').attempted_at)
+            latest_activity.append(SubmissionAttempt.objects.for_offering(self.course_offering).latest('attempted_at').attempted_at)
         except SubmissionAttempt.DoesNotExist:
             pass
 
         try:
-            latest_activity.append(SummaryPost.objects.filter(page__course_offering=self.course_offering).latest('posted_at').posted_at)
+            latest_activity.append(SummaryPost.objects.for_offering(self.course_offering).latest('posted_at').posted_at)
         except SummaryPost.DoesNotExist:
             pass
 
@@ -83,7 +154,15 @@ class ImportLmsData(object):
             self.course_offering.last_activity_at = max(latest_activity)
         else:
             self.course_offering.last_activity_at = None
-        self.course_offering.save()
+        self.course_offering.save(update_fields=['last_activity_at'])
+
+    def publish_data_version(self, data_version):
+        """
+            Switches the offering's dashboards over to data_version.  Older versions are left for
+            remove_old_data_versions.
+        """
+        CourseOffering.objects.filter(pk=self.course_offering.pk).update(data_version=data_version)
+        self.course_offering.data_version = data_version
 
     def write_error_log(self, errors, log_time):
         return self.write_to_error_log('errors_', errors, log_time)
@@ -100,69 +179,226 @@ class ImportLmsData(object):
         return error_log_path
 
     def process(self):
-        errors = set()
         offering = self.course_offering
         if self.just_clear:
             print("Removing old data for", offering)
-            self.remove_olap_data()
-            self.set_latest_activity()
+            with transaction.atomic():
+                self.remove_olap_data()
+                self.set_latest_activity()
+                offering.bump_import_generation()
             return
 
-        if offering.lms_type == CourseOffering.LMS_TYPE_BLACKBOARD:
+        since = None
+        if self.delta and not self.shadow:
+            # Only activity after the last recorded activity is new
+            offering.refresh_from_db(fields=['last_activity_at'])
+            since = offering.last_activity_at
+
+        if offering.lms_type != CourseOffering.LMS_TYPE_BLACKBOARD:
+            raise LMSImportError("Importing {} data is not supported".format(offering.get_lms_type_display()))
+
+        checkpoint = self._get_checkpoint(BlackboardImport.get_fingerprint(self.course_import_path))
+        self.data_version = checkpoint.data_version
+        if since is None:
             print("Importing course offering data for", offering)
-            lms_import = BlackboardImport(self.course_import_path, offering)
-            all_errors = lms_import.process_import_data()
+        else:
+            print("Importing course offering data after {} for".format(since.isoformat()), offering)
+        if self.shadow:
+            print("Importing into data version {} (version {} is published)".format(self.data_version, offering.data_version))
+        lms_import = BlackboardImport(self.course_import_path, offering, since=since, data_version=self.data_version)
+        # What the published version's snapshot holds before the import, unless part of the import has been committed
+        if not self.shadow and checkpoint.phase == ImportCheckpoint.PHASE_USERS:
+            snapshot_state = (offering.import_generation, self._get_snapshot_state())
+        else:
+            snapshot_state = None
+
+        try:
+            # Each unit of work is committed along with the checkpoint recording it, and a rerun carries on after it.
+            # Readers don't see a phase until it commits, or the activity until the summaries phase commits: a shadow
+            # import's version isn't read until it's published, and the activity added to the published version of an
+            # offering with activity isn't read until last_activity_at moves on past it (see olap.snapshots.load_columns).
+            for phase, activity_offset, process_unit in lms_import.iter_import_units(checkpoint):
+                with transaction.atomic():
+                    process_unit()
+                    if lms_import.error_list:
+                        # The import won't be finished, so a rerun starts again rather than resuming after the errors.
+                        # The rest of the file is still read, so all of its errors are reported.
+                        if checkpoint.pk is not None:
+                            checkpoint.delete()
+                    else:
+                        checkpoint.record_progress(phase, activity_offset)
+            self._check_errors(lms_import)
+
+            if not checkpoint.has_finished(ImportCheckpoint.PHASE_SESSIONS):
+                with transaction.atomic():
+                    self._calculate_import_sessions()
+                    checkpoint.record_progress(ImportCheckpoint.PHASE_SESSIONS)
+            with transaction.atomic():
+                self._finish_import(checkpoint, since)
+            self._update_snapshot(snapshot_state)
+        except (LMSImportDataError, LMSImportFileError) as e:
+            # Rerunning the file would fail the same way
+            with transaction.atomic():
+                if not self.shadow:
+                    self.remove_unpublished_activity()
+                # A shadow import's version is left for remove_old_data_versions
+                if checkpoint.pk is not None:
+                    checkpoint.delete()
+            if isinstance(e, LMSImportDataError):
+                self.report_errors(e.errors)
+            raise
+        finally:
+            lms_import.close()
+            non_critical_errors = set(lms_import.non_critical_error_list)
+            if len(non_critical_errors):
+                log_time = datetime.now()
+                self.write_non_critical_error_log(non_critical_errors, log_time)
+
+    def _check_errors(self, lms_import):
+        if lms_import.error_list:
             # Convert to set to remove duplicates
-            errors = set(all_errors['errors'])
-            non_critical_errors = set(all_errors['non_critical_errors'])
-
-            print("Processing user sessions for", offering)
-            if not len(errors):
-                self._calculate_sessions()
-
-        if len(non_critical_errors):
-            log_time = datetime.now()
-            self.write_non_critical_error_log(non_critical_errors, log_time)
-
-        if len(errors):
-            error_sample = itertools.islice(errors, settings.CLOOP_IMPORT_ERRORS_SAMPLE_SIZE)
-            log_time = datetime.now()
-            error_log_path = self.write_error_log(errors, log_time)
-            msg_text = "There were a total of {} errors during the import of {} at {}.\n\n".format(
-                len(errors),
-                self.course_offering.code,
-                log_time,
-            )
-            msg_text += "A sample of the errors can be found below. The full error log can be found at {}\n\n{}".format(
-                error_log_path,
-                "\n".join(error_sample),
-            )
-            send_mail(
-                'Errors in import of {}'.format(self.course_offering.code),
-                msg_text,
-                settings.SERVER_EMAIL,
-                settings.CLOOP_IMPORT_ADMINS,
-            )
-            raise LMSImportDataError(errors)
+            raise LMSImportDataError(set(lms_import.error_list))
+
+    def _calculate_import_sessions(self):
+        print("Processing user sessions for", self.course_offering)
+        if self.shadow:
+            # None of a new version's visits are in sessions yet
+            sessions_created = self._calculate_sessions()
+        else:
+            # The imported visits are the ones not in sessions yet
+            sessions_created = self._calculate_sessions(self._get_sessionizer().get_unsessioned_visit_times())
+        print("Created {} sessions".format(sessions_created))
+
+    def _finish_import(self, checkpoint, since):
+        """
+            The summaries phase: updates the summaries of the imported data and the offering's last_activity_at, and
+            publishes the imported version for a shadow import, so readers see all of the import once it commits
+        """
+        offering = self.course_offering
+        print("Summarising activity for", offering)
+        update_cubes(offering, self.data_version, since)
 
+        if self.shadow:
+            self.publish_data_version(self.data_version)
+            print("Published data version", self.data_version)
+        # Each activity added is later than last_activity_at was, so this only moves it forward
         self.set_latest_activity()
+        offering.bump_import_generation()
+        checkpoint.delete()
+
+    def _get_snapshot_state(self):
+        """
+            Returns what the published version's snapshot holds, besides the import generation it's named for: the
+            offering's last_activity_at (which moves on with any activity added), its number of users, and its pages'
+            ids and content types
+        """
+        offering = self.course_offering
+        return (
+            offering.last_activity_at,
+            LMSUser.objects.for_offering(offering).count(),
+            list(Page.objects.for_offering(offering).values_list('id', 'content_type').order_by('id')),
+        )
+
+    def _update_snapshot(self, snapshot_state):
+        """
+            Writes the snapshot of the imported data, or if the import didn't change what the published version's
+            snapshot held before it (snapshot_state, an (import generation, _get_snapshot_state()) tuple), renames that
+        """
+        offering = self.course_offering
+        if not settings.DATA_SNAPSHOT_DIR:
+            return
+        try:
+            if snapshot_state is not None:
+                previous_import_generation, previous_state = snapshot_state
+                if previous_state == self._get_snapshot_state() and rename_snapshot(offering, previous_import_generation):
+                    print("Keeping activity snapshot for", offering, "as the import didn't change its activity, users or pages")
+                    return
+            print("Writing activity snapshot for", offering)
+            write_snapshot(offering, self.data_version)
+        except OSError as e:
+            # The views load the activity from the database until a later import writes one
+            print("Couldn't write activity snapshot:", e)
+
+    def _get_checkpoint(self, fingerprint):
+        """
+            Returns the checkpoint for this import's file.  A checkpoint for a different file, for different contents
+            under the same name, or for another kind of import (or a version that has since been published) is discarded,
+            and the import starts from the beginning: a shadow import in a new version (the abandoned one is removed by
+            remove_old_data_versions), and other imports once the activity left by an unfinished import is removed.
+        """
+        offering = self.course_offering
+        filename = Path(self.course_import_path).name
+        if self.shadow:
+            this_import = Q(filename=filename, fingerprint=fingerprint, data_version__gt=offering.data_version)
+        else:
+            this_import = Q(filename=filename, fingerprint=fingerprint, data_version=offering.data_version)
+        ImportCheckpoint.objects.filter(course_offering=offering).exclude(this_import).delete()
+
+        checkpoint = ImportCheckpoint.objects.filter(course_offering=offering, filename=filename).first()
+        if checkpoint is not None:
+            print("Resuming import from the {} phase (activity offset {})".format(checkpoint.phase, checkpoint.activity_offset))
+            return checkpoint
+        if not self.shadow:
+            with transaction.atomic():
+                self.remove_unpublished_activity()
+        return ImportCheckpoint.objects.create(
+            course_offering=offering,
+            filename=filename,
+            fingerprint=fingerprint,
+            data_version=self._get_new_data_version() if self.shadow else offering.data_version,
+        )
+
+    def _get_new_data_version(self):
+        """
+            Returns a data version that the offering has no data in
+        """
+        offering = self.course_offering
+        versions = [offering.data_version]
+        for model in (LMSUser, Page):
+            versions.append(model.objects.filter(course_offering=offering).aggregate(Max('data_version'))['data_version__max'] or 0)
+        return max(versions) + 1
+
+    def report_errors(self, errors):
+        error_sample = itertools.islice(errors, settings.CLOOP_IMPORT_ERRORS_SAMPLE_SIZE)
+        log_time = datetime.now()
+        error_log_path = self.write_error_log(errors, log_time)
+        msg_text = "There were a total of {} errors during the import of {} at {}.\n\n".format(
+            len(errors),
+            self.course_offering.code,
+            log_time,
+        )
+        msg_text += "A sample of the errors can be found below. The full error log can be found at {}\n\n{}".format(
+            error_log_path,
+            "\n".join(error_sample),
+        )
+        send_mail(
+            'Errors in import of {}'.format(self.course_offering.code),
+            msg_text,
+            settings.SERVER_EMAIL,
+            settings.CLOOP_IMPORT_ADMINS,
+        )
 
     def remove_olap_data(self):
         offering = self.course_offering
         # First the OLAP Tables
+        remove_snapshots(offering)
+        # Unfinished imports have nothing left to resume
+        ImportCheckpoint.objects.filter(course_offering=offering).delete()
+        for model in CUBES:
+            model.objects.filter(course_offering=offering).delete()
         LMSUser.objects.filter(course_offering=offering).delete()
         Page.objects.filter(course_offering=offering).delete()
-        PageVisit.objects.filter(page__course_offering=offering).delete()
+        PageVisit.objects.filter(course_offering=offering).delete()
         LMSSession.objects.filter(course_offering=offering).delete()
-        SubmissionAttempt.objects.filter(page__course_offering=offering).delete()
+        SubmissionAttempt.objects.filter(course_offering=offering).delete()
         SubmissionType.objects.filter(course_offering=offering).delete()
-        SummaryPost.objects.filter(page__course_offering=offering).delete()
+        SummaryPost.objects.filter(course_offering=offering).delete()
 
         # # Next cleanup the Summary Tables
         # connection.execute("DELETE FROM Summary_Courses");
         SummaryForum.objects.filter(course_offering=offering).delete()
         SummaryDiscussion.objects.filter(course_offering=offering).delete()
-        SummaryPost.objects.filter(page__course_offering=offering).delete()
+        SummaryPost.objects.filter(course_offering=offering).delete()
         SummaryCourseVisitsByDayInWeek.objects.filter(course_offering=offering).delete()
         SummaryCourseCommunicationVisitsByDayInWeek.objects.filter(course_offering=offering).delete()
         SummaryCourseAssessmentVisitsByDayInWeek.objects.filter(course_offering=offering).delete()
@@ -172,77 +408,130 @@ class ImportLmsData(object):
         SummaryParticipatingUsersByDayInWeek.objects.filter(course_offering=offering).delete()
         SummaryUniquePageViewsByDayInWeek.objects.filter(course_offering=offering).delete()
 
-    def _store_session(self, session_visits_list):
-        first_visit = session_visits_list[0]
-        session_start = first_visit.visited_at
-        session_end = session_visits_list[-1].visited_at
-        session_duration = int((session_end - session_start).total_seconds() / 60)
-        pageviews = len(session_visits_list)
-        session = LMSSession(course_offering=self.course_offering, first_visit=first_visit, pageviews=pageviews, session_length_in_mins=session_duration)
-        session.save()
-        session_visits_list_ids = (v.id for v in session_visits_list)
-        PageVisit.objects.filter(id__in=session_visits_list_ids).update(session=session)
+    def remove_unpublished_activity(self):
+        """
+            Removes the activity an unfinished import added to the published version of the offering's data, after its
+            last_activity_at, and recalculates the sessions of the users it was for
+        """
+        offering = self.course_offering
+        offering.refresh_from_db(fields=['data_version', 'last_activity_at'])
+        last_activity_at = offering.last_activity_at
+        visits = PageVisit.objects.for_offering(offering)
+        if last_activity_at is not None:
+            visits = visits.filter(visited_at__gt=last_activity_at)
+        first_removed_times = dict(visits.values_list('lms_user_id').annotate(Min('visited_at')).order_by())
+        # Deleting the visits deletes the sessions that start with them, which only span new visits
+        visits.delete()
+        for model, time_field in ((SummaryPost, 'posted_at'), (SubmissionAttempt, 'attempted_at')):
+            activity = model.objects.for_offering(offering)
+            if last_activity_at is not None:
+                activity = activity.filter(**{time_field + '__gt': last_activity_at})
+            activity.delete()
+        if first_removed_times:
+            # The users' earlier sessions may have been extended over the removed visits
+            Sessionizer(offering, self.SESSION_LENGTH_MINS).update_user_sessions(first_removed_times)
+
+    def remove_old_data_versions(self):
+        """
+            Removes the versions of the offering's data that are neither published nor being imported into, and
+            returns them.  Each version is removed in its own transaction.
+        """
+        offering = self.course_offering
+        # Read in the order that an import moves a version through: stored, then checkpointed, then published
+        stored_versions = set()
+        for model in (LMSUser, Page):
+            stored_versions.update(model.objects.filter(course_offering=offering).values_list('data_version', flat=True).order_by().distinct())
+        used_versions = set(ImportCheckpoint.objects.filter(course_offering=offering).values_list('data_version', flat=True))
+        offering.refresh_from_db(fields=['data_version'])
+        used_versions.add(offering.data_version)
+
+        old_versions = sorted(stored_versions - used_versions)
+        for data_version in old_versions:
+            with transaction.atomic():
+                self.remove_data_version(data_version)
+        return old_versions
+
+    def remove_data_version(self, data_version):
+        offering = self.course_offering
+        remove_snapshots(offering, data_version)
+        for model in CUBES:
+            model.objects.for_offering(offering, data_version).delete()
+        # Unlink the visits before deleting their sessions, which would otherwise cascade to the visits
+        PageVisit.objects.for_offering(offering, data_version).exclude(session=None).update(session=None)
+        LMSSession.objects.for_offering(offering, data_version).delete()
+        PageVisit.objects.for_offering(offering, data_version).delete()
+        SubmissionAttempt.objects.for_offering(offering, data_version).delete()
+        SummaryPost.objects.for_offering(offering, data_version).delete()
+        Page.objects.for_offering(offering, data_version).delete()
+        LMSUser.objects.for_offering(offering, data_version).delete()
+
+    def _get_sessionizer(self):
+        return Sessionizer(self.course_offering, self.SESSION_LENGTH_MINS, data_version=self.data_version)
 
     def calculate_session_for_user(self, lms_user):
-
         """
-            For a given LMS user, aggregate page views into sessions.
-            A session includes all visits by a user, where the time difference between subsequent views
-            does not exceed SESSION_LENGTH_MINS.  Sessions don't care about which page got visited, only that there
-            were visits.
-
-            Algorithm to Determine Sessions:
-             - iterate over visits looking for a gap between visits greater than SESSION_LENGTH_MINS
-             - take the views with gaps shorter than SESSION_LENGTH_MINS and create a session to span them
-             - update the session FK in each visit spanned by the session, to the session
+            For a given LMS user, aggregate page views into sessions.  See olap.sessions.Sessionizer.
         """
-        visits = PageVisit.objects.filter(lms_user=lms_user).order_by('visited_at')
-
-        if len(visits) == 0:
-            # No visits => no sessions.
-            return
-
-        prev_visit_time = None
-        visits_list_for_this_session = []
-        for visit in visits:
-            if prev_visit_time is None:
-                prev_visit_time = visit.visited_at
-                visits_list_for_this_session = [visit]
-                continue
-
-            this_visit_time = visit.visited_at
-            td = this_visit_time - prev_visit_time
-            total_seconds = td.total_seconds()
-            session_duration = int(total_seconds / 60)
-            if session_duration > self.SESSION_LENGTH_MINS:
-                # Time since previous visit is greater than max session length, so we should start a new session.
-                # Save the visits we found so far.
-                self._store_session(visits_list_for_this_session)
-                visits_list_for_this_session = [visit]
-            else:
-                visits_list_for_this_session.append(visit)
-            prev_visit_time = this_visit_time
+        self._get_sessionizer().sessionize(PageVisit.objects.filter(lms_user=lms_user))
 
-        # If that was the final visit, store it as a session.
-        self._store_session(visits_list_for_this_session)
-
-    def _calculate_sessions(self):
-        # For each user (i.e., student), calculate visit sessions.
-        lms_users = LMSUser.objects.filter(course_offering=self.course_offering)
-        for lms_user in lms_users:
-            self.calculate_session_for_user(lms_user)
+    def _calculate_sessions(self, first_new_visit_times=None):
+        """
+            Calculates visit sessions, and returns the number created.
+            With first_new_visit_times (see Sessionizer.update_user_sessions), only the sessions of users with new visits
+            are updated.
+            Otherwise sessions are found for all users (i.e., students) in a single pass over the offering's visits.
+        """
+        sessionizer = self._get_sessionizer()
+        if first_new_visit_times is None:
+            sessionizer.sessionize(sessionizer.get_visits())
+        else:
+            sessionizer.update_user_sessions(first_new_visit_times)
+        return sessionizer.sessions_created
 
 
 class BaseLmsImport(object):
 
-    def __init__(self, course_import_path, course_offering):
+    def __init__(self, course_import_path, course_offering, since=None, data_version=None):
         self.course_offering = course_offering
         self.course_import_path = course_import_path
+        # The version of the offering's data to import into, by default the published version
+        self.data_version = course_offering.data_version if data_version is None else data_version
+        # For a delta import, activity at or before this time has already been imported and is skipped
+        self.since = since
+        self._since_time = None if since is None else to_epoch_microseconds(since)
+        # The offering's (start, end) in microseconds since the epoch, for checking activity times against
+        self._activity_window = (
+            to_epoch_microseconds(course_offering.start_datetime),
+            to_epoch_microseconds(course_offering.end_datetime),
+        )
         self.error_list = []
         self.non_critical_error_list = []
+        # Count of activity rows skipped by a delta import, by kind of activity
+        self.skipped_stats = Counter()
+        # Time of the latest visit, post or submission attempt added by this import
+        self.latest_activity_at = None
+        # Time of the earliest visit added by this import for each LMSUser pk, from which their sessions need updating
+        self.first_new_visit_times = {}
+
+    @classmethod
+    def get_fingerprint(cls, course_import_path):
+        """
+        Returns a string identifying the contents of the import file
+        """
+        raise NotImplementedError("'get_fingerprint' must be implemented")
+
+    def close(self):
+        """
+        Releases the import file, if it was kept open
+        """
 
-    def process_import_data(self):
-        raise NotImplementedError("'process_import_data' must be implemented")
+    def iter_import_units(self, checkpoint):
+        """
+        Yields the units of work left after checkpoint, as (phase, activity_offset, callable) tuples.  Each callable
+        does its unit of work; the caller then records the progress in the checkpoint.  activity_offset is None for the
+        unit that finishes a phase.
+        """
+        raise NotImplementedError("'iter_import_units' must be implemented")
 
     def _add_error(self, error_msg):
         self.error_list.append(error_msg)
@@ -250,6 +539,38 @@ class BaseLmsImport(object):
     def _add_non_critical_error(self, error_msg):
         self.non_critical_error_list.append(error_msg)
 
+    def _check_timestamp(self, timestamp):
+        """
+        Returns a (TIMESTAMP_* status, microseconds since the epoch) tuple for timestamp.  See check_timestamp.
+        """
+        return check_timestamp(timestamp, self._activity_window)
+
+    def _is_already_imported(self, kind, timestamp_status, activity_time):
+        """
+        For a delta import, returns whether the activity at activity_time (from _check_timestamp) has been imported
+        before, counting it as skipped if so.  Unparseable timestamps are left for the caller to report.
+        """
+        if self._since_time is None or timestamp_status not in (TIMESTAMP_VALID, TIMESTAMP_OUTSIDE_OFFERING):
+            return False
+        if activity_time > self._since_time:
+            return False
+        self.skipped_stats[kind] += 1
+        return True
+
+    def _add_new_activity(self, activity_at):
+        if self.latest_activity_at is None or activity_at > self.latest_activity_at:
+            self.latest_activity_at = activity_at
+
+    def _add_new_visits(self, visits):
+        for visit in visits:
+            self._add_new_visit_time(visit.lms_user_id, visit.visited_at)
+
+    def _add_new_visit_time(self, lms_user_id, visited_at):
+        first_new_visit_time = self.first_new_visit_times.get(lms_user_id)
+        if first_new_visit_time is None or visited_at < first_new_visit_time:
+            self.first_new_visit_times[lms_user_id] = visited_at
+        self._add_new_activity(visited_at)
+
 
 class BlackboardImport(BaseLmsImport):
     USERS_FILE = 'all_user.txt'
@@ -265,78 +586,393 @@ class BlackboardImport(BaseLmsImport):
     ACTIVITY_FIELDNAMES = ['user_key', 'content_key', 'forum_key', 'timestamp']
 
     FORUM_CONTENT_TYPE = 'resource/x-bb-discussionboard'
-
-    def process_import_data(self):
+    # Error for an activity row, by the TIMESTAMP_* status of its timestamp
+    ACTIVITY_TIMESTAMP_ERRORS = {
+        TIMESTAMP_INVALID_FORMAT: 'Timestamp {} for access activity is not a valid format',
+        TIMESTAMP_INVALID_DATETIME: 'Timestamp {} for access activity is not a valid datetime',
+        TIMESTAMP_OUTSIDE_OFFERING: 'Timestamp {} for access activity is outside course offering start/end',
+    }
+
+    BULK_CREATE_BATCH_SIZE = 1000
+    # Number of posts, submission attempts or visits to accumulate before inserting them
+    ACTIVITY_BATCH_SIZE = 10000
+    # As ACTIVITY_BATCH_SIZE, when loading them with LOAD DATA, which pays off for larger batches
+    LOAD_DATA_BATCH_SIZE = 100000
+    # Number of activity rows imported (and committed) together
+    ACTIVITY_CHUNK_ROWS = 100000
+    USER_UPDATE_FIELDS = ['firstname', 'lastname', 'username', 'email']
+    PAGE_UPDATE_FIELDS = ['title', 'content_type']
+
+    def __init__(self, course_import_path, course_offering, since=None, data_version=None, columnar_activity=None, load_data=None):
+        super().__init__(course_import_path, course_offering, since=since, data_version=data_version)
+        # Whether to import activity a chunk at a time with pandas rather than row by row.  See _import_activity_frame
+        self.columnar_activity = settings.CLOOP_IMPORT_COLUMNAR_ACTIVITY if columnar_activity is None else columnar_activity
+        # Whether to load posts, submission attempts and visits with LOAD DATA LOCAL INFILE (on MySQL; elsewhere they
+        # are inserted in batches regardless).  See bulk_load_ignore_values
+        self.load_data = settings.CLOOP_IMPORT_LOAD_DATA if load_data is None else load_data
+        self.activity_batch_size = self.LOAD_DATA_BATCH_SIZE if self.load_data else self.ACTIVITY_BATCH_SIZE
+        # The import file and its archive, opened on first use and kept open until close().  See _open_member
+        self._import_file = None
+        self._import_zip = None
+        # Contents of the members small enough to keep in memory, by name
+        self._member_data = {}
+        # Bytes and rows read from each member, and the seconds spent reading (and decompressing) them, by name
+        self.read_stats = defaultdict(Counter)
+        # Key -> id maps, built once per offering the first time a row needs resolving.  See _lookup_user/_lookup_page
+        self._user_pk_map = None
+        self._page_pk_map = None
+        self.lookup_stats = Counter()
+        self.upsert_stats = {}
+        self.insert_stats = Counter()
+
+    @classmethod
+    def get_fingerprint(cls, course_import_path):
+        with ZipFile(course_import_path) as import_zip:
+            members = ['{}:{}:{}'.format(info.filename, info.file_size, info.CRC) for info in import_zip.infolist()]
+        return hashlib.sha1('|'.join(sorted(members)).encode('UTF-8')).hexdigest()
+
+    def iter_import_units(self, checkpoint):
+        phases = (
+            (ImportCheckpoint.PHASE_USERS, self._import_users),
+            (ImportCheckpoint.PHASE_RESOURCES, self._import_resources),
+            (ImportCheckpoint.PHASE_POSTS, self._import_posts),
+            (ImportCheckpoint.PHASE_SUBMISSION_ATTEMPTS, self._import_submission_attempts),
+        )
+        for phase, import_phase in phases:
+            if not checkpoint.has_finished(phase):
+                yield phase, None, import_phase
+
+        if not checkpoint.has_finished(ImportCheckpoint.PHASE_ACTIVITY):
+            print("Processing activity")
+            import_chunk = self._import_activity_frame if self.columnar_activity else self._import_activity_chunk
+            for parse_chunk, activity_offset in self._iter_parsed_activity_chunks(checkpoint.activity_offset):
+                yield ImportCheckpoint.PHASE_ACTIVITY, activity_offset, functools.partial(import_chunk, parse_chunk)
+            yield ImportCheckpoint.PHASE_ACTIVITY, None, self._finish_activity
+
+    def _import_users(self):
         print("Processing users")
         self._process_csv(self.USERS_FILE, self._process_users)
+        print("Users: {} inserted, {} updated, {} unchanged".format(*self.upsert_stats['users']))
+        self._print_read_stats(self.USERS_FILE)
+
+    def _import_resources(self):
         print("Processing resources")
         self._process_csv(self.RESOURCES_FILE, self._process_resources)
-        self._process_csv(self.RESOURCES_FILE, self._process_resource_parents)
+        print("Resources: {} inserted, {} updated, {} unchanged".format(*self.upsert_stats['resources']))
+        self._print_read_stats(self.RESOURCES_FILE)
+
+    def _import_posts(self):
         print("Processing posts")
         self._process_csv(self.POSTS_FILE, self._process_posts)
+        self._print_insert_stats('posts')
+        self._print_read_stats(self.POSTS_FILE)
+
+    def _import_submission_attempts(self):
         print("Processing submission attempts")
         self._process_csv(self.SUBMISSIONS_FILE, self._process_submission_attempts)
-        print("Processing activity")
-        self._process_csv(self.ACTIVITY_FILE, self._process_access_log)
-
-        return {
-            'errors': self.error_list,
-            'non_critical_errors': self.non_critical_error_list
-        }
+        self._print_insert_stats('submission attempts')
+        self._print_read_stats(self.SUBMISSIONS_FILE)
+
+    def _finish_activity(self):
+        self._print_insert_stats('visits')
+        self._print_read_stats(self.ACTIVITY_FILE)
+        self._print_lookup_stats()
+        if self.since is not None:
+            print("Skipped activity at or before {}: {} posts, {} submission attempts, {} visits".format(
+                self.since.isoformat(),
+                self.skipped_stats['posts'],
+                self.skipped_stats['submission attempts'],
+                self.skipped_stats['visits'],
+            ))
+
+    def close(self):
+        if self._import_zip is not None:
+            self._import_zip.close()
+            self._import_file.close()
+            self._import_zip = None
+            self._import_file = None
+        self._member_data = {}
+
+    def _get_import_zip(self):
+        if self._import_zip is None:
+            # A large buffer means fewer, larger reads, which suits network storage
+            self._import_file = open(self.course_import_path, 'rb', buffering=settings.CLOOP_IMPORT_READ_BUFFER_SIZE)
+            try:
+                self._import_zip = ZipFile(self._import_file)
+            except:
+                self._import_file.close()
+                self._import_file = None
+                raise
+        return self._import_zip
+
+    def _open_member(self, file_name):
+        """
+        Returns a buffered binary file of the import file's member file_name.  Members no larger than
+        settings.CLOOP_IMPORT_MEMORY_MEMBER_SIZE are read (and decompressed) just once: the first open reads the whole
+        member into memory, and it is served from there until the import is closed.
+        """
+        if file_name not in self._member_data:
+            import_zip = self._get_import_zip()
+            member = MeteredReader(import_zip.open(file_name), self.read_stats[file_name])
+            member_file = io.BufferedReader(member, buffer_size=settings.CLOOP_IMPORT_READ_BUFFER_SIZE)
+            if import_zip.getinfo(file_name).file_size > settings.CLOOP_IMPORT_MEMORY_MEMBER_SIZE:
+                return member_file
+            with member_file:
+                self._member_data[file_name] = member_file.read()
+        return io.BytesIO(self._member_data[file_name])
 
     def _process_csv(self, file_name, process_callable):
-        with ZipFile(self.course_import_path) as import_zip:
-            with import_zip.open(file_name) as csv_file:
-                csv_file = io.TextIOWrapper(csv_file, encoding='UTF-8', newline='')
-                csv_data = csv.DictReader(csv_file, delimiter='|')
-                process_callable(csv_data)
+        with self._open_member(file_name) as csv_file:
+            csv_file = io.TextIOWrapper(csv_file, encoding='UTF-8', newline='')
+            csv_data = csv.DictReader(csv_file, delimiter='|')
+            process_callable(csv_data)
+            self.read_stats[file_name]['rows'] = max(csv_data.line_num - 1, 0)
+
+    def _print_read_stats(self, file_name):
+        stats = self.read_stats[file_name]
+        # Guard against dividing by zero for a member that was already in memory
+        seconds = max(stats['seconds'], 1e-6)
+        print("Read {}: {} rows, {:.1f} MB in {:.2f}s ({:.1f} MB/s, {:.0f} rows/s)".format(
+            file_name,
+            stats['rows'],
+            stats['bytes'] / 1e6,
+            stats['seconds'],
+            stats['bytes'] / 1e6 / seconds,
+            stats['rows'] / seconds,
+        ))
+
+    def _iter_activity_chunks(self, offset=0):
+        """
+        Reads the activity file ACTIVITY_CHUNK_ROWS rows at a time, starting at byte offset (or just after the header).
+        Yields a (fieldnames, bytes of the chunk, byte offset of the end of the chunk) tuple for each chunk.
+        """
+        with self._open_member(self.ACTIVITY_FILE) as activity_file:
+            header = activity_file.readline()
+            fieldnames = next(csv.reader([header.decode('UTF-8')], delimiter='|'), [])
+            if set(fieldnames) != set(self.ACTIVITY_FIELDNAMES):
+                raise LMSImportFileError(self.ACTIVITY_FILE, 'Activity data columns do not match {}'.format(self.ACTIVITY_FIELDNAMES))
+
+            position = len(header)
+            if offset > position and activity_file.seekable():
+                position = activity_file.seek(offset)
+            # A member streamed from the archive can't seek, so read up to the offset
+            while position < offset:
+                skipped = activity_file.read(min(offset - position, io.DEFAULT_BUFFER_SIZE * 64))
+                if not skipped:
+                    break
+                position += len(skipped)
+
+            while True:
+                lines = list(itertools.islice(activity_file, self.ACTIVITY_CHUNK_ROWS))
+                if not lines:
+                    break
+                position += sum(len(line) for line in lines)
+                self.read_stats[self.ACTIVITY_FILE]['rows'] += len(lines)
+                yield fieldnames, b''.join(lines), position
+
+    def _iter_parsed_activity_chunks(self, offset=0):
+        """
+        Yields a (callable returning the parsed chunk, byte offset of the end of the chunk) tuple for each chunk of the
+        activity file from offset.  A chunk is parsed into a ParsedActivity, or in columnar mode a DataFrame.  With parse
+        workers (see _get_parse_workers), the chunks are parsed in a process pool, keeping each worker a chunk ahead of
+        the one being imported.  Otherwise each chunk is parsed when its callable is called.
+        """
+        window = self._activity_window
+        parse = parse_activity_frame if self.columnar_activity else parse_activity_chunk
+        workers = self._get_parse_workers()
+        if not workers:
+            for fieldnames, chunk, end_offset in self._iter_activity_chunks(offset):
+                yield functools.partial(parse, chunk, fieldnames, window), end_offset
+            return
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for fieldnames, chunk, end_offset in self._iter_activity_chunks(offset):
+                pending.append((pool.submit(parse, chunk, fieldnames, window), end_offset))
+                if len(pending) > workers:
+                    future, chunk_end_offset = pending.popleft()
+                    yield future.result, chunk_end_offset
+            while pending:
+                future, chunk_end_offset = pending.popleft()
+                yield future.result, chunk_end_offset
+
+    def _get_parse_workers(self):
+        """
+        Returns the number of processes to parse activity in, from settings.CLOOP_IMPORT_PARSE_WORKERS
+        """
+        workers = settings.CLOOP_IMPORT_PARSE_WORKERS
+        if workers is None:
+            workers = os.cpu_count() or 0
+        if workers and multiprocessing.current_process().daemon:
+            # Eg. a process of Celery's default (prefork) pool
+            print("Parsing activity in this process, as a daemon process can't start parse workers")
+            workers = 0
+        return workers
+
+    def _reset_lookup_maps(self):
+        self._user_pk_map = None
+        self._page_pk_map = None
+
+    def _get_user_pk_map(self):
+        """
+        Returns a dict of lms_user_id -> LMSUser pk for this offering
+        """
+        if self._user_pk_map is None:
+            users = LMSUser.objects.for_offering(self.course_offering, self.data_version).values_list('lms_user_id', 'pk')
+            self._user_pk_map = dict(users)
+        return self._user_pk_map
+
+    def _get_page_pk_map(self):
+        """
+        Returns a dict of (content_id, is_forum) -> (Page pk, content_type) for this offering
+        """
+        if self._page_pk_map is None:
+            pages = Page.objects.for_offering(self.course_offering, self.data_version).values_list('content_id', 'is_forum', 'pk', 'content_type')
+            self._page_pk_map = {(content_id, is_forum): (pk, content_type) for content_id, is_forum, pk, content_type in pages}
+        return self._page_pk_map
+
+    def _lookup_user(self, user_key):
+        """
+        Returns the LMSUser pk for user_key, or None if there is no such user in this offering
+        """
+        user_pk = self._get_user_pk_map().get(user_key)
+        self.lookup_stats['user_hits' if user_pk is not None else 'user_misses'] += 1
+        return user_pk
+
+    def _lookup_page(self, content_key, is_forum):
+        """
+        Returns a (pk, content_type) tuple for the page, or None if there is no such page in this offering
+        """
+        # content_id is an integer column; a non-integer key raises ValueError just as the equivalent ORM lookup would
+        page = self._get_page_pk_map().get((int(content_key), is_forum))
+        self.lookup_stats['page_hits' if page is not None else 'page_misses'] += 1
+        return page
+
+    def _print_insert_stats(self, kind):
+        print("{}: {} inserted, {} duplicates skipped".format(
+            kind.capitalize(),
+            self.insert_stats[kind + ' inserted'],
+            self.insert_stats[kind + ' duplicates'],
+        ))
+
+    def _print_lookup_stats(self):
+        print("Lookups: users {} hit / {} missed, pages {} hit / {} missed".format(
+            self.lookup_stats['user_hits'],
+            self.lookup_stats['user_misses'],
+            self.lookup_stats['page_hits'],
+            self.lookup_stats['page_misses'],
+        ))
 
     def _process_users(self, users_data):
         """
-        Extracts users from the course import files and updates/inserts into the LMSUser table
+        Extracts users from the course import files and updates/inserts into the LMSUser table.
+        Rows are diffed against the users already stored: new users are bulk inserted and changed users are updated in batches.
         """
         if set(users_data.fieldnames) != set(self.USERS_FIELDNAMES):
             raise LMSImportFileError(self.USERS_FILE, 'User data columns do not match {}'.format(self.USERS_FIELDNAMES))
 
+        # Later rows for the same user win, as they did with update_or_create
+        incoming_users = {}
         for row in users_data:
-            values = {
+            incoming_users[row['user_key']] = {
                 'firstname': row['firstname'],
                 'lastname': row['lastname'],
                 'username': row['username'],
                 'email': row['email'],
             }
-            user, created = LMSUser.objects.update_or_create(course_offering=self.course_offering, lms_user_id=row['user_key'], defaults=values)
+
+        existing_users = {user.lms_user_id: user for user in LMSUser.objects.for_offering(self.course_offering, self.data_version)}
+        new_users = []
+        changed_users = []
+        for lms_user_id, values in incoming_users.items():
+            user = existing_users.get(lms_user_id)
+            if user is None:
+                new_users.append(LMSUser(course_offering=self.course_offering, data_version=self.data_version, lms_user_id=lms_user_id, **values))
+            elif self._apply_changes(user, values):
+                changed_users.append(user)
+
+        LMSUser.objects.bulk_create(new_users, batch_size=bulk_create_batch_size(LMSUser, self.BULK_CREATE_BATCH_SIZE))
+        bulk_update(LMSUser, changed_users, self.USER_UPDATE_FIELDS)
+        self.upsert_stats['users'] = (len(new_users), len(changed_users), len(incoming_users) - len(new_users) - len(changed_users))
+
+        self._reset_lookup_maps()
 
     def _process_resources(self, resources_data):
         """
-        Extracts pages/resources from the course import files and updates/inserts into the Page table
+        Extracts pages/resources from the course import files and updates/inserts into the Page table.
+        New pages are bulk inserted, changed pages are updated in batches, and parents are then resolved from the same rows.
         """
         if set(resources_data.fieldnames) != set(self.RESOURCES_FIELDNAMES):
             raise LMSImportFileError(self.RESOURCES_FILE, 'Resource data columns do not match {}'.format(self.RESOURCES_FIELDNAMES))
 
-        # Set the parent to None until all resources are inserted
-        for row in resources_data:
-            values = {
+        # Keep the rows so parents can be resolved without reading the file again
+        resource_rows = list(resources_data)
+        incoming_pages = {}
+        for row in resource_rows:
+            incoming_pages[int(row['content_key'])] = {
                 'title': row['title'],
                 'content_type': row['resource_type'],
-                'parent_id': None,
             }
-            resource, created = Page.objects.update_or_create(course_offering=self.course_offering, content_id=row['content_key'], is_forum=False, defaults=values)
+
+        existing_pages = {page.content_id: page for page in Page.objects.for_offering(self.course_offering, self.data_version).filter(is_forum=False)}
+        new_pages = []
+        changed_pages = []
+        for content_id, values in incoming_pages.items():
+            page = existing_pages.get(content_id)
+            if page is None:
+                # The parent is set once all resources are inserted
+                new_pages.append(Page(course_offering=self.course_offering, data_version=self.data_version, content_id=content_id, is_forum=False, parent_id=None, **values))
+            elif self._apply_changes(page, values):
+                changed_pages.append(page)
+
+        Page.objects.bulk_create(new_pages, batch_size=bulk_create_batch_size(Page, self.BULK_CREATE_BATCH_SIZE))
+        bulk_update(Page, changed_pages, self.PAGE_UPDATE_FIELDS)
+        self.upsert_stats['resources'] = (len(new_pages), len(changed_pages), len(incoming_pages) - len(new_pages) - len(changed_pages))
+
+        self._process_resource_parents(resource_rows)
+        self._reset_lookup_maps()
 
     def _process_resource_parents(self, resources_data):
         """
-        Go through the pages/resources from the course import files again and find the parents
+        Find the parents of the pages/resources in the course import files and save them with a single batched update
         """
+        # bulk_create doesn't give us back ids, so (re)load the pages for the offering once
+        pages = {(page.content_id, page.is_forum): page for page in Page.objects.for_offering(self.course_offering, self.data_version)}
+
+        parent_ids = {}
         for row in resources_data:
+            content_page = pages.get((int(row['content_key']), False))
+            if content_page is None:
+                continue
+            parent_ids[content_page.pk] = None
             if row['parent_content_key']:
-                content_page = Page.objects.get(content_id=row['content_key'], is_forum=False, course_offering=self.course_offering)
-                try:
-                    parent_page = Page.objects.get(content_id=row['parent_content_key'], course_offering=self.course_offering)
-                    content_page.parent = parent_page
-                    content_page.save()
-                except Page.DoesNotExist:
+                parent_key = int(row['parent_content_key'])
+                # Resources are normally parented by other resources, but a forum with the same key will also do
+                parent_page = pages.get((parent_key, False)) or pages.get((parent_key, True))
+                if parent_page is not None:
+                    parent_ids[content_page.pk] = parent_page.pk
+                else:
                     self._add_non_critical_error('Unable to find parent resource {}'.format(row['parent_content_key']))
 
+        changed_pages = []
+        for page in pages.values():
+            if page.pk in parent_ids and page.parent_id != parent_ids[page.pk]:
+                page.parent_id = parent_ids[page.pk]
+                changed_pages.append(page)
+        bulk_update(Page, changed_pages, ['parent'])
+
+    @staticmethod
+    def _apply_changes(instance, values):
+        """
+        Sets values on instance, returning True if any of them differ from what is stored
+        """
+        changed = False
+        for field_name, value in values.items():
+            if getattr(instance, field_name) != value:
+                setattr(instance, field_name, value)
+                changed = True
+        return changed
+
     def _process_submission_attempts(self, submissions_data):
         """
         Extracts submission attempts from the course import files and updates/inserts into the submission attempts table
@@ -344,40 +980,51 @@ class BlackboardImport(BaseLmsImport):
         if set(submissions_data.fieldnames) != set(self.SUBMISSIONS_FIELDNAMES):
             raise LMSImportFileError(self.SUBMISSIONS_FILE, 'Submissions data columns do not match {}'.format(self.SUBMISSIONS_FIELDNAMES))
 
+        batch = []
+
         for row in submissions_data:
-            try:
-                user = LMSUser.objects.get(lms_user_id=row['user_key'], course_offering=self.course_offering)
-            except LMSUser.DoesNotExist:
-                self._add_error('Unable to find user {} for submission attempt'.format(row['user_key']))
+            timestamp_status, attempt_time = self._check_timestamp(row['timestamp'])
+            if self._is_already_imported('submission attempts', timestamp_status, attempt_time):
                 continue
 
-            try:
-                page = Page.objects.get(content_id=row['content_key'], is_forum=False, course_offering=self.course_offering)
-                if page.content_type not in CourseOffering.assessment_types():
-                    self._add_non_critical_error('Resource {} for submission attempt is not an assessment type'.format(page.content_id))
-                    continue
+            user_pk = self._lookup_user(row['user_key'])
+            if user_pk is None:
+                self._add_error('Unable to find user {} for submission attempt'.format(row['user_key']))
+                continue
 
-            except Page.DoesNotExist:
+            page = self._lookup_page(row['content_key'], False)
+            if page is None:
                 self._add_error('Unable to find page {} for submission attempt'.format(row['content_key']))
                 continue
+            page_pk, content_type = page
+            if content_type not in CourseOffering.assessment_types():
+                self._add_non_critical_error('Resource {} for submission attempt is not an assessment type'.format(int(row['content_key'])))
+                continue
 
-            try:
-                attempted_at = dateparse.parse_datetime(row['timestamp'])
-                if attempted_at is None:
-                    self._add_error('Timestamp {} for submission attempt is not a valid format'.format(row['timestamp']))
-                    continue
-            except ValueError:
+            if timestamp_status == TIMESTAMP_INVALID_FORMAT:
+                self._add_error('Timestamp {} for submission attempt is not a valid format'.format(row['timestamp']))
+                continue
+            if timestamp_status == TIMESTAMP_INVALID_DATETIME:
                 self._add_error('Timestamp {} for submission attempt is not a valid datetime'.format(row['timestamp']))
                 continue
-
-            if attempted_at < self.course_offering.start_datetime or attempted_at > self.course_offering.end_datetime:
+            if timestamp_status == TIMESTAMP_OUTSIDE_OFFERING:
                 self._add_non_critical_error('Timestamp {} for submission attempt is outside course offering start/end'.format(row['timestamp']))
                 continue
 
-            try:
-                submission = SubmissionAttempt.objects.create(lms_user=user, page=page, attempted_at=attempted_at, grade=row['user_grade'])
-            except IntegrityError as e:
-                self._add_error('Integrity Error in submission attempt insert: {}'.format(e))
+            attempted_at = from_epoch_microseconds(attempt_time)
+
+            batch.append(SubmissionAttempt(
+                course_offering=self.course_offering, data_version=self.data_version,
+                lms_user_id=user_pk, page_id=page_pk, attempted_at=attempted_at, grade=row['user_grade'],
+                **time_dimensions(self.course_offering, attempted_at)
+            ))
+            self._add_new_activity(attempted_at)
+
+            if len(batch) == self.activity_batch_size:
+                self._insert_activity('submission attempts', SubmissionAttempt, batch)
+                batch = []
+
+        self._insert_activity('submission attempts', SubmissionAttempt, batch)
 
     def _process_access_log(self, activity_data):
         """
@@ -386,55 +1033,161 @@ class BlackboardImport(BaseLmsImport):
         if set(activity_data.fieldnames) != set(self.ACTIVITY_FIELDNAMES):
             raise LMSImportFileError(self.ACTIVITY_FILE, 'Activity data columns do not match {}'.format(self.ACTIVITY_FIELDNAMES))
 
-        batch_size = 10000
+        self._store_parsed_activity(parse_activity_rows(activity_data, self._activity_window))
+
+    def _import_activity_chunk(self, parse_chunk):
+        self._store_parsed_activity(parse_chunk())
+
+    def _store_parsed_activity(self, parsed_activity):
+        """
+        Resolves the users and pages of a ParsedActivity, and inserts its visits.  Errors are recorded here, in row
+        order, so they are the same however the rows were parsed.
+        """
         batch = []
 
-        for row in activity_data:
-            try:
-                user = LMSUser.objects.get(lms_user_id=row['user_key'], course_offering=self.course_offering)
-            except LMSUser.DoesNotExist:
-                self._add_error('Unable to find user {} for activity'.format(row['user_key']))
+        for index, (user_key, content_key, forum_key, visit_time, timestamp_status) in enumerate(parsed_activity.rows()):
+            if self._is_already_imported('visits', timestamp_status, visit_time):
                 continue
 
-            try:
-                # Check if it's a visit to a normal resource or a forum (thread)
-                if row['content_key']:
-                    page = Page.objects.get(content_id=row['content_key'], is_forum=False, course_offering=self.course_offering)
-                else:
-                    page = Page.objects.get(content_id=row['forum_key'], is_forum=True, course_offering=self.course_offering)
-            except Page.DoesNotExist:
-                if row['content_key']:
-                    self._add_non_critical_error('Unable to find resource {} for activity'.format(row['content_key']))
-                else:
-                    self._add_non_critical_error('Unable to find forum {} for activity'.format(row['forum_key']))
+            user_pk = self._lookup_user(user_key)
+            if user_pk is None:
+                self._add_error('Unable to find user {} for activity'.format(user_key))
                 continue
 
-            try:
-                visited_at = dateparse.parse_datetime(row['timestamp'])
-                if visited_at is None:
-                    self._add_error('Timestamp {} for access activity is not a valid format'.format(row['timestamp']))
-                    continue
-            except ValueError:
-                self._add_error('Timestamp {} for access activity is not a valid datetime'.format(row['timestamp']))
+            # Check if it's a visit to a normal resource or a forum (thread)
+            if content_key:
+                page = self._lookup_page(content_key, False)
+            else:
+                page = self._lookup_page(forum_key, True)
+            if page is None:
+                if content_key:
+                    self._add_non_critical_error('Unable to find resource {} for activity'.format(content_key))
+                else:
+                    self._add_non_critical_error('Unable to find forum {} for activity'.format(forum_key))
                 continue
 
-            if visited_at < self.course_offering.start_datetime or visited_at > self.course_offering.end_datetime:
-                self._add_error('Timestamp {} for access activity is outside course offering start/end'.format(row['timestamp']))
+            if timestamp_status != TIMESTAMP_VALID:
+                self._add_error(self.ACTIVITY_TIMESTAMP_ERRORS[timestamp_status].format(parsed_activity.bad_timestamps[index]))
                 continue
 
-            batch.append(PageVisit(lms_user=user, page=page, visited_at=visited_at))
+            visited_at = from_epoch_microseconds(visit_time)
+            batch.append(PageVisit(
+                course_offering=self.course_offering, data_version=self.data_version,
+                lms_user_id=user_pk, page_id=page[0], visited_at=visited_at, **time_dimensions(self.course_offering, visited_at)
+            ))
 
-            if len(batch) == batch_size:
-                try:
-                    PageVisit.objects.bulk_create(batch)
-                except IntegrityError as e:
-                    self._add_error('Integrity Error in activity bulk insert: {}'.format(e))
+            if len(batch) == self.activity_batch_size:
+                self._store_visits(batch)
                 batch = []
 
+        self._store_visits(batch)
+
+    def _import_activity_frame(self, parse_chunk):
+        """
+        The columnar equivalent of _import_activity_chunk, for a chunk parsed into a DataFrame by parse_activity_frame.
+        Users and pages are resolved by merging against frames of the lookup maps, and the visits are deduplicated and
+        inserted as whole columns.  The visits, errors and stats are the same as _store_parsed_activity gives.
+        """
+        activity = parse_chunk()
+        activity['row'] = np.arange(len(activity))
+        if self._since_time is not None:
+            skipped = (
+                activity['timestamp_status'].isin([TIMESTAMP_VALID, TIMESTAMP_OUTSIDE_OFFERING]) & (activity['visit_time'] <= self._since_time)
+            )
+            self.skipped_stats['visits'] += int(skipped.sum())
+            activity = activity[~skipped]
+
+        users = pd.DataFrame(list(self._get_user_pk_map().items()), columns=['user_key', 'lms_user_id'])
+        activity = activity.merge(users, how='left', on='user_key')
+        has_user = activity['lms_user_id'].notna()
+        # Counter's += leaves out zero counts, as counting row by row does
+        self.lookup_stats += Counter(user_hits=int(has_user.sum()), user_misses=int((~has_user).sum()))
+        errors = [(row, 'Unable to find user {} for activity'.format(user_key)) for row, user_key in zip(
+            activity['row'][~has_user], activity['user_key'][~has_user],
+        )]
+
+        # Check if it's a visit to a normal resource or a forum (thread)
+        activity = activity[has_user]
+        is_forum = activity['content_key'] == ''
+        # content_id is an integer column; a non-integer key raises ValueError as it does in _lookup_page
+        activity = activity.assign(content_id=activity['content_key'].where(~is_forum, activity['forum_key']).astype(np.int64), is_forum=is_forum)
+        pages = pd.DataFrame(
+            [(content_id, is_forum, page_pk) for (content_id, is_forum), (page_pk, content_type) in self._get_page_pk_map().items()],
+            columns=['content_id', 'is_forum', 'page_id'],
+        )
+        activity = activity.merge(pages.astype({'content_id': np.int64, 'is_forum': bool}), how='left', on=['content_id', 'is_forum'])
+        has_page = activity['page_id'].notna()
+        self.lookup_stats += Counter(page_hits=int(has_page.sum()), page_misses=int((~has_page).sum()))
+        for content_key, forum_key in zip(activity['content_key'][~has_page], activity['forum_key'][~has_page]):
+            if content_key:
+                self._add_non_critical_error('Unable to find resource {} for activity'.format(content_key))
+            else:
+                self._add_non_critical_error('Unable to find forum {} for activity'.format(forum_key))
+
+        activity = activity[has_page]
+        is_valid = activity['timestamp_status'] == TIMESTAMP_VALID
+        errors.extend((row, self.ACTIVITY_TIMESTAMP_ERRORS[status].format(timestamp)) for row, status, timestamp in zip(
+            activity['row'][~is_valid], activity['timestamp_status'][~is_valid], activity['timestamp'][~is_valid],
+        ))
+        for row, error in sorted(errors):
+            self._add_error(error)
+
+        visits = activity.loc[is_valid, ['lms_user_id', 'page_id', 'visit_time']].astype(np.int64)
+        self._store_visit_frame(visits)
+
+    def _store_visit_frame(self, visits):
+        """
+        Inserts visits, a DataFrame of lms_user_id, page_id and visit_time (in microseconds since the epoch) columns
+        """
+        unique_visits = visits.drop_duplicates()
+        # The backend stores naive datetimes in its connection's time zone, so converting the whole column to those
+        # leaves it just formatting each one
+        visited_at = pd.to_datetime(unique_visits['visit_time'].values, unit='us', utc=True).tz_convert(connection.timezone).tz_localize(None)
+        dimensions = time_dimension_columns(self.course_offering, unique_visits['visit_time'].values)
+        rows = zip(
+            itertools.repeat(self.course_offering.pk),
+            itertools.repeat(self.data_version),
+            unique_visits['lms_user_id'].tolist(),
+            unique_visits['page_id'].tolist(),
+            map(connection.ops.adapt_datetimefield_value, visited_at.to_pydatetime()),
+            dimensions['course_week'].tolist(),
+            map(connection.ops.adapt_datefield_value, dimensions['local_date']),
+            dimensions['local_weekday'].tolist(),
+            dimensions['local_hour'].tolist(),
+        )
+        try:
+            inserted, duplicates = bulk_insert_ignore_values(
+                PageVisit, ['course_offering', 'data_version', 'lms_user', 'page', 'visited_at'] + list(TIME_DIMENSION_FIELDS), rows,
+                prepared=True, load_data=self.load_data,
+            )
+        except IntegrityError as e:
+            self._add_error('Integrity Error in visits bulk insert: {}'.format(e))
+            return
+        self.insert_stats['visits inserted'] += inserted
+        self.insert_stats['visits duplicates'] += duplicates + len(visits) - len(unique_visits)
+
+        for lms_user_id, first_visit_time in visits.groupby('lms_user_id')['visit_time'].min().items():
+            self._add_new_visit_time(int(lms_user_id), from_epoch_microseconds(int(first_visit_time)))
+        if not visits.empty:
+            self._add_new_activity(from_epoch_microseconds(int(visits['visit_time'].max())))
+
+    def _store_visits(self, visits):
+        if self._insert_activity('visits', PageVisit, visits):
+            self._add_new_visits(visits)
+
+    def _insert_activity(self, kind, model, objs):
+        """
+        Inserts the batch of activity objs, skipping (and counting) any that are already stored.
+        Returns whether the insert succeeded.
+        """
         try:
-            PageVisit.objects.bulk_create(batch)
+            inserted, duplicates = bulk_insert_ignore(model, objs, load_data=self.load_data)
         except IntegrityError as e:
-            self._add_error('Integrity Error in activity bulk insert: {}'.format(e))
+            self._add_error('Integrity Error in {} bulk insert: {}'.format(kind, e))
+            return False
+        self.insert_stats[kind + ' inserted'] += inserted
+        self.insert_stats[kind + ' duplicates'] += duplicates
+        return True
 
     def _process_posts(self, posts_data):
         """
@@ -443,39 +1196,86 @@ class BlackboardImport(BaseLmsImport):
         if set(posts_data.fieldnames) != set(self.POSTS_FIELDNAMES):
             raise LMSImportFileError(self.POSTS_FILE, 'Posts data columns do not match {}'.format(self.POSTS_FIELDNAMES))
 
+        batch = []
+        # Posts to forums that aren't pages yet, and the thread of the first post to each, which titles its page
+        missing_forum_posts = []
+        missing_forum_titles = OrderedDict()
+
         for row in posts_data:
-            try:
-                user = LMSUser.objects.get(lms_user_id=row['user_key'], course_offering=self.course_offering)
-            except LMSUser.DoesNotExist:
-                self._add_error('Unable to find user {} for post'.format(row['user_key']))
+            timestamp_status, post_time = self._check_timestamp(row['timestamp'])
+            if self._is_already_imported('posts', timestamp_status, post_time):
                 continue
 
-            values = {
-                'title': row['thread'],
-                'content_type': self.FORUM_CONTENT_TYPE,
-                'parent_id': None,
-            }
-            page, _ = Page.objects.get_or_create(content_id=row['forum_key'], is_forum=True, course_offering=self.course_offering, defaults=values)
-
-            # In case page was found already, check it's content type to ensure it is a communication type
-            if page.content_type not in CourseOffering.communication_types():
-                self._add_error('Resource {} for post is not a communication type'.format(page.content_id))
+            user_pk = self._lookup_user(row['user_key'])
+            if user_pk is None:
+                self._add_error('Unable to find user {} for post'.format(row['user_key']))
                 continue
 
-            try:
-                posted_at = dateparse.parse_datetime(row['timestamp'])
-                if posted_at is None:
-                    self._add_error('Timestamp {} for post is not a valid format'.format(row['timestamp']))
-                    continue
-            except ValueError:
-                self._add_error('Timestamp {} for post is not a valid datetime'.format(row['timestamp']))
+            page = self._lookup_page(row['forum_key'], True)
+            if page is None:
+                # Stored once the missing forums' pages are created together
+                missing_forum_titles.setdefault(int(row['forum_key']), row['thread'])
+                missing_forum_posts.append((row, timestamp_status, post_time, user_pk))
                 continue
+            self._add_post(batch, row, timestamp_status, post_time, user_pk, page)
 
-            if posted_at < self.course_offering.start_datetime or posted_at > self.course_offering.end_datetime:
-                self._add_non_critical_error('Timestamp {} for post is outside course offering start/end'.format(row['timestamp']))
-                continue
+        if missing_forum_titles:
+            self._create_forum_pages(missing_forum_titles)
+            page_pk_map = self._get_page_pk_map()
+            for row, timestamp_status, post_time, user_pk in missing_forum_posts:
+                self._add_post(batch, row, timestamp_status, post_time, user_pk, page_pk_map[(int(row['forum_key']), True)])
 
-            try:
-                post = SummaryPost.objects.create(lms_user=user, page=page, posted_at=posted_at)
-            except IntegrityError as e:
-                self._add_error('Integrity Error in post insert: {}'.format(e))
+        self._insert_activity('posts', SummaryPost, batch)
+
+    def _create_forum_pages(self, titles):
+        """
+        Bulk inserts a page for each forum in titles (a dict of content_id -> title), and reloads the page map to add them
+        """
+        forum_pages = [
+            Page(
+                content_id=content_id,
+                is_forum=True,
+                course_offering=self.course_offering,
+                data_version=self.data_version,
+                title=title,
+                content_type=self.FORUM_CONTENT_TYPE,
+                parent_id=None,
+            )
+            for content_id, title in titles.items()
+        ]
+        Page.objects.bulk_create(forum_pages, batch_size=bulk_create_batch_size(Page, self.BULK_CREATE_BATCH_SIZE))
+        self._page_pk_map = None
+
+    def _add_post(self, batch, row, timestamp_status, post_time, user_pk, page):
+        """
+        Adds the post in row to batch, given its timestamp's status and time and its user's and page's pks, inserting the
+        batch once it's full
+        """
+        page_pk, content_type = page
+
+        # In case page was found already, check it's content type to ensure it is a communication type
+        if content_type not in CourseOffering.communication_types():
+            self._add_error('Resource {} for post is not a communication type'.format(int(row['forum_key'])))
+            return
+
+        if timestamp_status == TIMESTAMP_INVALID_FORMAT:
+            self._add_error('Timestamp {} for post is not a valid format'.format(row['timestamp']))
+            return
+        if timestamp_status == TIMESTAMP_INVALID_DATETIME:
+            self._add_error('Timestamp {} for post is not a valid datetime'.format(row['timestamp']))
+            return
+        if timestamp_status == TIMESTAMP_OUTSIDE_OFFERING:
+            self._add_non_critical_error('Timestamp {} for post is outside course offering start/end'.format(row['timestamp']))
+            return
+
+        posted_at = from_epoch_microseconds(post_time)
+
+        batch.append(SummaryPost(
+            course_offering=self.course_offering, data_version=self.data_version,
+            lms_user_id=user_pk, page_id=page_pk, posted_at=posted_at, **time_dimensions(self.course_offering, posted_at)
+        ))
+        self._add_new_activity(posted_at)
+
+        if len(batch) == self.activity_batch_size:
+            self._insert_activity('posts', SummaryPost, batch)
+            del batch[:]
@@ -0,0 +1,94 @@
+from contextlib import redirect_stdout
+import io
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import transaction
+
+from dashboard.models import CourseOffering
+from olap.lms_import import BlackboardImport
+from olap.lms_import import ImportLmsData
+from olap.models import ImportCheckpoint
+from olap.models import PageVisit
+
+
+class Command(BaseCommand):
+    help = "Time the row by row and columnar activity imports of an LMS export file, and check that they agree"
+
+    def add_arguments(self, parser):
+        parser.add_argument('offering_code', type=str)
+        parser.add_argument('import_file', type=str)
+
+        parser.add_argument('--load-data',
+            action='store_true',
+            dest='load_data',
+            default=None,
+            help='Load the activity with LOAD DATA LOCAL INFILE in both modes (default CLOOP_IMPORT_LOAD_DATA; MySQL only).',
+        )
+
+        parser.add_argument('--repeat',
+            type=int,
+            dest='repeat',
+            default=1,
+            help='Number of times to import the file in each mode; the fastest time is reported (default 1).',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            course_offering = CourseOffering.objects.get(code=options['offering_code'])
+        except CourseOffering.DoesNotExist:
+            raise CommandError('There is no course offering with a code of "{}".'.format(options['offering_code']))
+        if options['repeat'] < 1:
+            raise CommandError('--repeat must be at least 1.')
+
+        timings = {}
+        results = {}
+        for columnar_activity in (False, True):
+            mode = 'columnar' if columnar_activity else 'row by row'
+            for _ in range(options['repeat']):
+                seconds, results[mode] = self.import_file(course_offering, options['import_file'], columnar_activity, options['load_data'])
+                timings[mode] = min(seconds, timings.get(mode, seconds))
+            self.stdout.write('{}: {:.2f}s, {} visits inserted'.format(mode.capitalize(), timings[mode], results[mode]['insert_stats']['visits inserted']))
+
+        for name in results['row by row']:
+            if results['row by row'][name] != results['columnar'][name]:
+                raise CommandError('The columnar import gave different {} to the row by row import.'.format(name.replace('_', ' ')))
+        self.stdout.write('Columnar import is {:.2f}x the speed of row by row, with the same results.'.format(timings['row by row'] / timings['columnar']))
+
+    def import_file(self, course_offering, import_file, columnar_activity, load_data=None):
+        """
+        Imports import_file into a new data version of course_offering, then rolls it back.  Returns the seconds taken by
+        the activity phase, and a dict of what was imported.
+        """
+        with transaction.atomic():
+            data_version = ImportLmsData(course_offering, import_file)._get_new_data_version()
+            checkpoint = ImportCheckpoint(course_offering=course_offering, data_version=data_version)
+            lms_import = BlackboardImport(
+                import_file, course_offering, data_version=data_version, columnar_activity=columnar_activity, load_data=load_data,
+            )
+
+            with redirect_stdout(io.StringIO()):
+                activity_started_at = time.perf_counter()
+                try:
+                    for phase, activity_offset, process_unit in lms_import.iter_import_units(checkpoint):
+                        process_unit()
+                        if phase != ImportCheckpoint.PHASE_ACTIVITY:
+                            activity_started_at = time.perf_counter()
+                finally:
+                    lms_import.close()
+                seconds = time.perf_counter() - activity_started_at
+
+            # The visits are compared by their keys, as the users and pages are new rows in each run
+            visits = PageVisit.objects.for_offering(course_offering, data_version).values_list(
+                'lms_user__lms_user_id', 'page__content_id', 'page__is_forum', 'visited_at',
+            )
+            results = {
+                'visits': set(visits),
+                'errors': lms_import.error_list,
+                'non_critical_errors': lms_import.non_critical_error_list,
+                'insert_stats': lms_import.insert_stats,
+                'lookup_stats': lms_import.lookup_stats,
+            }
+            transaction.set_rollback(True)
+        return seconds, results
@@ -29,6 +29,20 @@ class Command(BaseCommand):
             help='Clear data from db instead of importing it into db.',
         )
 
+        parser.add_argument('--delta',
+            action='store_true',
+            dest='delta',
+            default=False,
+            help='Only import activity after the last activity already imported for each course offering.',
+        )
+
+        parser.add_argument('--shadow',
+            action='store_true',
+            dest='shadow',
+            default=False,
+            help='Import into a new version of each course offering\'s data, which replaces the current one once complete.',
+        )
+
         parser.add_argument('--trace',
             action='store_true',
             dest='trace',
@@ -43,6 +57,11 @@ class Command(BaseCommand):
         course_import_metadata = get_course_import_metadata()
         all_course_codes = course_import_metadata['courses'].keys()
 
+        if options['clear'] and options['delta']:
+            raise CommandError('--delta cannot be specified at the same time as --clear.')
+        if options['shadow'] and (options['clear'] or options['delta']):
+            raise CommandError('--shadow cannot be specified at the same time as --clear or --delta.')
+
         if options['all']:
             if len(requested_course_codes) > 0:
                 raise CommandError('Course offering codes cannot be specified at the same time as --all.')
@@ -74,13 +93,13 @@ class Command(BaseCommand):
             try:
                 course_offering = CourseOffering.objects.get(code=course_code)
                 course_offering.is_importing = True
-                course_offering.save()
-                import_olap_task.delay(course_offering.id, course_import_metadata['courses'][course_code]['filename'], just_clear=options['clear'])
+                course_offering.save(update_fields=['is_importing'])
+                import_olap_task.delay(course_offering.id, course_import_metadata['courses'][course_code]['filename'], just_clear=options['clear'], delta=options['delta'], shadow=options['shadow'])
             except:
                 # Reset the course offering
                 if course_offering:
                     course_offering.is_importing = False
-                    course_offering.save()
+                    course_offering.save(update_fields=['is_importing'])
 
                 error_count += 1
                 self.stderr.write('An error occurred when {}ing the data for {}:'.format(verb, course_code))
@@ -0,0 +1,91 @@
+import sys
+import traceback
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from dashboard.models import CourseOffering
+from olap.lms_import import ImportLmsData
+from olap.tasks import resessionize_olap_task
+
+
+class Command(BaseCommand):
+    help = "Rebuild the LMS sessions of one or more course offerings, using a given session length"
+
+    def add_arguments(self, parser):
+        parser.add_argument('offering_code', nargs='*', type=str)
+
+        parser.add_argument('--all',
+            action='store_true',
+            dest='all',
+            default=False,
+            help='Rebuild sessions for all course offerings.',
+        )
+
+        parser.add_argument('--gap',
+            type=int,
+            dest='gap',
+            default=ImportLmsData.SESSION_LENGTH_MINS,
+            help='Minutes between visits after which a new session starts (default {}).'.format(ImportLmsData.SESSION_LENGTH_MINS),
+        )
+
+        parser.add_argument('--trace',
+            action='store_true',
+            dest='trace',
+            default=False,
+            help='Show a diagnostic trace on error.',
+        )
+
+    def handle(self, *args, **options):
+        requested_course_codes = options['offering_code']
+        if options['gap'] < 0:
+            raise CommandError('The session gap cannot be negative.')
+
+        if options['all']:
+            if len(requested_course_codes) > 0:
+                raise CommandError('Course offering codes cannot be specified at the same time as --all.')
+            course_offerings = list(CourseOffering.objects.all())
+        else:
+            if len(requested_course_codes) == 0:
+                raise CommandError('Please supply the code of the course offering to resessionize.')
+
+            course_offerings = list(CourseOffering.objects.filter(code__in=requested_course_codes))
+            found_course_codes = {course_offering.code for course_offering in course_offerings}
+            missing_course_codes = [course_code for course_code in requested_course_codes if course_code not in found_course_codes]
+            if missing_course_codes:
+                for course_code in missing_course_codes:
+                    self.stderr.write('There is no course offering with a code of "{}".'.format(course_code))
+                raise CommandError('Resessionize not done.')
+
+        if len(course_offerings) == 0:
+            raise CommandError('Cannot resessionize because there are no course offerings.')
+
+        error_count = 0
+        for course_offering in course_offerings:
+            if course_offering.is_importing:
+                error_count += 1
+                self.stderr.write('Skipping {} because its data is being imported.'.format(course_offering.code))
+                continue
+
+            try:
+                course_offering.is_importing = True
+                course_offering.save(update_fields=['is_importing'])
+                resessionize_olap_task.delay(course_offering.id, options['gap'])
+            except:
+                # Reset the course offering
+                course_offering.is_importing = False
+                course_offering.save(update_fields=['is_importing'])
+
+                error_count += 1
+                self.stderr.write('An error occurred when resessionizing the data for {}:'.format(course_offering.code))
+                if not options['trace']:
+                    self.stdout.write('Run again with --trace to show a diagnostic trace.')
+                else:
+                    exc_info = sys.exc_info()
+                    traceback.print_exception(*exc_info)
+
+        plural_errors = error_count != 1
+        if error_count == 0:
+            self.stdout.write('Resessionized {} course offering{}.'.format(len(course_offerings), 's' if len(course_offerings) != 1 else ''))
+        else:
+            self.stderr.write('{} resessionize{} out of {} {} unsuccessful.'.format(error_count, 's' if plural_errors else '', len(course_offerings), 'were' if plural_errors else 'was'))
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0013_course_offering_start_date_help_text'),
+        ('olap', '0020_really_really_change_SubmissionAttempt_grade_to_Decimal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('filename', models.CharField(max_length=255)),
+                ('fingerprint', models.CharField(max_length=255)),
+                ('phase', models.CharField(choices=[('users', 'Users'), ('resources', 'Resources'), ('posts', 'Posts'), ('submission_attempts', 'Submission attempts'), ('activity', 'Activity'), ('sessions', 'Sessions')], default='users', max_length=30)),
+                ('activity_offset', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course_offering', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='importcheckpoint',
+            unique_together=set([('course_offering', 'filename')]),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0014_course_offering_data_version'),
+        ('olap', '0021_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importcheckpoint',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lmssession',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='lmsuser',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AlterUniqueTogether(
+            name='lmsuser',
+            unique_together=set([('course_offering', 'data_version', 'lms_user_id')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='page',
+            unique_together=set([('course_offering', 'data_version', 'content_id', 'is_forum')]),
+        ),
+    ]
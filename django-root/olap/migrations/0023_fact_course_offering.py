@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def copy_page_offering(apps, schema_editor):
+    """
+    Copies each visit, attempt and post's course_offering and data_version from its page
+    """
+    Page = apps.get_model('olap', 'Page')
+    for model_name in ('PageVisit', 'SubmissionAttempt', 'SummaryPost'):
+        model = apps.get_model('olap', model_name)
+        page = Page.objects.filter(pk=models.OuterRef('page_id'))
+        model.objects.update(
+            course_offering=models.Subquery(page.values('course_offering')[:1]),
+            data_version=models.Subquery(page.values('data_version')[:1]),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0014_course_offering_data_version'),
+        ('olap', '0022_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagevisit',
+            name='course_offering',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering'),
+        ),
+        migrations.AddField(
+            model_name='pagevisit',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='submissionattempt',
+            name='course_offering',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering'),
+        ),
+        migrations.AddField(
+            model_name='submissionattempt',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='summarypost',
+            name='course_offering',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering'),
+        ),
+        migrations.AddField(
+            model_name='summarypost',
+            name='data_version',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(copy_page_offering, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='pagevisit',
+            name='course_offering',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering'),
+        ),
+        migrations.AlterField(
+            model_name='submissionattempt',
+            name='course_offering',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering'),
+        ),
+        migrations.AlterField(
+            model_name='summarypost',
+            name='course_offering',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering'),
+        ),
+        migrations.AddIndex(
+            model_name='pagevisit',
+            index=models.Index(fields=['course_offering', 'data_version', 'visited_at'], name='olap_pagevi_course__0ff885_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pagevisit',
+            index=models.Index(fields=['course_offering', 'data_version', 'lms_user', 'visited_at'], name='olap_pagevi_course__129287_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pagevisit',
+            index=models.Index(fields=['course_offering', 'data_version', 'page', 'visited_at'], name='olap_pagevi_course__7f08de_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionattempt',
+            index=models.Index(fields=['course_offering', 'data_version', 'attempted_at'], name='olap_submis_course__a11871_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionattempt',
+            index=models.Index(fields=['course_offering', 'data_version', 'lms_user', 'attempted_at'], name='olap_submis_course__b6cbb7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionattempt',
+            index=models.Index(fields=['course_offering', 'data_version', 'page', 'attempted_at'], name='olap_submis_course__fbfdb2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='summarypost',
+            index=models.Index(fields=['course_offering', 'data_version', 'posted_at'], name='olap_summar_course__32d4c0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='summarypost',
+            index=models.Index(fields=['course_offering', 'data_version', 'lms_user', 'posted_at'], name='olap_summar_course__aa1b5e_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='summarypost',
+            index=models.Index(fields=['course_offering', 'data_version', 'page', 'posted_at'], name='olap_summar_course__c5cf85_idx'),
+        ),
+    ]
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import Max
+from django.db.models import Min
+from django.utils import timezone
+
+# Time zone offsets are whole quarter hours, so the local date and hour of a time is the same across each UTC quarter hour
+QUARTER_HOUR = datetime.timedelta(minutes=15)
+
+
+def add_time_dimensions(apps, schema_editor):
+    """
+    Sets the time dimensions of existing activity.  Rather than updating rows one by one, each local hour of each data
+    version's activity is updated at once.
+    """
+    our_tz = timezone.get_default_timezone()
+    CourseOffering = apps.get_model('dashboard', 'CourseOffering')
+
+    def time_dimensions(course_offering, dt):
+        local_dt = timezone.localtime(dt, our_tz)
+        return {
+            'course_week': (local_dt.date() - course_offering.start_date).days // 7,
+            'local_date': local_dt.date(),
+            'local_weekday': local_dt.weekday(),
+            'local_hour': local_dt.hour,
+        }
+
+    for model_name, time_field in (('PageVisit', 'visited_at'), ('SubmissionAttempt', 'attempted_at'), ('SummaryPost', 'posted_at')):
+        model = apps.get_model('olap', model_name)
+        for course_offering in CourseOffering.objects.all():
+            data_versions = model.objects.filter(course_offering=course_offering).values_list('data_version', flat=True).distinct()
+            for data_version in data_versions:
+                activity = model.objects.filter(course_offering=course_offering, data_version=data_version)
+                times = activity.aggregate(first=Min(time_field), last=Max(time_field))
+                start = times['first'].replace(minute=times['first'].minute // 15 * 15, second=0, microsecond=0)
+                while start <= times['last']:
+                    dimensions = time_dimensions(course_offering, start)
+                    end = start + QUARTER_HOUR
+                    while end <= times['last'] and time_dimensions(course_offering, end) == dimensions:
+                        end += QUARTER_HOUR
+                    activity.filter(**{time_field + '__gte': start, time_field + '__lt': end}).update(**dimensions)
+                    start = end
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('olap', '0023_fact_course_offering'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pagevisit',
+            name='course_week',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='pagevisit',
+            name='local_date',
+            field=models.DateField(default=datetime.date(1970, 1, 1)),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='pagevisit',
+            name='local_weekday',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='pagevisit',
+            name='local_hour',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='submissionattempt',
+            name='course_week',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='submissionattempt',
+            name='local_date',
+            field=models.DateField(default=datetime.date(1970, 1, 1)),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='submissionattempt',
+            name='local_weekday',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='submissionattempt',
+            name='local_hour',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='summarypost',
+            name='course_week',
+            field=models.IntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='summarypost',
+            name='local_date',
+            field=models.DateField(default=datetime.date(1970, 1, 1)),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='summarypost',
+            name='local_weekday',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='summarypost',
+            name='local_hour',
+            field=models.SmallIntegerField(default=0),
+            preserve_default=False,
+        ),
+        migrations.RunPython(add_time_dimensions, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='pagevisit',
+            index=models.Index(fields=['course_offering', 'data_version', 'course_week', 'local_weekday'], name='olap_pagevi_course__b2c90c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pagevisit',
+            index=models.Index(fields=['course_offering', 'data_version', 'local_date', 'local_hour'], name='olap_pagevi_course__bf7239_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionattempt',
+            index=models.Index(fields=['course_offering', 'data_version', 'course_week', 'local_weekday'], name='olap_submis_course__b553d9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='submissionattempt',
+            index=models.Index(fields=['course_offering', 'data_version', 'local_date', 'local_hour'], name='olap_submis_course__9a04a9_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='summarypost',
+            index=models.Index(fields=['course_offering', 'data_version', 'course_week', 'local_weekday'], name='olap_summar_course__c4c20b_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='summarypost',
+            index=models.Index(fields=['course_offering', 'data_version', 'local_date', 'local_hour'], name='olap_summar_course__20b656_idx'),
+        ),
+    ]
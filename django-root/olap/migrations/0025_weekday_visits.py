@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def summarise_visits(apps, schema_editor):
+    """
+    Counts the existing visits by page and by user, and course week and weekday
+    """
+    PageVisit = apps.get_model('olap', 'PageVisit')
+    for model_name, dimension in (('PageVisitsByWeekday', 'page_id'), ('LMSUserVisitsByWeekday', 'lms_user_id')):
+        model = apps.get_model('olap', model_name)
+        field_names = ['course_offering_id', 'data_version', dimension, 'course_week', 'local_weekday']
+        cells = PageVisit.objects.values_list(*field_names).annotate(visits=Count('id')).order_by()
+        model.objects.bulk_create(
+            (model(**dict(zip(field_names + ['visits'], cell))) for cell in cells.iterator()),
+            batch_size=500,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0014_course_offering_data_version'),
+        ('olap', '0024_time_dimensions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LMSUserVisitsByWeekday',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_version', models.IntegerField(default=0)),
+                ('course_week', models.IntegerField()),
+                ('local_weekday', models.SmallIntegerField()),
+                ('visits', models.IntegerField()),
+                ('course_offering', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering')),
+                ('lms_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='olap.LMSUser')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PageVisitsByWeekday',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_version', models.IntegerField(default=0)),
+                ('course_week', models.IntegerField()),
+                ('local_weekday', models.SmallIntegerField()),
+                ('visits', models.IntegerField()),
+                ('course_offering', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='olap.Page')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pagevisitsbyweekday',
+            unique_together=set([('course_offering', 'data_version', 'page', 'course_week', 'local_weekday')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='lmsuservisitsbyweekday',
+            unique_together=set([('course_offering', 'data_version', 'lms_user', 'course_week', 'local_weekday')]),
+        ),
+        migrations.RunPython(summarise_visits, migrations.RunPython.noop),
+    ]
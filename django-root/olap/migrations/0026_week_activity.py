@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def summarise_activity(apps, schema_editor):
+    """
+    Counts the existing activity by page and by user, and course week
+    """
+    activity_models = (('PageVisit', 'visits'), ('SummaryPost', 'posts'), ('SubmissionAttempt', 'attempts'))
+    for model_name, dimension in (('PageActivityByWeek', 'page_id'), ('LMSUserActivityByWeek', 'lms_user_id')):
+        model = apps.get_model('olap', model_name)
+        cells = {}
+        for activity_model_name, count_name in activity_models:
+            counts = {count_name: Count('id')}
+            if model_name == 'PageActivityByWeek' and count_name == 'visits':
+                counts['users'] = Count('lms_user', distinct=True)
+            activity = apps.get_model('olap', activity_model_name).objects
+            for cell_counts in activity.values('course_offering_id', 'data_version', dimension, 'course_week').annotate(**counts).order_by().iterator():
+                key = tuple(cell_counts.pop(name) for name in ('course_offering_id', 'data_version', dimension, 'course_week'))
+                cell = cells.setdefault(key, model(course_offering_id=key[0], data_version=key[1], course_week=key[3], **{dimension: key[2]}))
+                for name, count in cell_counts.items():
+                    setattr(cell, name, count)
+        model.objects.bulk_create(cells.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('dashboard', '0014_course_offering_data_version'),
+        ('olap', '0025_weekday_visits'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LMSUserActivityByWeek',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_version', models.IntegerField(default=0)),
+                ('course_week', models.IntegerField()),
+                ('visits', models.IntegerField(default=0)),
+                ('posts', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('course_offering', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering')),
+                ('lms_user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='olap.LMSUser')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PageActivityByWeek',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_version', models.IntegerField(default=0)),
+                ('course_week', models.IntegerField()),
+                ('visits', models.IntegerField(default=0)),
+                ('users', models.IntegerField(default=0)),
+                ('posts', models.IntegerField(default=0)),
+                ('attempts', models.IntegerField(default=0)),
+                ('course_offering', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='dashboard.CourseOffering')),
+                ('page', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='olap.Page')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pageactivitybyweek',
+            unique_together=set([('course_offering', 'data_version', 'page', 'course_week')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='lmsuseractivitybyweek',
+            unique_together=set([('course_offering', 'data_version', 'lms_user', 'course_week')]),
+        ),
+        migrations.RunPython(summarise_activity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('olap', '0026_week_activity'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='importcheckpoint',
+            name='phase',
+            field=models.CharField(choices=[('users', 'Users'), ('resources', 'Resources'), ('posts', 'Posts'), ('submission_attempts', 'Submission attempts'), ('activity', 'Activity'), ('sessions', 'Sessions'), ('summaries', 'Summaries')], default='users', max_length=30),
+        ),
+    ]
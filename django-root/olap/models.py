@@ -2,6 +2,53 @@ from django.db import models
 from django.db.models.aggregates import Max
 
 from dashboard.models import CourseOffering
+from olap.time_dimensions import course_week
+from olap.time_dimensions import time_dimensions
+
+
+class OfferingDataQuerySet(models.QuerySet):
+    """
+    Queryset for OLAP data, which is stored by course offering and data version.  Models using it have course_offering
+    and data_version fields (on the fact tables, copies of their page's, so they can be filtered without a join).
+    """
+    def for_offering(self, course_offering, data_version=None):
+        """
+        Returns the data in the given version of course_offering's data, by default the published version
+        """
+        if data_version is None:
+            data_version = course_offering.data_version
+        return self.filter(course_offering=course_offering, data_version=data_version)
+
+
+class TimeDimensionsMixin(object):
+    """
+    Mixin for the activity models, which store the course week, local date, weekday and hour of their activity_time_field
+    (see olap.time_dimensions).  These are set on save; bulk inserts must set them themselves.
+    """
+    activity_time_field = None
+
+    def save(self, *args, **kwargs):
+        self.set_time_dimensions()
+        super().save(*args, **kwargs)
+
+    def set_time_dimensions(self):
+        for name, value in time_dimensions(self.course_offering, getattr(self, self.activity_time_field)).items():
+            setattr(self, name, value)
+
+    @classmethod
+    def update_course_weeks(cls, course_offering):
+        """
+        Recalculates the course weeks of course_offering's activity (in all its data versions), eg. after its start date
+        has changed.  Returns the number of rows updated.
+        """
+        activity = cls.objects.filter(course_offering=course_offering)
+        local_dates_by_week = {}
+        for local_date in activity.values_list('local_date', flat=True).distinct():
+            local_dates_by_week.setdefault(course_week(course_offering, local_date), []).append(local_date)
+        updated = 0
+        for week, local_dates in local_dates_by_week.items():
+            updated += activity.filter(local_date__in=local_dates).exclude(course_week=week).update(course_week=week)
+        return updated
 
 
 # CREATE TABLE `summary_courses` (
@@ -66,13 +113,16 @@ class LMSUser(models.Model):
     lms_user_id = models.CharField(max_length=255)
     username = models.CharField(max_length=255)
     course_offering = models.ForeignKey(CourseOffering)
+    data_version = models.IntegerField(default=0)
     firstname = models.CharField(max_length=255, blank=True)
     lastname = models.CharField(max_length=255, blank=True)
     role = models.CharField(max_length=255, blank=True)
     email = models.EmailField(max_length=255, blank=True)
 
     class Meta:
-        unique_together = (('course_offering', 'lms_user_id'), )
+        unique_together = (('course_offering', 'data_version', 'lms_user_id'), )
+
+    objects = OfferingDataQuerySet.as_manager()
 
     def __str__(self):
         name = self.full_name()
@@ -105,15 +155,33 @@ class LMSUser(models.Model):
 #   `info` varchar(5000) DEFAULT NULL,
 #   `session_id` int(11) DEFAULT NULL
 # ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
-class PageVisit(models.Model):
+class PageVisit(TimeDimensionsMixin, models.Model):
+    activity_time_field = 'visited_at'
+
+    # Copied from page, so visits can be filtered by offering without joining pages (indexed below)
+    course_offering = models.ForeignKey(CourseOffering, db_index=False)
+    data_version = models.IntegerField(default=0)
     lms_activity_id = models.CharField(max_length=255)
     visited_at = models.DateTimeField()
+    course_week = models.IntegerField()
+    local_date = models.DateField()
+    local_weekday = models.SmallIntegerField()  # Monday is 0
+    local_hour = models.SmallIntegerField()
     lms_user = models.ForeignKey(LMSUser)
     page = models.ForeignKey('Page')
     session = models.ForeignKey('LMSSession', blank=True, null=True) # We need to allow blank to cater for period before sessions are calculated.
 
     class Meta:
         unique_together = (('lms_user', 'page', 'visited_at'), )
+        indexes = [
+            models.Index(fields=['course_offering', 'data_version', 'visited_at']),
+            models.Index(fields=['course_offering', 'data_version', 'lms_user', 'visited_at']),
+            models.Index(fields=['course_offering', 'data_version', 'page', 'visited_at']),
+            models.Index(fields=['course_offering', 'data_version', 'course_week', 'local_weekday']),
+            models.Index(fields=['course_offering', 'data_version', 'local_date', 'local_hour']),
+        ]
+
+    objects = OfferingDataQuerySet.as_manager()
 
     # TODO: There's several fields here which are candidates for removal/alteration.  Audit.
     module = models.CharField(blank=True, max_length=255) # Is this always a resource/x-bb-* content type?
@@ -141,6 +209,7 @@ class Page(models.Model):
     PAGE_TYPE_ASSESSMENT = 'assessment'
 
     course_offering = models.ForeignKey(CourseOffering)
+    data_version = models.IntegerField(default=0)
     content_type = models.CharField(max_length=255)
     content_id = models.IntegerField()
     is_forum = models.BooleanField(default=False)   # Defines whether content_id is from the resources or the forums
@@ -149,7 +218,9 @@ class Page(models.Model):
     title = models.TextField()
 
     class Meta:
-        unique_together = (('course_offering', 'content_id', 'is_forum'), )
+        unique_together = (('course_offering', 'data_version', 'content_id', 'is_forum'), )
+
+    objects = OfferingDataQuerySet.as_manager()
 
     def get_page_type(self):
         if self.content_type in CourseOffering.communication_types():
@@ -186,10 +257,13 @@ class Page(models.Model):
 class LMSSession(models.Model):
     # Not strictly needed (since we can find course_offering by .first_visit.page.course_offering, but it will make queries easier.
     course_offering = models.ForeignKey(CourseOffering)
+    data_version = models.IntegerField(default=0)
     session_length_in_mins = models.IntegerField()
     pageviews = models.IntegerField()
     first_visit = models.ForeignKey(PageVisit)
 
+    objects = OfferingDataQuerySet.as_manager()
+
     """
     @staticmethod
     def get_next_session_id():
@@ -226,15 +300,33 @@ class LMSSession(models.Model):
 #   `grade` varchar(50) NOT NULL,
 #   `unixtimestamp` int(11) NOT NULL
 # ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
-class SubmissionAttempt(models.Model):
+class SubmissionAttempt(TimeDimensionsMixin, models.Model):
+    activity_time_field = 'attempted_at'
+
+    # Copied from page, as for PageVisit
+    course_offering = models.ForeignKey(CourseOffering, db_index=False)
+    data_version = models.IntegerField(default=0)
     attempt_key = models.CharField(max_length=255)
     attempted_at = models.DateTimeField()
+    course_week = models.IntegerField()
+    local_date = models.DateField()
+    local_weekday = models.SmallIntegerField()  # Monday is 0
+    local_hour = models.SmallIntegerField()
     page = models.ForeignKey(Page) # Was called content_id
     lms_user = models.ForeignKey(LMSUser)
     grade = models.DecimalField(decimal_places=4, max_digits=7) # Up to 999.9999
 
     class Meta:
         unique_together = (('lms_user', 'page', 'attempted_at'),)
+        indexes = [
+            models.Index(fields=['course_offering', 'data_version', 'attempted_at']),
+            models.Index(fields=['course_offering', 'data_version', 'lms_user', 'attempted_at']),
+            models.Index(fields=['course_offering', 'data_version', 'page', 'attempted_at']),
+            models.Index(fields=['course_offering', 'data_version', 'course_week', 'local_weekday']),
+            models.Index(fields=['course_offering', 'data_version', 'local_date', 'local_hour']),
+        ]
+
+    objects = OfferingDataQuerySet.as_manager()
 
 
 # CREATE TABLE `dim_submissiontypes` (
@@ -371,13 +463,31 @@ class SummaryParticipatingUsersByDayInWeek(models.Model):
 #   `discussion_id` int(11) NOT NULL,
 #   `user_id` int(11) NOT NULL
 # ) ENGINE=InnoDB DEFAULT CHARSET=latin1;
-class SummaryPost(models.Model):
+class SummaryPost(TimeDimensionsMixin, models.Model):
+    activity_time_field = 'posted_at'
+
+    # Copied from page, as for PageVisit
+    course_offering = models.ForeignKey(CourseOffering, db_index=False)
+    data_version = models.IntegerField(default=0)
     page = models.ForeignKey('Page')
     lms_user = models.ForeignKey(LMSUser)
     posted_at = models.DateTimeField()
+    course_week = models.IntegerField()
+    local_date = models.DateField()
+    local_weekday = models.SmallIntegerField()  # Monday is 0
+    local_hour = models.SmallIntegerField()
 
     class Meta:
         unique_together = (('lms_user', 'page', 'posted_at'),)
+        indexes = [
+            models.Index(fields=['course_offering', 'data_version', 'posted_at']),
+            models.Index(fields=['course_offering', 'data_version', 'lms_user', 'posted_at']),
+            models.Index(fields=['course_offering', 'data_version', 'page', 'posted_at']),
+            models.Index(fields=['course_offering', 'data_version', 'course_week', 'local_weekday']),
+            models.Index(fields=['course_offering', 'data_version', 'local_date', 'local_hour']),
+        ]
+
+    objects = OfferingDataQuerySet.as_manager()
 
 
 # CREATE TABLE `Summary_SessionAverageLengthByDayInWeek` (
@@ -446,3 +556,134 @@ class SummaryUniquePageViewsByDayInWeek(models.Model):
     date_dayinweek = models.IntegerField()
     pageviews = models.IntegerField(default=0)
     course_offering = models.ForeignKey(CourseOffering)
+
+
+class PageVisitsByWeekday(models.Model):
+    """
+    Count of the visits to a page on a weekday of a course week.  Summarised from PageVisit when an import finishes
+    (see olap.cubes), so the events views needn't read the visits themselves.
+    """
+    dimension = 'page'
+
+    course_offering = models.ForeignKey(CourseOffering, db_index=False)
+    data_version = models.IntegerField(default=0)
+    page = models.ForeignKey(Page)
+    course_week = models.IntegerField()
+    local_weekday = models.SmallIntegerField()  # Monday is 0
+    visits = models.IntegerField()
+
+    class Meta:
+        unique_together = (('course_offering', 'data_version', 'page', 'course_week', 'local_weekday'), )
+
+    objects = OfferingDataQuerySet.as_manager()
+
+
+class LMSUserVisitsByWeekday(models.Model):
+    """
+    Count of a user's visits on a weekday of a course week.  See PageVisitsByWeekday.
+    """
+    dimension = 'lms_user'
+
+    course_offering = models.ForeignKey(CourseOffering, db_index=False)
+    data_version = models.IntegerField(default=0)
+    lms_user = models.ForeignKey(LMSUser)
+    course_week = models.IntegerField()
+    local_weekday = models.SmallIntegerField()  # Monday is 0
+    visits = models.IntegerField()
+
+    class Meta:
+        unique_together = (('course_offering', 'data_version', 'lms_user', 'course_week', 'local_weekday'), )
+
+    objects = OfferingDataQuerySet.as_manager()
+
+
+class PageActivityByWeek(models.Model):
+    """
+    Counts of the activity on a page in a course week.  Summarised from the activity when an import finishes (see
+    olap.cubes).
+    """
+    dimension = 'page'
+
+    course_offering = models.ForeignKey(CourseOffering, db_index=False)
+    data_version = models.IntegerField(default=0)
+    page = models.ForeignKey(Page)
+    course_week = models.IntegerField()
+    visits = models.IntegerField(default=0)
+    users = models.IntegerField(default=0)  # Distinct users visiting the page in the week
+    posts = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('course_offering', 'data_version', 'page', 'course_week'), )
+
+    objects = OfferingDataQuerySet.as_manager()
+
+
+class LMSUserActivityByWeek(models.Model):
+    """
+    Counts of a user's activity in a course week.  See PageActivityByWeek.
+    """
+    dimension = 'lms_user'
+
+    course_offering = models.ForeignKey(CourseOffering, db_index=False)
+    data_version = models.IntegerField(default=0)
+    lms_user = models.ForeignKey(LMSUser)
+    course_week = models.IntegerField()
+    visits = models.IntegerField(default=0)
+    posts = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('course_offering', 'data_version', 'lms_user', 'course_week'), )
+
+    objects = OfferingDataQuerySet.as_manager()
+
+
+class ImportCheckpoint(models.Model):
+    """
+    Progress through the import of an LMS export file into a version of a course offering's data (a new version for a
+    shadow import, otherwise the published one), so a failed import can be resumed.  Each phase, and each chunk of the
+    activity phase, is committed together with the update to its checkpoint.  The summaries phase is committed along
+    with the checkpoint's deletion.
+    """
+    PHASE_USERS = 'users'
+    PHASE_RESOURCES = 'resources'
+    PHASE_POSTS = 'posts'
+    PHASE_SUBMISSION_ATTEMPTS = 'submission_attempts'
+    PHASE_ACTIVITY = 'activity'
+    PHASE_SESSIONS = 'sessions'
+    PHASE_SUMMARIES = 'summaries'
+    PHASES = (PHASE_USERS, PHASE_RESOURCES, PHASE_POSTS, PHASE_SUBMISSION_ATTEMPTS, PHASE_ACTIVITY, PHASE_SESSIONS, PHASE_SUMMARIES)
+    PHASE_CHOICES = (
+        (PHASE_USERS, 'Users'),
+        (PHASE_RESOURCES, 'Resources'),
+        (PHASE_POSTS, 'Posts'),
+        (PHASE_SUBMISSION_ATTEMPTS, 'Submission attempts'),
+        (PHASE_ACTIVITY, 'Activity'),
+        (PHASE_SESSIONS, 'Sessions'),
+        (PHASE_SUMMARIES, 'Summaries'),
+    )
+
+    course_offering = models.ForeignKey(CourseOffering)
+    filename = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=255)  # Identifies the contents of the file
+    data_version = models.IntegerField(default=0)  # The version of the offering's data being imported into
+    phase = models.CharField(max_length=30, choices=PHASE_CHOICES, default=PHASE_USERS)  # The first unfinished phase
+    activity_offset = models.BigIntegerField(default=0)  # Bytes of the activity file that have been imported
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = (('course_offering', 'filename'), )
+
+    def has_finished(self, phase):
+        return self.PHASES.index(phase) < self.PHASES.index(self.phase)
+
+    def record_progress(self, phase, activity_offset=None):
+        """
+        Records that phase has finished, or for the activity phase, that activity up to activity_offset has been imported
+        """
+        if activity_offset is None:
+            self.phase = self.PHASES[self.PHASES.index(phase) + 1]
+        else:
+            self.activity_offset = activity_offset
+        self.save()
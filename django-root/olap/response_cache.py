@@ -0,0 +1,165 @@
+"""
+    A cache of the OLAP views' responses
+
+    An offering's OLAP data only changes when its activity is imported (or its start date or events are edited), so the
+    responses of the /olap/<course_id>/ views are kept in the settings.CLOOP_OLAP_RESPONSE_CACHE cache.  They're cached
+    by the state of the offering stored in the database (see offering_state), the view, and its URL arguments and query
+    parameters.  Each process reads that state afresh for each request, so a response from before an import or edit
+    is never returned by any of them.  The cache must be shared by the processes (eg. memcached), as a cache in each
+    process's memory would mostly hold responses that others had already computed.  response_cache_info() reports the
+    hits and misses of each view.
+
+    The same state gives the views' responses their ETag and Last-Modified headers (see olap_course_access_url_wrapper),
+    so a browser revalidating a response it already has gets a 304 Not Modified without the view running at all.
+"""
+from collections import Counter
+from collections import namedtuple
+from functools import wraps
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http.response import HttpResponse
+from django.utils import timezone
+
+from dashboard.models import CourseOffering
+from dashboard.models import CourseRepeatingEvent
+from dashboard.models import CourseSingleEvent
+from dashboard.models import CourseSubmissionEvent
+from django_site.permissions import course_access_url_wrapper
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses'))
+
+_counts = Counter()  # Hits and misses in this process, by (URL name, whether it was a hit)
+_counts_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Returns the cache the OLAP views' responses are kept in, or None if they aren't cached
+    """
+    if not settings.CLOOP_OLAP_RESPONSE_CACHE:
+        return None
+    cache = caches[settings.CLOOP_OLAP_RESPONSE_CACHE]
+    if isinstance(cache, LocMemCache):
+        raise ImproperlyConfigured("CLOOP_OLAP_RESPONSE_CACHE must be a cache shared by all processes, not the local memory cache '{}'".format(settings.CLOOP_OLAP_RESPONSE_CACHE))
+    return cache
+
+
+def offering_state(course_offering):
+    """
+    Returns a tuple of the state of course_offering that its OLAP views' responses depend on, as stored in the database
+    """
+    return (
+        course_offering.pk,
+        course_offering.data_version,
+        course_offering.import_generation,
+        course_offering.last_activity_at,
+        course_offering.start_date,
+        course_offering.end_date,
+        course_offering.no_weeks,
+        # Moved on by saving the offering, and by changes to its events
+        course_offering.updated_at,
+    )
+
+
+def response_etag(request, *args, **kwargs):
+    """
+    Returns the ETag of an OLAP view's response to request, which changes with the offering's state
+    """
+    return '"{}"'.format(hashlib.md5(repr((
+        offering_state(request.course_offering),
+        request.META.get('HTTP_ACCEPT'),
+    )).encode()).hexdigest())
+
+
+def response_last_modified(request, *args, **kwargs):
+    """
+    Returns when the activity, offering or events shown by an OLAP view's response to request last changed
+    """
+    course_offering = request.course_offering
+    return max(filter(None, (course_offering.last_activity_at, course_offering.updated_at)))
+
+
+def olap_course_access_url_wrapper(view_func):
+    """
+    Wraps an OLAP view with django_site.permissions.course_access_url_wrapper, answering conditional GETs by
+    response_etag and response_last_modified
+    """
+    return course_access_url_wrapper(view_func, etag_func=response_etag, last_modified_func=response_last_modified)
+
+
+def cache_olap_response(view_func):
+    """
+    Caches the responses of an OLAP view.  It must be wrapped by olap_course_access_url_wrapper,
+    which sets request.course_offering and checks the user's access to it before the cache is looked in.
+    """
+    @wraps(view_func)
+    def cached_view_func(request, *args, **kwargs):
+        cache = get_response_cache()
+        if cache is None or request.method != 'GET':
+            return view_func(request, *args, **kwargs)
+
+        course_offering = request.course_offering
+        url_name = request.resolver_match.url_name
+        key = 'olap-response:' + hashlib.md5(repr((
+            offering_state(course_offering),
+            url_name,
+            args,
+            sorted(kwargs.items()),
+            sorted(request.GET.lists()),
+            request.META.get('HTTP_ACCEPT'),  # Picks the renderer
+        )).encode()).hexdigest()
+
+        cached = cache.get(key)
+        with _counts_lock:
+            _counts[url_name, cached is not None] += 1
+        if cached is not None:
+            content, headers = cached
+            response = HttpResponse(content)
+            for header, value in headers:
+                response[header] = value
+            return response
+
+        response = view_func(request, *args, **kwargs)
+        if response.status_code == 200:
+            # REST framework's responses are rendered after the view returns
+            if hasattr(response, 'render'):
+                response.render()
+            headers = [(header, value) for header, value in response.items() if header.lower() != 'set-cookie']
+            cache.set(key, (response.content, headers), settings.CLOOP_OLAP_RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    return cached_view_func
+
+
+def response_cache_info():
+    """
+    Returns the hits and misses of each view's responses in this process, as a CacheInfo by URL name
+    """
+    with _counts_lock:
+        return {
+            url_name: CacheInfo(_counts[url_name, True], _counts[url_name, False])
+            for url_name in sorted({url_name for url_name, hit in _counts})
+        }
+
+
+def clear_response_cache_info():
+    with _counts_lock:
+        _counts.clear()
+
+
+@receiver(post_save, sender=CourseRepeatingEvent)
+@receiver(post_delete, sender=CourseRepeatingEvent)
+@receiver(post_save, sender=CourseSingleEvent)
+@receiver(post_delete, sender=CourseSingleEvent)
+@receiver(post_save, sender=CourseSubmissionEvent)
+@receiver(post_delete, sender=CourseSubmissionEvent)
+def _event_changed(sender, instance, **kwargs):
+    CourseOffering.objects.filter(pk=instance.course_offering_id).update(updated_at=timezone.now())
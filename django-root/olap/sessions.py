@@ -0,0 +1,324 @@
+"""
+    Aggregation of page visits into LMS sessions
+"""
+from contextlib import contextmanager
+import functools
+import itertools
+import operator
+import time
+
+from django.db import connection
+from django.db import transaction
+from django.db.models import BigIntegerField
+from django.db.models import F
+from django.db.models import Func
+from django.db.models import Max
+from django.db.models import Min
+from django.db.models import Q
+import numpy as np
+
+from olap.bulk import bulk_assign
+from olap.bulk import bulk_assign_by_pk
+from olap.bulk import bulk_create_batch_size
+from olap.models import LMSSession
+from olap.models import PageVisit
+
+
+class EpochSeconds(Func):
+    """
+    The number of whole seconds since the epoch of a datetime expression
+    """
+    template = 'CAST(EXTRACT(EPOCH FROM %(expressions)s) AS BIGINT)'
+
+    def __init__(self, expression, **extra):
+        super().__init__(expression, output_field=BigIntegerField(), **extra)
+
+    def as_mysql(self, compiler, connection):
+        return self.as_sql(compiler, connection, template="TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %(expressions)s)")
+
+    def as_sqlite(self, compiler, connection):
+        # The % is doubled for the template, and again for the query's parameter substitution
+        return self.as_sql(compiler, connection, template="CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)")
+
+
+class Sessionizer(object):
+    """
+        Aggregates page views into sessions.
+        A session includes all visits by a user, where the time difference between subsequent views
+        does not exceed session_length_mins.  Sessions don't care about which page got visited, only that there
+        were visits.
+
+        Algorithm to Determine Sessions:
+         - make a single pass over the visits ordered by user then time, looking for a change of user or a gap
+           between visits greater than session_length_mins
+         - take the views with gaps shorter than session_length_mins and create a session to span them
+         - sessions are written in bulk, and the session FK of each spanned visit is set with a few large updates
+    """
+    # Number of sessions to accumulate before writing them to the database
+    FLUSH_SIZE = 10000
+    BULK_CREATE_BATCH_SIZE = 1000
+    # Number of users whose sessions are updated together (each adds a condition to the queries)
+    USER_BATCH_SIZE = 200
+
+    def __init__(self, course_offering, session_length_mins, data_version=None):
+        self.course_offering = course_offering
+        self.session_length_mins = session_length_mins
+        # The version of the offering's data to work on, by default the published version
+        self.data_version = course_offering.data_version if data_version is None else data_version
+        self.sessions_created = 0
+
+    def sessionize(self, visits):
+        """
+        Creates sessions for the visits in the given PageVisit queryset.  The visits should not already be in sessions.
+        """
+        visit_rows = visits.order_by('lms_user_id', 'visited_at', 'id').values_list('id', 'lms_user_id', 'visited_at').iterator()
+
+        pending_sessions = []
+        session = None
+        prev_user_id = None
+        prev_visit_time = None
+        for visit_id, user_id, visited_at in visit_rows:
+            if session is not None and user_id == prev_user_id:
+                gap_mins = int((visited_at - prev_visit_time).total_seconds() / 60)
+                if gap_mins <= self.session_length_mins:
+                    session['visit_ids'].append(visit_id)
+                    session['last_visit_time'] = visited_at
+                    prev_visit_time = visited_at
+                    continue
+
+            # Change of user, or time since previous visit is greater than max session length, so start a new session.
+            if session is not None:
+                pending_sessions.append(session)
+                if len(pending_sessions) >= self.FLUSH_SIZE:
+                    self._store_sessions(pending_sessions)
+                    pending_sessions = []
+            session = {
+                'first_visit_id': visit_id,
+                'first_visit_time': visited_at,
+                'last_visit_time': visited_at,
+                'visit_ids': [visit_id],
+            }
+            prev_user_id = user_id
+            prev_visit_time = visited_at
+
+        # If that was the final visit, store it as a session.
+        if session is not None:
+            pending_sessions.append(session)
+        self._store_sessions(pending_sessions)
+
+    def get_visits(self):
+        """
+        Returns a queryset of the visits in the offering's data version.  Visits are found through their users, as
+        sessions are.
+        """
+        return PageVisit.objects.for_offering(self.course_offering, self.data_version)
+
+    def get_unsessioned_visit_times(self):
+        """
+        Returns a dict of the pk of each user with visits that aren't in a session to the time of the earliest of them,
+        for update_user_sessions
+        """
+        visits = self.get_visits().filter(session=None)
+        return dict(visits.values_list('lms_user_id').annotate(Min('visited_at')).order_by())
+
+    def update_user_sessions(self, first_new_visit_times):
+        """
+        Updates the sessions of users who have new visits.  first_new_visit_times maps the pk of each of those users
+        to the time of their earliest new visit.
+
+        The only existing session that the new visits can extend is the last one to start at or before the earliest new
+        visit, so each user's sessions are deleted and recalculated from the start of that session (or from the
+        earliest new visit if there isn't one).  Older sessions are left untouched.
+        """
+        user_pks = list(first_new_visit_times)
+        for start in range(0, len(user_pks), self.USER_BATCH_SIZE):
+            batch_new_visit_times = {user_pk: first_new_visit_times[user_pk] for user_pk in user_pks[start:start + self.USER_BATCH_SIZE]}
+
+            restart_times = dict(batch_new_visit_times)
+            extendable_sessions = LMSSession.objects.for_offering(self.course_offering, self.data_version).filter(
+                self._any_user_q('first_visit__lms_user_id', 'first_visit__visited_at__lte', batch_new_visit_times),
+            ).values('first_visit__lms_user_id').annotate(first_visit_time=Max('first_visit__visited_at'))
+            for session in extendable_sessions:
+                restart_times[session['first_visit__lms_user_id']] = session['first_visit_time']
+
+            # Unlink the visits before deleting their sessions, which would otherwise cascade to the visits
+            visits = PageVisit.objects.filter(self._any_user_q('lms_user_id', 'visited_at__gte', restart_times))
+            visits.exclude(session=None).update(session=None)
+            LMSSession.objects.for_offering(self.course_offering, self.data_version).filter(
+                self._any_user_q('first_visit__lms_user_id', 'first_visit__visited_at__gte', restart_times),
+            ).delete()
+
+            self.sessionize(visits)
+
+    @staticmethod
+    def _any_user_q(user_lookup, time_lookup, times_by_user):
+        return functools.reduce(operator.or_, (Q(**{user_lookup: user_pk, time_lookup: time}) for user_pk, time in times_by_user.items()))
+
+    def _store_sessions(self, sessions):
+        if not sessions:
+            return
+
+        LMSSession.objects.bulk_create((
+            LMSSession(
+                course_offering=self.course_offering,
+                data_version=self.data_version,
+                first_visit_id=session['first_visit_id'],
+                pageviews=len(session['visit_ids']),
+                session_length_in_mins=int((session['last_visit_time'] - session['first_visit_time']).total_seconds() / 60),
+            )
+            for session in sessions
+        ), batch_size=bulk_create_batch_size(LMSSession, self.BULK_CREATE_BATCH_SIZE))
+
+        # bulk_create doesn't return ids on MySQL, so fetch them back by first visit (unique to each session)
+        first_visit_ids = [session['first_visit_id'] for session in sessions]
+        session_pks = {}
+        for start in range(0, len(first_visit_ids), self.BULK_CREATE_BATCH_SIZE):
+            created = LMSSession.objects.for_offering(self.course_offering, self.data_version).filter(
+                first_visit_id__in=first_visit_ids[start:start + self.BULK_CREATE_BATCH_SIZE],
+            ).order_by('id').values_list('first_visit_id', 'id')
+            session_pks.update(created)
+
+        visit_ids_by_session_pk = {session_pks[session['first_visit_id']]: session['visit_ids'] for session in sessions}
+        bulk_assign(PageVisit, 'session', visit_ids_by_session_pk)
+        self.sessions_created += len(sessions)
+
+
+class ArraySessionizer(object):
+    """
+        Rebuilds all of the sessions of a course offering, with the given session length.
+
+        Uses the same rules as Sessionizer, but the visit timestamps are loaded into NumPy arrays and the session
+        boundaries are found with vectorised operations instead of a loop over the visits:
+         - sort the visits by user, then time
+         - mark a visit as starting a session if it's for a different user than the previous visit, or if more than
+           session_length_mins whole minutes have passed since the previous visit
+         - the cumulative sum of the marks numbers the session that each visit belongs to
+        Timestamps are compared in whole seconds.  The sessions are replaced a batch of users at a time, each batch in
+        its own transaction, so readers see each user's old sessions or new ones.
+    """
+    BULK_CREATE_BATCH_SIZE = 1000
+    # Number of visits whose users' sessions are replaced in each transaction (rounded up to a whole user)
+    USER_BATCH_VISITS = 200000
+
+    def __init__(self, course_offering, session_length_mins, data_version=None):
+        self.course_offering = course_offering
+        self.session_length_mins = session_length_mins
+        self.data_version = course_offering.data_version if data_version is None else data_version
+        self.sessions_created = 0
+        self.timings = []
+
+    def resessionize(self):
+        """
+        Deletes the sessions in the offering's data version, and creates new ones from all of its visits.
+        The time taken by each phase is kept in self.timings as (phase, seconds) tuples.
+        """
+        with self._timed('load visits'):
+            visit_ids, user_ids, visit_times = self._load_visits()
+        with self._timed('find sessions'):
+            session_starts = self._find_session_starts(user_ids, visit_times)
+        with self._timed('replace sessions'):
+            for start, end in self._iter_user_batches(user_ids):
+                first_start, last_start = np.searchsorted(session_starts, (start, end))
+                batch_starts = session_starts[first_start:last_start] - start
+                with transaction.atomic():
+                    self._clear_sessions(int(user_ids[start]), int(user_ids[end - 1]))
+                    self._store_sessions(visit_ids[start:end], user_ids[start:end], visit_times[start:end], batch_starts)
+                    self.sessions_created += len(batch_starts)
+
+    @contextmanager
+    def _timed(self, phase):
+        start = time.perf_counter()
+        yield
+        self.timings.append((phase, time.perf_counter() - start))
+
+    def _load_visits(self):
+        """
+        Returns arrays of the visit ids, user ids and visit times (in seconds since the epoch) of the offering's
+        visits, sorted by user then time.
+        """
+        visits = PageVisit.objects.for_offering(self.course_offering, self.data_version).annotate(
+            visited_at_seconds=EpochSeconds(F('visited_at')),
+        ).values_list('id', 'lms_user_id', 'visited_at_seconds')
+
+        rows = np.fromiter(itertools.chain.from_iterable(visits.iterator()), dtype=np.int64).reshape(-1, 3)
+        visit_ids, user_ids, visit_times = rows[:, 0], rows[:, 1], rows[:, 2]
+        order = np.lexsort((visit_ids, visit_times, user_ids))
+        return visit_ids[order], user_ids[order], visit_times[order]
+
+    def _find_session_starts(self, user_ids, visit_times):
+        """
+        Returns the indexes of the visits that start a session.
+        """
+        if not len(user_ids):
+            return np.empty(0, dtype=np.int64)
+
+        starts_session = np.empty(len(user_ids), dtype=bool)
+        starts_session[0] = True
+        starts_session[1:] = (user_ids[1:] != user_ids[:-1]) | (np.diff(visit_times) // 60 > self.session_length_mins)
+        return np.flatnonzero(starts_session)
+
+    def _iter_user_batches(self, user_ids):
+        """
+        Yields the (start, end) indexes of each batch of the visits (sorted by user), of about USER_BATCH_VISITS visits
+        and whole users
+        """
+        start = 0
+        while start < len(user_ids):
+            end = min(start + self.USER_BATCH_VISITS, len(user_ids))
+            # Take the rest of the last user's visits
+            end = int(np.searchsorted(user_ids, user_ids[end - 1], side='right'))
+            yield start, end
+            start = end
+
+    def _clear_sessions(self, min_user_id, max_user_id):
+        """
+        Deletes the sessions of the users with ids from min_user_id to max_user_id
+        """
+        visits = PageVisit.objects.for_offering(self.course_offering, self.data_version).filter(lms_user__id__range=(min_user_id, max_user_id))
+        visits.exclude(session=None).update(session=None)
+        # No visits refer to the sessions any more.  QuerySet.delete() would load every session to look for them, so the
+        # sessions are deleted with a single statement.
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'DELETE FROM {sessions} WHERE course_offering_id = %s AND data_version = %s AND first_visit_id IN '
+                '(SELECT id FROM {visits} WHERE course_offering_id = %s AND data_version = %s AND lms_user_id BETWEEN %s AND %s)'.format(
+                    sessions=connection.ops.quote_name(LMSSession._meta.db_table),
+                    visits=connection.ops.quote_name(PageVisit._meta.db_table),
+                ),
+                [self.course_offering.pk, self.data_version] * 2 + [min_user_id, max_user_id],
+            )
+
+    def _store_sessions(self, visit_ids, user_ids, visit_times, session_starts):
+        """
+        Creates the sessions of a batch of visits, sorted by user then time, with a session starting at each of
+        session_starts
+        """
+        if not len(session_starts):
+            return
+
+        session_ends = np.append(session_starts[1:], len(visit_ids)) - 1
+        first_visit_ids = visit_ids[session_starts]
+        pageviews = session_ends - session_starts + 1
+        session_lengths = (visit_times[session_ends] - visit_times[session_starts]) // 60
+
+        LMSSession.objects.bulk_create((
+            LMSSession(
+                course_offering=self.course_offering,
+                data_version=self.data_version,
+                first_visit_id=first_visit_id,
+                pageviews=session_pageviews,
+                session_length_in_mins=session_length,
+            )
+            for first_visit_id, session_pageviews, session_length in zip(first_visit_ids.tolist(), pageviews.tolist(), session_lengths.tolist())
+        ), batch_size=bulk_create_batch_size(LMSSession, self.BULK_CREATE_BATCH_SIZE))
+
+        # bulk_create doesn't return ids on MySQL, so fetch them back by first visit.  The sessions of the batch's users
+        # were all just created.
+        created = LMSSession.objects.for_offering(self.course_offering, self.data_version).filter(
+            first_visit__lms_user__id__range=(int(user_ids[0]), int(user_ids[-1])),
+        ).values_list('first_visit_id', 'id')
+        created = np.fromiter(itertools.chain.from_iterable(created.iterator()), dtype=np.int64).reshape(-1, 2)
+        created = created[np.argsort(created[:, 0])]
+        session_pks = created[np.searchsorted(created[:, 0], first_visit_ids), 1]
+
+        bulk_assign_by_pk(PageVisit, 'session', visit_ids.tolist(), np.repeat(session_pks, pageviews).tolist())
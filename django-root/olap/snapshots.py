@@ -0,0 +1,192 @@
+"""
+    Snapshots of course offerings' activity as numpy files
+
+    When an import finishes, the activity in the version of the offering's data it imported is written to a directory
+    of .npy files, one for each column (see write_snapshot).  Web processes memory map them (see olap.visit_cache), so
+    they share one copy of each offering's activity through the OS page cache rather than each loading its own from
+    the database.  Without a snapshot of the offering's current data (eg. with settings.DATA_SNAPSHOT_DIR unset, or
+    after its start date changes), the columns are loaded from the database.
+"""
+from collections import OrderedDict
+import itertools
+import os
+import shutil
+
+from django.conf import settings
+import numpy as np
+
+from dashboard.models import CourseOffering
+from olap.models import LMSUser
+from olap.models import Page
+from olap.models import PageVisit
+from olap.models import SubmissionAttempt
+from olap.models import SummaryPost
+
+PAGE_TYPE_CONTENT = 0
+PAGE_TYPE_COMMUNICATION = 1
+PAGE_TYPE_ASSESSMENT = 2
+PAGE_TYPES = 3
+
+ACTIVITY_MODELS = OrderedDict((
+    ('visits', PageVisit),
+    ('posts', SummaryPost),
+    ('attempts', SubmissionAttempt),
+))
+ACTIVITY_TIME_FIELDS = {
+    'visits': 'visited_at',
+    'posts': 'posted_at',
+    'attempts': 'attempted_at',
+}
+
+# The columns of each kind of activity, with an element for each visit, post or attempt
+ACTIVITY_COLUMNS = ('user_index', 'page_index', 'page_type', 'course_week', 'local_weekday')
+
+
+def page_type(content_type):
+    """
+    Returns the PAGE_TYPE_* of pages of content_type
+    """
+    if content_type in CourseOffering.communication_types():
+        return PAGE_TYPE_COMMUNICATION
+    if content_type in CourseOffering.assessment_types():
+        return PAGE_TYPE_ASSESSMENT
+    return PAGE_TYPE_CONTENT
+
+
+def load_columns(course_offering, data_version, activities=tuple(ACTIVITY_MODELS)):
+    """
+        Returns a dict of the columns of the given version of course_offering's data, loaded from the database:
+         - user_ids and page_ids: the ids of its LMSUsers and Pages, in order
+         - page_types: the PAGE_TYPE_* of each of page_ids
+         - for each of activities ('visits', 'posts' and 'attempts'), '<activity>_<column>' for each of ACTIVITY_COLUMNS:
+           the index of each visit, post or attempt's LMSUser in user_ids and Page in page_ids, its page's type, and its
+           course week and local weekday
+        Activity after the offering's last_activity_at is left out, as it's been added by an import that hasn't
+        finished.
+    """
+    user_ids = LMSUser.objects.for_offering(course_offering, data_version).values_list('id', flat=True).order_by('id')
+    pages = Page.objects.for_offering(course_offering, data_version).values_list('id', 'content_type').order_by('id')
+    columns = {
+        'user_ids': np.fromiter(user_ids.iterator(), dtype=np.int64),
+        'page_ids': np.array([page_id for page_id, content_type in pages], dtype=np.int64),
+        'page_types': np.array([page_type(content_type) for page_id, content_type in pages], dtype=np.int8),
+    }
+    for activity in activities:
+        rows = ACTIVITY_MODELS[activity].objects.for_offering(course_offering, data_version)
+        if course_offering.last_activity_at is not None:
+            rows = rows.filter(**{ACTIVITY_TIME_FIELDS[activity] + '__lte': course_offering.last_activity_at})
+        rows = rows.values_list('lms_user_id', 'page_id', 'course_week', 'local_weekday').order_by()
+        rows = np.fromiter(itertools.chain.from_iterable(rows.iterator()), dtype=np.int64).reshape(-1, 4)
+        page_index = np.searchsorted(columns['page_ids'], rows[:, 1]).astype(np.int32)
+        columns.update({
+            activity + '_user_index': np.searchsorted(columns['user_ids'], rows[:, 0]).astype(np.int32),
+            activity + '_page_index': page_index,
+            activity + '_page_type': columns['page_types'][page_index],
+            activity + '_course_week': rows[:, 2].astype(np.int16),
+            activity + '_local_weekday': rows[:, 3].astype(np.int8),
+        })
+    return columns
+
+
+def _offering_dir(course_offering):
+    return os.path.join(settings.DATA_SNAPSHOT_DIR, str(course_offering.pk))
+
+
+def _snapshot_name(course_offering, data_version, import_generation=None):
+    """
+    Returns the name of the snapshot of the given version of course_offering's data, which changes with each import (as
+    its import generation is bumped) and with the start date its course weeks count from.  import_generation overrides
+    the offering's.
+    """
+    last_activity_at = course_offering.last_activity_at
+    return '{}-{}-{}-{}'.format(
+        data_version,
+        course_offering.import_generation if import_generation is None else import_generation,
+        int(last_activity_at.timestamp() * 1000000) if last_activity_at else 0,
+        course_offering.start_date.strftime('%Y%m%d'),
+    )
+
+
+def write_snapshot(course_offering, data_version=None):
+    """
+    Writes a snapshot of the given version of course_offering's data (by default the published version), and removes
+    the offering's earlier snapshots, which it supersedes.  Does nothing if settings.DATA_SNAPSHOT_DIR is unset.
+    """
+    if not settings.DATA_SNAPSHOT_DIR:
+        return
+    # The snapshot is named for the offering as the views will read it
+    course_offering.refresh_from_db(fields=['last_activity_at', 'start_date', 'data_version', 'import_generation'])
+    if data_version is None:
+        data_version = course_offering.data_version
+    offering_dir = _offering_dir(course_offering)
+    name = _snapshot_name(course_offering, data_version)
+
+    # The files are written to a directory of their own, and it's renamed into place, so readers never see part of a
+    # snapshot
+    os.makedirs(offering_dir, exist_ok=True)
+    partial_dir = os.path.join(offering_dir, '.{}.{}'.format(name, os.getpid()))
+    shutil.rmtree(partial_dir, ignore_errors=True)
+    os.mkdir(partial_dir)
+    for column, values in load_columns(course_offering, data_version).items():
+        np.save(os.path.join(partial_dir, column + '.npy'), values)
+    snapshot_dir = os.path.join(offering_dir, name)
+    shutil.rmtree(snapshot_dir, ignore_errors=True)
+    os.rename(partial_dir, snapshot_dir)
+
+    # Snapshots of earlier imports, or of an unpublished version, are no longer read.  (Others' partly written
+    # snapshots are left to them.)
+    for other_name in os.listdir(offering_dir):
+        if other_name != name and not other_name.startswith('.'):
+            shutil.rmtree(os.path.join(offering_dir, other_name), ignore_errors=True)
+
+
+def rename_snapshot(course_offering, previous_import_generation):
+    """
+    Renames the snapshot of course_offering's published data from before an import that didn't change what it holds
+    (previous_import_generation being the import generation it was written at) for the offering's current generation.
+    Returns whether there was such a snapshot.  Does nothing if settings.DATA_SNAPSHOT_DIR is unset.
+    """
+    if not settings.DATA_SNAPSHOT_DIR:
+        return False
+    course_offering.refresh_from_db(fields=['last_activity_at', 'start_date', 'data_version', 'import_generation'])
+    offering_dir = _offering_dir(course_offering)
+    previous_name = _snapshot_name(course_offering, course_offering.data_version, previous_import_generation)
+    name = _snapshot_name(course_offering, course_offering.data_version)
+    try:
+        os.rename(os.path.join(offering_dir, previous_name), os.path.join(offering_dir, name))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def open_snapshot(course_offering, data_version, columns):
+    """
+    Returns a dict of the given columns (as named by load_columns) of the snapshot of the given version of
+    course_offering's data, memory mapped read-only, or None if there's no snapshot of its current data
+    """
+    if not settings.DATA_SNAPSHOT_DIR:
+        return None
+    snapshot_dir = os.path.join(_offering_dir(course_offering), _snapshot_name(course_offering, data_version))
+    try:
+        return {column: np.load(os.path.join(snapshot_dir, column + '.npy'), mmap_mode='r') for column in columns}
+    except FileNotFoundError:
+        # Not written, or superseded by a later import's since this request fetched the offering
+        return None
+
+
+def remove_snapshots(course_offering, data_version=None):
+    """
+    Removes the snapshots of the given version of course_offering's data, or of all of its data if data_version is None
+    """
+    if not settings.DATA_SNAPSHOT_DIR:
+        return
+    offering_dir = _offering_dir(course_offering)
+    if not os.path.isdir(offering_dir):
+        return
+    # Web processes that have a snapshot's files mapped keep reading them until they unmap them
+    if data_version is None:
+        shutil.rmtree(offering_dir)
+        return
+    for name in os.listdir(offering_dir):
+        if name.split('-')[0] == str(data_version):
+            shutil.rmtree(os.path.join(offering_dir, name))
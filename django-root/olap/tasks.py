@@ -4,23 +4,112 @@ from unipath.path import Path
 
 from dashboard.models import CourseOffering
 from django_site.celery import app
+from olap.cubes import update_cubes
 from olap.lms_import import ImportLmsData
+from olap.lms_import import LMSImportDataError
+from olap.lms_import import LMSImportFileError
+from olap.models import PageVisit
+from olap.models import SubmissionAttempt
+from olap.models import SummaryPost
+from olap.sessions import ArraySessionizer
+from olap.snapshots import write_snapshot
 from olap.utils import get_course_import_metadata
+from olap.warming import warm_responses
+from olap.warming import warming_enabled
 
 
 @app.task(bind=True)
-def import_olap_task(self, course_id, filename, just_clear=False):
+def import_olap_task(self, course_id, filename, just_clear=False, delta=False, shadow=False):
     course_offering = CourseOffering.objects.get(id=course_id)
     file_path = Path(settings.DATA_PROCESSING_DIR, filename)
 
     try:
-        with transaction.atomic():
-            importer = ImportLmsData(course_offering, file_path, just_clear=just_clear)
-            importer.process()
-    finally:
+        # An import commits its work in phases and chunks, recording its progress in an ImportCheckpoint
+        importer = ImportLmsData(course_offering, file_path, just_clear=just_clear, delta=delta, shadow=shadow)
+        importer.process()
+        if shadow:
+            # The previously published version is no longer read
+            remove_old_data_versions_task.delay(course_id)
+    except (LMSImportDataError, LMSImportFileError):
+        # Rerunning this file would fail the same way
+        file_path.remove()
+        if shadow:
+            # The version it was imported into won't be published
+            remove_old_data_versions_task.delay(course_id)
+        raise
+    else:
         file_path.remove()
+    finally:
+        # Any other failure leaves the file in place, so the import can be rerun, resuming from its checkpoint
         course_offering.is_importing = False
-        course_offering.save()
+        course_offering.save(update_fields=['is_importing'])
+
+    # After the import has bumped the offering's generation, which changes the key of its cached responses
+    if warming_enabled():
+        warm_olap_responses_task.delay(course_id)
+
+
+@app.task(bind=True)
+def warm_olap_responses_task(self, course_id):
+    if not warming_enabled():
+        return {}
+    course_offering = CourseOffering.objects.get(id=course_id)
+
+    print("Warming OLAP responses for", course_offering)
+    seconds_by_view = warm_responses(course_offering, settings.CLOOP_OLAP_WARM_CONCURRENCY)
+    for url_name, seconds in seconds_by_view.items():
+        print("  {}: {:.2f}s".format(url_name, seconds))
+    # Kept as the task's result
+    return seconds_by_view
+
+
+@app.task(bind=True)
+def remove_old_data_versions_task(self, course_id):
+    course_offering = CourseOffering.objects.get(id=course_id)
+    old_versions = ImportLmsData(course_offering, None).remove_old_data_versions()
+    if old_versions:
+        print("Removed data versions {} of".format(', '.join(str(data_version) for data_version in old_versions)), course_offering)
+
+
+@app.task(bind=True)
+def resessionize_olap_task(self, course_id, session_length_mins):
+    course_offering = CourseOffering.objects.get(id=course_id)
+
+    try:
+        print("Rebuilding {}-minute sessions for".format(session_length_mins), course_offering)
+        # The sessions are replaced a batch of users at a time, each committed separately
+        sessionizer = ArraySessionizer(course_offering, session_length_mins)
+        sessionizer.resessionize()
+        course_offering.bump_import_generation()
+        for phase, seconds in sessionizer.timings:
+            print("  {}: {:.2f}s".format(phase, seconds))
+        print("Created {} sessions".format(sessionizer.sessions_created))
+    finally:
+        course_offering.is_importing = False
+        course_offering.save(update_fields=['is_importing'])
+
+
+@app.task(bind=True)
+def update_course_weeks_task(self, course_id):
+    course_offering = CourseOffering.objects.get(id=course_id)
+
+    print("Recalculating course weeks from the start date of", course_offering)
+    with transaction.atomic():
+        # The activity's course weeks count from the start date
+        for model in (PageVisit, SubmissionAttempt, SummaryPost):
+            model.update_course_weeks(course_offering)
+        update_cubes(course_offering)
+        course_offering.bump_import_generation()
+
+    # Once committed, as the snapshot is named for the offering's start date and generation
+    try:
+        write_snapshot(course_offering)
+    except OSError as e:
+        # The views load the activity from the database until a later import writes one
+        print("Couldn't write activity snapshot:", e)
+
+    if warming_enabled():
+        warm_olap_responses_task.delay(course_id)
 
 
 @app.task(bind=True)
@@ -37,9 +126,12 @@ def preprocess_data_imports(self):
             course_offering = CourseOffering.objects.get(id=import_metadata_mapping[import_file.name])
             import_file.move(processing_data_folder)
             course_offering.is_importing = True
-            course_offering.save()
+            course_offering.save(update_fields=['is_importing'])
 
-            import_olap_task.delay(course_offering.id, import_file.name)
+            # The LMS exports activity since the offering's last activity, so once there is some, only import what's new.
+            # A full import is loaded into a new data version, so the current one is read until it's complete.
+            delta = course_offering.last_activity_at is not None
+            import_olap_task.delay(course_offering.id, import_file.name, delta=delta, shadow=not delta)
         except KeyError:
             # File is unrecognised so remove it
             import_file.remove()
@@ -77,6 +77,8 @@ class PageVisitFactory(factory.DjangoModelFactory):
     visited_at = faker.Faker('date_time_between_dates', datetime_start=Params.VISITS_START, datetime_end=Params.VISITS_END)
     lms_user = factory.SubFactory(LMSUserFactory)
     page = factory.SubFactory(PageFactory)
+    course_offering = factory.SelfAttribute('page.course_offering')
+    data_version = factory.SelfAttribute('page.data_version')
     # TODO: There's several fields here which are candidates for removal/alteration.  Audit.
     # module = factory.CharField(blank=True, max_length=255) # Is this always a resource/x-bb-* content type?
     action = 'CONTENT_ACCESS' # Also extent: COURSE_ACCESS
@@ -99,6 +101,8 @@ class SummaryPostFactory(factory.DjangoModelFactory):
 
     page = factory.SubFactory(PageFactory)
     lms_user = factory.SubFactory(LMSUserFactory)
+    course_offering = factory.SelfAttribute('page.course_offering')
+    data_version = factory.SelfAttribute('page.data_version')
     posted_at = faker.Faker('date_time_between_dates', datetime_start=Params.VISITS_START, datetime_end=Params.VISITS_END)
 
 
@@ -114,6 +118,8 @@ class SubmissionAttemptFactory(factory.DjangoModelFactory):
     attempt_key = factory.Sequence(lambda n: "key %d" % n)
     page = factory.SubFactory(PageFactory)
     lms_user = factory.SubFactory(LMSUserFactory)
+    course_offering = factory.SelfAttribute('page.course_offering')
+    data_version = factory.SelfAttribute('page.data_version')
     attempted_at = faker.Faker('date_time_between_dates', datetime_start=Params.VISITS_START, datetime_end=Params.VISITS_END)
     grade = fuzzy.FuzzyFloat(10.0)
 
@@ -2,23 +2,45 @@ import datetime
 from factory import fuzzy
 import json
 import random
+import tempfile
+from unittest import mock
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection
 from django.test.testcases import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
 from django.urls.base import reverse
 from django.utils.timezone import get_current_timezone
+from django.utils.timezone import make_aware
+from django.utils.timezone import now
 
 from rest_framework.test import APIClient
 from rest_framework.status import HTTP_200_OK
+from rest_framework.status import HTTP_304_NOT_MODIFIED
 
+from dashboard.models import CourseOffering
 from dashboard.tests.factories import LecturerFactory
 from dashboard.tests.factories import CourseOfferingFactory
 from dashboard.tests.factories import CourseRepeatingEventFactory
+from olap.cubes import update_cubes
+from olap.response_cache import clear_response_cache_info
+from olap.response_cache import get_response_cache
+from olap.response_cache import response_cache_info
 from olap.models import SubmissionAttempt
 from olap.tests.factories import LMSUserFactory
 from olap.tests.factories import PageFactory
 from olap.tests.factories import PageVisitFactory
 from olap.tests.factories import SubmissionAttemptFactory
 from olap.tests.factories import SummaryPostFactory
+from olap import visit_cache
+from olap.visit_cache import cache_info
+from olap.visit_cache import clear_cache
+from olap.visit_cache import get_offering_visits
+from olap.warming import get_warm_paths
+from olap.warming import warm_responses
+from olap.warming import warming_enabled
 
 # TODO: Test for permissions checks:
 #  - Access to a course that the user doesn't own fails.
@@ -26,6 +48,8 @@ from olap.tests.factories import SummaryPostFactory
 
 class APITestsBase(TestCase):
     def setUp(self):
+        # Offerings' ids are reused between tests, so their cached visits would be out of date
+        clear_cache()
         self.our_tz = get_current_timezone()
         self.user = LecturerFactory(password='12345')
         self.course_offering = CourseOfferingFactory()
@@ -35,6 +59,35 @@ class APITestsBase(TestCase):
         self.client = APIClient()
         login = self.client.login(username=self.user.email, password='12345')
 
+    def summarise(self, course_offering=None):
+        # As an import does once it's added the activity: the views read its summaries, and responses cached from
+        # before it aren't used
+        course_offering = course_offering or self.course_offering
+        update_cubes(course_offering)
+        course_offering.bump_import_generation()
+
+    def use_response_cache(self):
+        # A cache shared between processes, as the responses are only cached in one of those
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache_settings = dict(settings.CACHES, olap_responses={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': cache_dir.name,
+        })
+        overridden = override_settings(CACHES=cache_settings, CLOOP_OLAP_RESPONSE_CACHE='olap_responses')
+        overridden.enable()
+        self.addCleanup(overridden.disable)
+
+    def get_summarised(self, api_url, course_offering=None):
+        self.summarise(course_offering)
+        return self.client.get(api_url)
+
+    def get_week_start_dt(self, week_no):
+        # Course weeks start at local midnight, which isn't a whole number of weeks after the start of the course
+        # across a daylight saving change
+        week_start_date = self.course_offering.start_date + datetime.timedelta(weeks=week_no)
+        return make_aware(datetime.datetime.combine(week_start_date, datetime.time()), self.our_tz)
+
     def get_dt_in_courseoffering_window(self):
         dt_range = (self.course_offering.start_datetime, self.course_offering.start_datetime + datetime.timedelta(weeks=self.course_offering.no_weeks))
         return fuzzy.FuzzyDateTime(*dt_range).fuzz()
@@ -45,13 +98,13 @@ class APICommunicationAccessesTests(APITestsBase):
         page = PageFactory(course_offering=self.course_offering, content_type='course/x-bb-collabsession')
         # For this one page, generate one visit per week for the duration of the course
         for week_no in range(self.course_offering.no_weeks):
-            week_start_dt = self.course_offering.start_datetime + datetime.timedelta(weeks=week_no)
-            week_end_dt = week_start_dt + datetime.timedelta(days=7)
+            week_start_dt = self.get_week_start_dt(week_no)
+            week_end_dt = self.get_week_start_dt(week_no + 1) - datetime.timedelta(microseconds=1)
             visit_dt = fuzzy.FuzzyDateTime(week_start_dt, week_end_dt)
             visit = PageVisitFactory(page=page, module='course/x-bb-collabsession', lms_user=self.lms_user, visited_at=visit_dt)
 
         # Call the API endpoint
-        response = self.client.get(self.api_url)
+        response = self.get_summarised(self.api_url)
         self.assertEqual(response.status_code, HTTP_200_OK)
         totals = [1] * self.course_offering.no_weeks # One visit per week
         totals.append(self.course_offering.no_weeks) # Add a final number for the total visits
@@ -85,7 +138,7 @@ class APICommunicationAccessesTests(APITestsBase):
             visit = PageVisitFactory(page=random_page, module='course/x-bb-collabsession', lms_user=self.lms_user, visited_at=random_visit_dt)
 
         # Call the API endpoint
-        response = self.client.get(self.api_url)
+        response = self.get_summarised(self.api_url)
         self.assertEqual(response.status_code, HTTP_200_OK)
         response_dict = json.loads(response.content.decode('utf-8'))
         # FIXME: This could be greatly expanded to check the numbers in the response.
@@ -96,6 +149,22 @@ class APICommunicationAccessesTests(APITestsBase):
         self.assertEqual(len(page_set), NR_PAGES)
         # Could add more tests here.  Is it worth it?
 
+    def test_accesses_queries_independent_of_pages(self):
+        self.api_url = reverse('olap:communication_accesses', kwargs={'course_id': self.course_offering.id})
+        query_counts = []
+        for nr_pages in (1, 10):
+            for page in PageFactory.create_batch(nr_pages, course_offering=self.course_offering, content_type='course/x-bb-collabsession'):
+                PageVisitFactory(page=page, module='course/x-bb-collabsession', lms_user=self.lms_user, visited_at=self.get_dt_in_courseoffering_window())
+            self.summarise()
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(self.api_url)
+            self.assertEqual(response.status_code, HTTP_200_OK)
+            query_counts.append(len(queries))
+        self.assertEqual(query_counts[0], query_counts[1])
+        response_dict = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(len(response_dict['pageSet']), 11)
+        self.assertEqual(response_dict['totalsByWeek'][-1], 11)
+
 
 class APICommunicationPostsTests(APITestsBase):
     def test_posts_one_page(self):
@@ -103,13 +172,13 @@ class APICommunicationPostsTests(APITestsBase):
         page = PageFactory(course_offering=self.course_offering, content_type='resource/x-bb-discussionboard')
         # For this one page, generate one post per week for the duration of the course
         for week_no in range(self.course_offering.no_weeks):
-            week_start_dt = self.course_offering.start_datetime + datetime.timedelta(weeks=week_no)
-            week_end_dt = week_start_dt + datetime.timedelta(days=7)
+            week_start_dt = self.get_week_start_dt(week_no)
+            week_end_dt = self.get_week_start_dt(week_no + 1) - datetime.timedelta(microseconds=1)
             post_event_dt = fuzzy.FuzzyDateTime(week_start_dt, week_end_dt)
             post_event = SummaryPostFactory(page=page, lms_user=self.lms_user, posted_at=post_event_dt)
 
         # Call the API endpoint
-        response = self.client.get(api_url)
+        response = self.get_summarised(api_url)
         self.assertEqual(response.status_code, HTTP_200_OK)
         totals = [1] * self.course_offering.no_weeks # One visit per week
         totals.append(self.course_offering.no_weeks) # Add a final number for the total visits
@@ -186,13 +255,34 @@ class APICommunicationStudentsTests(APITestsBase):
         response_dict = json.loads(response.content.decode('utf-8'))
         self.assertEqual(response_dict, expected)
 
+    def test_students_only_counts_pages_and_weeks_shown(self):
+        course_offering = CourseOfferingFactory(start_date=self.course_offering.start_date, no_weeks=2)
+        course_offering.owners.add(self.user)
+        self.api_url = reverse('olap:communication_students', kwargs={'course_id': course_offering.id})
+        page = PageFactory(course_offering=course_offering, content_type='resource/x-bb-discussionboard')
+        content_page = PageFactory(course_offering=course_offering, content_type='resource/x-bb-document')
+        lms_user1 = LMSUserFactory(course_offering=course_offering)
+        lms_user2 = LMSUserFactory(course_offering=course_offering)
+        lms_user3 = LMSUserFactory(course_offering=course_offering)
+
+        PageVisitFactory(page=page, lms_user=lms_user1, visited_at=self.course_offering.start_datetime + datetime.timedelta(days=3))
+        # U2 only visits the page after the course, and U3 only visits a content page
+        PageVisitFactory(page=page, lms_user=lms_user2, visited_at=self.course_offering.start_datetime + datetime.timedelta(days=15))
+        PageVisitFactory(page=content_page, lms_user=lms_user3, visited_at=self.course_offering.start_datetime + datetime.timedelta(days=3))
+
+        response = self.client.get(self.api_url)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        response_dict = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([(p['id'], p['weeks'], p['total'], p['percent']) for p in response_dict['pageSet']], [(page.id, [1, 0], 1, 100.0)])
+        self.assertEqual(response_dict['totalsByWeek'], [1, 0, 1])
+
 
 class APICommunicationEventsTests(APITestsBase):
     def events_setUp(self):
         self.course_offering_start = datetime.datetime(2016, 2, 1, 8, 0, 10, tzinfo=self.our_tz) # Mon
         assert self.course_offering_start.weekday() == 0 # Date chosen to be a monday.  Test won't work otherwise.
 
-        course_offering = CourseOfferingFactory(start_date=self.course_offering_start, no_weeks=2)
+        course_offering = CourseOfferingFactory(start_date=self.course_offering_start.date(), no_weeks=2)
         course_offering.owners.add(self.user)
         self.page = PageFactory(course_offering=course_offering, content_type='resource/x-bb-discussionboard')
 
@@ -204,12 +294,15 @@ class APICommunicationEventsTests(APITestsBase):
 
         self.api_url = reverse('olap:communication_events', kwargs={'course_id': course_offering.id, 'event_id': self.repeating_event.id})
 
+    def get_events_response(self):
+        return self.get_summarised(self.api_url, self.page.course_offering)
+
     def test_events_one_page_view_before_event(self):
         self.events_setUp()
         self.repeating_event.day_of_week = 4 # Fri, visit is Thu
         self.repeating_event.save()
 
-        response = self.client.get(self.api_url)
+        response = self.get_events_response()
         self.assertEqual(response.status_code, HTTP_200_OK)
         expected = [
             {
@@ -227,7 +320,7 @@ class APICommunicationEventsTests(APITestsBase):
         self.repeating_event.day_of_week = 2 # Wed, visit is Thu
         self.repeating_event.save()
 
-        response = self.client.get(self.api_url)
+        response = self.get_events_response()
         self.assertEqual(response.status_code, HTTP_200_OK)
         expected = [
             {
@@ -246,7 +339,7 @@ class APICommunicationEventsTests(APITestsBase):
         self.repeating_event.day_of_week = 3 # Thu, same day as visit
         self.repeating_event.save()
 
-        response = self.client.get(self.api_url)
+        response = self.get_events_response()
         self.assertEqual(response.status_code, HTTP_200_OK)
         expected = [
             {
@@ -269,7 +362,7 @@ class APICommunicationEventsTests(APITestsBase):
         visit2_dt = self.course_offering_start + datetime.timedelta(weeks=1, days=5) # Sat
         visit2 = PageVisitFactory(page=self.page, lms_user=self.lms_user, visited_at=visit2_dt)
 
-        response = self.client.get(self.api_url)
+        response = self.get_events_response()
         self.assertEqual(response.status_code, HTTP_200_OK)
         expected = [
             {
@@ -293,7 +386,7 @@ class APICommunicationEventsTests(APITestsBase):
         visit.visited_at += datetime.timedelta(weeks=3)
         visit.save()
 
-        response = self.client.get(self.api_url)
+        response = self.get_events_response()
         self.assertEqual(response.status_code, HTTP_200_OK)
         expected = [
             {
@@ -379,3 +472,232 @@ class APIAssessmentsGradesTests(APITestsBase):
 
         response_dict = json.loads(response.content.decode('utf-8'))
         self.assertEqual(response_dict, expected)
+
+
+class VisitCacheTests(APITestsBase):
+    def setUp(self):
+        super().setUp()
+        page = PageFactory(course_offering=self.course_offering)
+        for visit_no in range(3):
+            PageVisitFactory(page=page, lms_user=self.lms_user, visited_at=self.get_week_start_dt(visit_no))
+
+    def test_reloaded_when_offering_data_changes(self):
+        visits = get_offering_visits(self.course_offering)
+        self.assertEqual(len(visits), 3)
+
+        # The cached visits are used until an import changes the offering's data
+        PageVisitFactory(page=PageFactory(course_offering=self.course_offering), lms_user=self.lms_user, visited_at=self.get_dt_in_courseoffering_window())
+        self.assertIs(get_offering_visits(self.course_offering), visits)
+        self.course_offering.bump_import_generation()
+        visits = get_offering_visits(self.course_offering)
+        self.assertEqual(len(visits), 4)
+        self.assertEqual(visits.count_by_page(visits.by_user(self.lms_user.id)), {page_id: count for page_id, count in zip(visits.page_ids.tolist(), (3, 1))})
+
+        info = cache_info()
+        self.assertEqual((info.hits, info.misses, info.offerings, info.bytes), (1, 2, 1, visits.nbytes))
+
+    def test_least_recently_used_evicted(self):
+        other_offering = CourseOfferingFactory()
+        PageVisitFactory(page=PageFactory(course_offering=other_offering), lms_user=LMSUserFactory(course_offering=other_offering), visited_at=self.get_dt_in_courseoffering_window())
+
+        with mock.patch.object(visit_cache._cache, 'max_bytes', get_offering_visits(self.course_offering).nbytes + 1):
+            get_offering_visits(other_offering)
+            self.assertEqual(cache_info().offerings, 1)
+            # The first offering's visits were evicted to make room, so are loaded again
+            get_offering_visits(self.course_offering)
+            self.assertEqual(cache_info().misses, 3)
+            self.assertLessEqual(cache_info().bytes, cache_info().max_bytes)
+
+
+class CacheStatsTests(APITestsBase):
+    def setUp(self):
+        super().setUp()
+        clear_response_cache_info()
+        self.api_url = reverse('olap:cache_stats')
+
+    def test_cache_stats(self):
+        self.use_response_cache()
+        self.summarise()
+        get_offering_visits(self.course_offering)
+        self.client.get(reverse('olap:content_accesses', kwargs={'course_id': self.course_offering.id}))
+        staff_user = LecturerFactory(password='12345', is_staff=True)
+        self.client.login(username=staff_user.email, password='12345')
+        response = self.client.get(self.api_url)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        response_dict = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(response_dict['visitCache']['misses'], 1)
+        self.assertEqual(response_dict['responseCache'], {'contentAccesses': {'hits': 0, 'misses': 1}})
+
+    def test_staff_only(self):
+        self.assertEqual(self.client.get(self.api_url).status_code, 403)
+
+
+class ResponseCacheTests(APITestsBase):
+    def setUp(self):
+        super().setUp()
+        self.use_response_cache()
+        clear_response_cache_info()
+        self.page = PageFactory(course_offering=self.course_offering, content_type='resource/x-bb-document')
+        PageVisitFactory(page=self.page, lms_user=self.lms_user, visited_at=self.get_week_start_dt(1))
+        self.api_url = reverse('olap:content_accesses', kwargs={'course_id': self.course_offering.id})
+
+    def get_total(self):
+        response = self.client.get(self.api_url)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        return json.loads(response.content.decode('utf-8'))['totalsByWeek'][-1]
+
+    def test_cached_until_import_commits(self):
+        self.summarise()
+        self.assertEqual(self.get_total(), 1)
+        self.assertEqual(self.get_total(), 1)
+
+        # Activity added without an import committing isn't seen
+        PageVisitFactory(page=self.page, lms_user=self.lms_user, visited_at=self.get_week_start_dt(2))
+        update_cubes(self.course_offering)
+        self.assertEqual(self.get_total(), 1)
+        self.course_offering.bump_import_generation()
+        self.assertEqual(self.get_total(), 2)
+        self.assertEqual(response_cache_info(), {'content_accesses': (2, 2)})
+
+    def test_invalidated_by_start_date_change(self):
+        self.summarise()
+        self.get_total()
+        # The course weeks shown count from the start date
+        self.course_offering.start_date += datetime.timedelta(weeks=1)
+        self.course_offering.save()
+        self.get_total()
+        self.assertEqual(response_cache_info(), {'content_accesses': (0, 2)})
+
+    def test_invalidated_by_event_changes(self):
+        repeating_event = CourseRepeatingEventFactory(course_offering=self.course_offering, start_week=1, end_week=2, day_of_week=0)
+        api_url = reverse('olap:content_events', kwargs={'course_id': self.course_offering.id, 'event_id': repeating_event.id})
+        # A Monday visit, which moves from on or after the event to before it
+        monday = self.get_week_start_dt(1) + datetime.timedelta(days=-self.course_offering.start_date.weekday() % 7)
+        PageVisitFactory(page=self.page, lms_user=LMSUserFactory(course_offering=self.course_offering), visited_at=monday)
+        self.summarise()
+        before_event = self.client.get(api_url).content
+        repeating_event.day_of_week = 6
+        repeating_event.save()
+        self.assertNotEqual(self.client.get(api_url).content, before_event)
+        self.assertEqual(response_cache_info(), {'content_events': (0, 2)})
+
+    def test_access_checked_before_cache(self):
+        self.summarise()
+        self.get_total()
+        other_user = LecturerFactory(password='12345')
+        self.client.login(username=other_user.email, password='12345')
+        self.assertEqual(self.client.get(self.api_url).status_code, 403)
+
+    def test_local_memory_cache_refused(self):
+        cache_settings = dict(settings.CACHES, olap_responses={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        with override_settings(CACHES=cache_settings, CLOOP_OLAP_RESPONSE_CACHE='olap_responses'):
+            with self.assertRaises(ImproperlyConfigured):
+                get_response_cache()
+
+    def test_disabled(self):
+        with override_settings(CLOOP_OLAP_RESPONSE_CACHE=None):
+            self.summarise()
+            self.get_total()
+            self.get_total()
+        self.assertEqual(response_cache_info(), {})
+
+
+class ConditionalGetTests(APITestsBase):
+    def setUp(self):
+        super().setUp()
+        self.use_response_cache()
+        clear_response_cache_info()
+        self.page = PageFactory(course_offering=self.course_offering, content_type='resource/x-bb-document')
+        PageVisitFactory(page=self.page, lms_user=self.lms_user, visited_at=self.get_week_start_dt(1))
+        self.course_offering.last_activity_at = self.get_week_start_dt(1)
+        self.course_offering.save()
+        self.summarise()
+        self.api_url = reverse('olap:content_accesses', kwargs={'course_id': self.course_offering.id})
+
+    def test_not_modified(self):
+        response = self.client.get(self.api_url)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertIn('no-cache', response['Cache-Control'])
+        etag = response['ETag']
+
+        response = self.client.get(self.api_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        response = self.client.get(self.api_url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, HTTP_304_NOT_MODIFIED)
+        # Answered before the view (or its cache) was reached
+        self.assertEqual(response_cache_info(), {'content_accesses': (0, 1)})
+
+        # Another representation of the response has its own ETag
+        response = self.client.get(self.api_url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT='*/*')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+
+    def test_modified_by_import(self):
+        etag = self.client.get(self.api_url)['ETag']
+        PageVisitFactory(page=self.page, lms_user=self.lms_user, visited_at=self.get_week_start_dt(2))
+        self.course_offering.last_activity_at = self.get_week_start_dt(2)
+        self.course_offering.save()
+        self.summarise()
+
+        response = self.client.get(self.api_url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))['totalsByWeek'][-1], 2)
+
+    def test_modified_by_event_change(self):
+        # Last-Modified is only to the second, so the offering was saved earlier than the event's change
+        CourseOffering.objects.filter(pk=self.course_offering.pk).update(updated_at=now() - datetime.timedelta(hours=1))
+        response = self.client.get(self.api_url)
+        last_modified = response['Last-Modified']
+        etag = response['ETag']
+        CourseRepeatingEventFactory(course_offering=self.course_offering, start_week=1, end_week=2, day_of_week=0)
+
+        response = self.client.get(self.api_url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_access_checked_before_not_modified(self):
+        etag = self.client.get(self.api_url)['ETag']
+        other_user = LecturerFactory(password='12345')
+        self.client.login(username=other_user.email, password='12345')
+        self.assertEqual(self.client.get(self.api_url, HTTP_IF_NONE_MATCH=etag).status_code, 403)
+
+
+class WarmResponsesTests(APITestsBase):
+    def setUp(self):
+        super().setUp()
+        self.use_response_cache()
+        clear_response_cache_info()
+        self.repeating_event = CourseRepeatingEventFactory(course_offering=self.course_offering, start_week=1, end_week=2, day_of_week=0)
+        PageVisitFactory(page=PageFactory(course_offering=self.course_offering), lms_user=self.lms_user, visited_at=self.get_week_start_dt(1))
+        self.summarise()
+
+    def test_warm_paths(self):
+        paths_by_view = {}
+        for url_name, path in get_warm_paths(self.course_offering):
+            paths_by_view.setdefault(url_name, []).append(path)
+
+        no_weeks = self.course_offering.no_weeks
+        self.assertEqual(len(paths_by_view['content_accesses']), 1)
+        self.assertEqual(paths_by_view['content_events'], [reverse('olap:content_events', kwargs={'course_id': self.course_offering.id, 'event_id': self.repeating_event.id})])
+        self.assertEqual(len(paths_by_view['per_week_metrics']), no_weeks)
+        # Optionally by week
+        self.assertEqual(len(paths_by_view['top_content']), no_weeks + 1)
+        self.assertNotIn('student_assessments', paths_by_view)
+        self.assertNotIn('students_not_viewed_resource', paths_by_view)
+
+    def test_warmed_responses_cached(self):
+        seconds_by_view = warm_responses(self.course_offering)
+        self.assertIn('top_content', seconds_by_view)
+
+        response = self.client.get(reverse('olap:top_content', kwargs={'course_id': self.course_offering.id, 'week_num': 2}), HTTP_ACCEPT='application/json')
+        self.assertEqual(response.status_code, HTTP_200_OK)
+        self.assertEqual(response_cache_info()['top_content'], (1, self.course_offering.no_weeks + 1))
+
+    def test_warming_enabled(self):
+        # Only if opted into, with a response cache to keep the responses in
+        self.assertFalse(warming_enabled())
+        with override_settings(CLOOP_OLAP_WARM_RESPONSES=True):
+            self.assertTrue(warming_enabled())
+            with override_settings(CLOOP_OLAP_RESPONSE_CACHE=None):
+                self.assertFalse(warming_enabled())
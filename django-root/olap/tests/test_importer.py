@@ -1,23 +1,60 @@
+from contextlib import redirect_stdout
 import csv
 import datetime
 import io
+import os
+import tempfile
 from textwrap import dedent
+from unittest import mock
+from unittest import skipIf
+from unittest import skipUnless
+import zipfile
 
+from django.db import connection
+
+from django.test import override_settings
+from django.test.testcases import SimpleTestCase
 from django.test.testcases import TestCase
+from django.utils import dateparse
 from django.utils.timezone import get_current_timezone
+import numpy as np
+import pandas as pd
 
+from dashboard.models import CourseOffering
 from dashboard.tests.factories import CourseOfferingFactory
+from olap.activity_parsing import TimestampParser
+from olap.activity_parsing import check_timestamp
+from olap.activity_parsing import check_timestamp_column
+from olap.activity_parsing import parse_activity_frame
+from olap.activity_parsing import to_epoch_microseconds
+from olap.bulk import bulk_load_ignore_values
+from olap.bulk import load_data_line
+from olap.cubes import CUBES
+from olap.cubes import update_cubes
 from olap.lms_import import BlackboardImport
 from olap.lms_import import ImportLmsData
+from olap.lms_import import LMSImportDataError
 from olap.lms_import import LMSImportFileError
+from olap.models import ImportCheckpoint
 from olap.models import LMSSession, SummaryPost
 from olap.models import LMSUser
+from olap.models import LMSUserActivityByWeek
+from olap.models import LMSUserVisitsByWeekday
 from olap.models import Page
+from olap.models import PageActivityByWeek
 from olap.models import PageVisit
+from olap.models import PageVisitsByWeekday
 from olap.models import SubmissionAttempt
+from olap.sessions import ArraySessionizer
+from olap.snapshots import load_columns
+from olap.snapshots import open_snapshot
+from olap.tasks import update_course_weeks_task
+from olap.time_dimensions import TIME_DIMENSION_FIELDS
 from olap.tests.factories import LMSUserFactory
 from olap.tests.factories import PageFactory
 from olap.tests.factories import PageVisitFactory
+from olap.tests.factories import SubmissionAttemptFactory
+from olap.visit_cache import OfferingVisits
 
 
 class ImporterSessionCalcTests(TestCase):
@@ -50,7 +87,7 @@ class ImporterSessionCalcTests(TestCase):
         )
 
         lms_user = LMSUserFactory(course_offering=self.offering)
-        page = PageFactory()
+        page = PageFactory(course_offering=self.offering)
 
         importer = ImportLmsData(self.offering, 'ignore.txt')
 
@@ -84,14 +121,14 @@ class ImporterSessionCalcTests(TestCase):
         # especially the aspect that visits due to one user are ignored when calculating the session for another user.
 
         u1 = LMSUserFactory(course_offering=self.offering)
-        u1_p1 = PageFactory()
-        u1_p2 = PageFactory()
+        u1_p1 = PageFactory(course_offering=self.offering)
+        u1_p2 = PageFactory(course_offering=self.offering)
 
         u2 = LMSUserFactory(course_offering=self.offering)
-        u2_p1 = PageFactory()
-        u2_p2 = PageFactory()
+        u2_p1 = PageFactory(course_offering=self.offering)
+        u2_p2 = PageFactory(course_offering=self.offering)
 
-        orphan = PageFactory()
+        orphan = PageFactory(course_offering=self.offering)
 
         # Visits for u1 which should result in a session starting at test_start_dt, lasting 25 mins
         u1_expected_session_start_dt = self.test_start_datetime
@@ -123,9 +160,9 @@ class ImporterSessionCalcTests(TestCase):
         u1 = LMSUserFactory(course_offering=self.offering)
         u2 = LMSUserFactory(course_offering=self.offering)
 
-        pre_page = PageFactory()
-        common_visit_pages = PageFactory.create_batch(3)
-        post_page = PageFactory()
+        pre_page = PageFactory(course_offering=self.offering)
+        common_visit_pages = PageFactory.create_batch(3, course_offering=self.offering)
+        post_page = PageFactory(course_offering=self.offering)
 
         user_visit_info = {
             u1.pk: (
@@ -164,6 +201,106 @@ class ImporterSessionCalcTests(TestCase):
 
         self.assertEqual(expected_session_info, extracted_session_info)
 
+    def test_query_count_independent_of_users(self):
+        # Sessions for every user are found in one pass and written with a fixed number of statements
+        users = LMSUserFactory.create_batch(5, course_offering=self.offering)
+        page = PageFactory(course_offering=self.offering)
+        for user in users:
+            for visit_offset_mins in (0, 10, 100, 110, 300):
+                PageVisitFactory(lms_user=user, page=page, visited_at=self.test_start_datetime + datetime.timedelta(minutes=visit_offset_mins))
+
+        importer = ImportLmsData(self.offering, 'ignore.txt')
+        # Select visits, insert sessions, fetch session ids, assign visits to sessions
+        with self.assertNumQueries(4):
+            sessions_created = importer._calculate_sessions()
+
+        self.assertEqual(sessions_created, 15)
+        self.assertEqual(LMSSession.objects.filter(course_offering=self.offering).count(), 15)
+        self.assertFalse(PageVisit.objects.filter(session__isnull=True).exists())
+        for session in LMSSession.objects.all():
+            self.assertEqual(set(session.pagevisit_set.values_list('lms_user', flat=True)), {session.first_visit.lms_user_id})
+            self.assertEqual(session.pagevisit_set.count(), session.pageviews)
+
+    def test_update_sessions_of_users_with_new_visits(self):
+        # Only the sessions that new visits could extend are recalculated, and the result is the same as recalculating
+        # from scratch
+        u1 = LMSUserFactory(course_offering=self.offering)
+        u2 = LMSUserFactory(course_offering=self.offering)
+        page = PageFactory(course_offering=self.offering)
+
+        def add_visits(user, visit_offsets_mins):
+            for visit_offset_mins in visit_offsets_mins:
+                PageVisitFactory(lms_user=user, page=page, visited_at=self.test_start_datetime + datetime.timedelta(minutes=visit_offset_mins))
+
+        add_visits(u1, (0, 10, 100, 110, 300, 320))
+        add_visits(u2, (0, 10, 100))
+        importer = ImportLmsData(self.offering, 'ignore.txt')
+        importer._calculate_sessions()
+        original_session_pks = set(LMSSession.objects.values_list('pk', flat=True))
+
+        # The new visits extend u1's session starting at 100 mins, and start a new one
+        add_visits(u1, (140, 500))
+        sessions_created = importer._calculate_sessions({u1.pk: self.test_start_datetime + datetime.timedelta(minutes=140)})
+
+        self.assertEqual(sessions_created, 3)
+        session_info_extractor = lambda s: (s.first_visit.lms_user, s.first_visit.visited_at, s.session_length_in_mins, s.pageviews)
+        expected_session_info = [
+            (u1, self.test_start_datetime, 10, 2),
+            (u1, self.test_start_datetime + datetime.timedelta(minutes=100), 40, 3),
+            (u1, self.test_start_datetime + datetime.timedelta(minutes=300), 20, 2),
+            (u1, self.test_start_datetime + datetime.timedelta(minutes=500), 0, 1),
+            (u2, self.test_start_datetime, 10, 2),
+            (u2, self.test_start_datetime + datetime.timedelta(minutes=100), 0, 1),
+        ]
+        sessions = LMSSession.objects.order_by('first_visit__lms_user_id', 'first_visit__visited_at')
+        self.assertEqual(expected_session_info, [session_info_extractor(session) for session in sessions])
+        # u1's session before the new visits, and all of u2's, are the original rows
+        self.assertEqual([session.pk in original_session_pks for session in sessions], [True, False, False, False, True, True])
+        self.assertFalse(PageVisit.objects.filter(session__isnull=True).exists())
+        for session in sessions:
+            self.assertEqual(session.pagevisit_set.count(), session.pageviews)
+
+    def test_resessionize_with_gap(self):
+        # Rebuilding with the import's session length gives the same sessions as the import; a shorter gap
+        # replaces them with more, shorter sessions
+        u1 = LMSUserFactory(course_offering=self.offering)
+        u2 = LMSUserFactory(course_offering=self.offering)
+        page = PageFactory(course_offering=self.offering)
+        for user, visit_offsets_mins in ((u1, (0, 15, 30, 95, 130)), (u2, (-5, 30, 45, 200))):
+            for visit_offset_mins in visit_offsets_mins:
+                PageVisitFactory(lms_user=user, page=page, visited_at=self.test_start_datetime + datetime.timedelta(minutes=visit_offset_mins))
+
+        session_info_extractor = lambda s: (s.first_visit.lms_user, s.first_visit.visited_at, s.session_length_in_mins, s.pageviews)
+
+        ImportLmsData(self.offering, 'ignore.txt')._calculate_sessions()
+        imported_session_info = sorted((session_info_extractor(s) for s in LMSSession.objects.all()), key=lambda info: (info[0].pk, info[1]))
+
+        sessionizer = ArraySessionizer(self.offering, ImportLmsData.SESSION_LENGTH_MINS)
+        sessionizer.resessionize()
+        resessionized_info = sorted((session_info_extractor(s) for s in LMSSession.objects.all()), key=lambda info: (info[0].pk, info[1]))
+        self.assertEqual(imported_session_info, resessionized_info)
+        self.assertEqual(sessionizer.sessions_created, 4)
+
+        # Each user's sessions are replaced in a batch of their own
+        sessionizer = ArraySessionizer(self.offering, 20)
+        with mock.patch.object(ArraySessionizer, 'USER_BATCH_VISITS', 2):
+            sessionizer.resessionize()
+        resessionized_info = sorted((session_info_extractor(s) for s in LMSSession.objects.all()), key=lambda info: (info[0].pk, info[1]))
+        expected_session_info = [
+            (u1, self.test_start_datetime, 30, 3),
+            (u1, self.test_start_datetime + datetime.timedelta(minutes=95), 0, 1),
+            (u1, self.test_start_datetime + datetime.timedelta(minutes=130), 0, 1),
+            (u2, self.test_start_datetime + datetime.timedelta(minutes=-5), 0, 1),
+            (u2, self.test_start_datetime + datetime.timedelta(minutes=30), 15, 2),
+            (u2, self.test_start_datetime + datetime.timedelta(minutes=200), 0, 1),
+        ]
+        self.assertEqual(expected_session_info, resessionized_info)
+        self.assertEqual(sessionizer.sessions_created, 6)
+        self.assertEqual(len(sessionizer.timings), 3)
+        self.assertFalse(PageVisit.objects.filter(session__isnull=True).exists())
+        for session in LMSSession.objects.all():
+            self.assertEqual(session.pagevisit_set.count(), session.pageviews)
+
 
 class ImportUsersTestCase(TestCase):
     """
@@ -201,6 +338,29 @@ class ImportUsersTestCase(TestCase):
 
         self.assertTrue(LMSUser.objects.filter(lms_user_id=1, username='fred', firstname='Fred', lastname='Jones', email='fred@email.com', course_offering=self.offering).exists())
 
+    def test_changed_data(self):
+        test_users = """\
+            user_key|username|firstname|lastname|email
+            1|fred|Fred|Smith|fred@email.com
+            2|jane|Jane|Doe|jane@email.com
+            3|bob|Bob|Brown|bob@email.com
+        """
+
+        LMSUserFactory(lms_user_id=1, username='fred', firstname='Fred', lastname='Jones', email='fred@email.com', course_offering=self.offering)
+        LMSUserFactory(lms_user_id=2, username='jane', firstname='Jane', lastname='Doe', email='jane@email.com', course_offering=self.offering)
+
+        csv_data = io.StringIO(dedent(test_users))
+        user_data = csv.DictReader(csv_data, delimiter='|')
+
+        importer = BlackboardImport('ignore.zip', self.offering)
+        # Load existing users, insert the new user, update the changed user
+        with self.assertNumQueries(3):
+            importer._process_users(user_data)
+
+        self.assertEqual(LMSUser.objects.filter(course_offering=self.offering).count(), 3)
+        self.assertTrue(LMSUser.objects.filter(lms_user_id=1, lastname='Smith', course_offering=self.offering).exists())
+        self.assertTrue(LMSUser.objects.filter(lms_user_id=3, username='bob', course_offering=self.offering).exists())
+
 
 class ImportResourcesTestCase(TestCase):
     """
@@ -237,8 +397,35 @@ class ImportResourcesTestCase(TestCase):
         resources_data = csv.DictReader(csv_data, delimiter='|')
         importer._process_resources(resources_data)
 
-        self.assertTrue(Page.objects.filter(content_id=1, parent__isnull=True, title='Parent page', content_type='resource/x-bb-document', is_forum=False, course_offering=self.offering).exists())
-        self.assertTrue(Page.objects.filter(content_id=2, parent__isnull=True, title='Child page', content_type='resource/x-bb-document', is_forum=False, course_offering=self.offering).exists())
+        parent_page = Page.objects.get(content_id=1, parent__isnull=True, title='Parent page', content_type='resource/x-bb-document', is_forum=False, course_offering=self.offering)
+        self.assertTrue(Page.objects.filter(content_id=2, parent=parent_page, title='Child page', content_type='resource/x-bb-document', is_forum=False, course_offering=self.offering).exists())
+
+    def test_changed_data(self):
+        test_resources = """\
+            content_key|parent_content_key|title|resource_type
+            1||Parent page|resource/x-bb-document
+            2|1|Renamed child page|resource/x-bb-document
+            3|1|New page|resource/x-bb-document
+        """
+
+        importer = BlackboardImport('ignore.zip', self.offering)
+
+        parent_page = PageFactory(content_id=1, title='Parent page', content_type='resource/x-bb-document', course_offering=self.offering)
+        child_page = PageFactory(content_id=2, title='Child page', content_type='resource/x-bb-document', parent=parent_page, course_offering=self.offering)
+        orphaned_page = PageFactory(content_id=4, title='Orphaned page', parent=parent_page, course_offering=self.offering)
+
+        csv_data = io.StringIO(dedent(test_resources))
+        resources_data = csv.DictReader(csv_data, delimiter='|')
+        importer._process_resources(resources_data)
+
+        self.assertEqual(Page.objects.filter(course_offering=self.offering).count(), 4)
+        child_page.refresh_from_db()
+        self.assertEqual(child_page.title, 'Renamed child page')
+        self.assertEqual(child_page.parent, parent_page)
+        self.assertTrue(Page.objects.filter(content_id=3, parent=parent_page, title='New page', course_offering=self.offering).exists())
+        # Pages that aren't in the file are left alone
+        orphaned_page.refresh_from_db()
+        self.assertEqual(orphaned_page.parent, parent_page)
 
     def test_valid_parents_data(self):
         test_resources = """\
@@ -420,6 +607,59 @@ class ImportPostsTestCase(TestCase):
         self.assertTrue(SummaryPost.objects.filter(page=page, lms_user=user1, posted_at=posted_dt).exists())
         self.assertTrue(SummaryPost.objects.filter(page=page, lms_user=user2, posted_at=posted_dt).exists())
 
+    def test_duplicate_posts(self):
+        test_posts = """\
+            forum_key|user_key|thread|post|timestamp
+            1|1|Name of thread|User 1 post|2017-10-05 13:30:00+00:00
+            1|1|Name of thread|User 1 post again|2017-10-05 13:30:00+00:00
+            1|2|Name of thread|User 2 post|2017-10-05 13:30:00+00:00
+        """
+
+        importer = BlackboardImport('ignore.zip', self.offering)
+
+        PageFactory(content_id=1, is_forum=True, content_type='resource/x-bb-discussionboard', course_offering=self.offering)
+        LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=2, course_offering=self.offering)
+
+        csv_data = io.StringIO(dedent(test_posts))
+        posts_data = csv.DictReader(csv_data, delimiter='|')
+        # The posts are inserted together
+        with self.assertNumQueries(3):
+            importer._process_posts(posts_data)
+
+        self.assertEqual(importer.error_list, [])
+        self.assertEqual(importer.insert_stats['posts inserted'], 2)
+        self.assertEqual(importer.insert_stats['posts duplicates'], 1)
+        self.assertEqual(SummaryPost.objects.count(), 2)
+
+    def test_missing_forums_created(self):
+        test_posts = """\
+            forum_key|user_key|thread|post|timestamp
+            1|1|First thread|User 1 post|2017-10-05 13:30:00+00:00
+            2|1|Second thread|User 1 post|2017-10-05 13:31:00+00:00
+            1|2|Reply|User 2 post|2017-10-05 13:32:00+00:00
+        """
+
+        importer = BlackboardImport('ignore.zip', self.offering)
+
+        LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=2, course_offering=self.offering)
+
+        csv_data = io.StringIO(dedent(test_posts))
+        posts_data = csv.DictReader(csv_data, delimiter='|')
+        # The forums' pages are inserted together, as are the posts
+        with self.assertNumQueries(5):
+            importer._process_posts(posts_data)
+
+        self.assertEqual(importer.error_list, [])
+        forums = Page.objects.filter(is_forum=True, course_offering=self.offering).order_by('content_id')
+        self.assertEqual([(forum.content_id, forum.title, forum.content_type) for forum in forums], [
+            (1, 'First thread', BlackboardImport.FORUM_CONTENT_TYPE),
+            (2, 'Second thread', BlackboardImport.FORUM_CONTENT_TYPE),
+        ])
+        self.assertEqual(SummaryPost.objects.filter(page=forums[0]).count(), 2)
+        self.assertEqual(SummaryPost.objects.filter(page=forums[1]).count(), 1)
+
 
     def test_missing_related_objects(self):
         test_posts = """\
@@ -543,3 +783,743 @@ class ImportActivityTestCase(TestCase):
 
         self.assertEqual(len(importer.non_critical_error_list), 2)
         self.assertEqual(len(importer.error_list), 1)
+
+    def test_duplicate_visits(self):
+        test_activity = """\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:31:00+00:00
+            2|1||2017-10-05 13:30:00+00:00
+        """
+
+        importer = BlackboardImport('ignore.zip', self.offering)
+
+        page = PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        user1 = LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=2, course_offering=self.offering)
+        PageVisitFactory(lms_user=user1, page=page, visited_at=datetime.datetime(2017, 10, 5, 13, 31, 0, tzinfo=datetime.timezone.utc))
+
+        csv_data = io.StringIO(dedent(test_activity))
+        activity_data = csv.DictReader(csv_data, delimiter='|')
+        importer._process_access_log(activity_data)
+
+        # One duplicate within the file and one of an existing visit are skipped, and the other rows are kept
+        self.assertEqual(importer.error_list, [])
+        self.assertEqual(importer.insert_stats['visits inserted'], 2)
+        self.assertEqual(importer.insert_stats['visits duplicates'], 2)
+        self.assertEqual(PageVisit.objects.count(), 3)
+
+    def test_lookups_use_in_memory_maps(self):
+        test_activity = """\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:31:00+00:00
+            2|1||2017-10-05 13:30:00+00:00
+            2||2|2017-10-05 13:30:00+00:00
+            500|1||2017-10-05 13:30:00+00:00
+            1|500||2017-10-05 13:30:00+00:00
+        """
+
+        importer = BlackboardImport('ignore.zip', self.offering)
+
+        PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        PageFactory(content_id=2, is_forum=True, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=2, course_offering=self.offering)
+
+        csv_data = io.StringIO(dedent(test_activity))
+        activity_data = csv.DictReader(csv_data, delimiter='|')
+        # One query to build each map, then a single insert for the batch
+        with self.assertNumQueries(3):
+            importer._process_access_log(activity_data)
+
+        self.assertEqual(PageVisit.objects.count(), 4)
+        self.assertEqual(importer.lookup_stats['user_hits'], 5)
+        self.assertEqual(importer.lookup_stats['user_misses'], 1)
+        self.assertEqual(importer.lookup_stats['page_hits'], 4)
+        self.assertEqual(importer.lookup_stats['page_misses'], 1)
+
+    def test_invalid_timestamps(self):
+        test_activity = """\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||yesterday
+            1|1||2017-02-30 13:30:00+00:00
+            1|1||2016-10-05 13:30:00+00:00
+            500|1||yesterday
+        """
+
+        importer = BlackboardImport('ignore.zip', self.offering)
+
+        PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+
+        csv_data = io.StringIO(dedent(test_activity))
+        activity_data = csv.DictReader(csv_data, delimiter='|')
+        importer._process_access_log(activity_data)
+
+        self.assertEqual(importer.error_list, [
+            'Timestamp yesterday for access activity is not a valid format',
+            'Timestamp 2017-02-30 13:30:00+00:00 for access activity is not a valid datetime',
+            'Timestamp 2016-10-05 13:30:00+00:00 for access activity is outside course offering start/end',
+            'Unable to find user 500 for activity',
+        ])
+        self.assertEqual(PageVisit.objects.count(), 1)
+
+    def test_delta_import(self):
+        test_activity = """\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 12:30:00+00:00
+            500|1||2017-10-05 12:45:00+00:00
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 14:30:00+00:00
+            2|1||2017-10-05 14:00:00+00:00
+        """
+
+        watermark = datetime.datetime(2017, 10, 5, 13, 30, 0, tzinfo=datetime.timezone.utc)
+        self.offering.last_activity_at = watermark
+        self.offering.save()
+        importer = BlackboardImport('ignore.zip', self.offering, since=watermark)
+
+        page = PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        user1 = LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=2, course_offering=self.offering)
+        PageVisitFactory(lms_user=user1, page=page, visited_at=watermark)
+
+        csv_data = io.StringIO(dedent(test_activity))
+        activity_data = csv.DictReader(csv_data, delimiter='|')
+        importer._process_access_log(activity_data)
+
+        # Rows at or before the watermark are skipped, including the one for an unknown user
+        self.assertEqual(importer.error_list, [])
+        self.assertEqual(importer.skipped_stats['visits'], 3)
+        self.assertEqual(PageVisit.objects.count(), 3)
+        self.assertEqual(importer.latest_activity_at, watermark + datetime.timedelta(hours=1))
+
+        # The watermark moves on to the latest activity
+        ImportLmsData(self.offering, 'ignore.zip', delta=True).set_latest_activity()
+        self.offering.refresh_from_db()
+        self.assertEqual(self.offering.last_activity_at, watermark + datetime.timedelta(hours=1))
+
+
+    def test_columnar_matches_row_by_row(self):
+        test_activity = dedent("""\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:30:00+00:00
+            500|1||2017-10-05 13:30:00+00:00
+            1|500||2017-10-05 13:30:00+00:00
+            2||2|2017-10-05T14:30:00.000000+11:00
+            2||500|2017-10-05 13:30:00+00:00
+            1|1||yesterday
+            500|1||yesterday
+            1|1||2017-02-30 13:30:00+00:00
+            1|1||2016-10-05 13:30:00+00:00
+            2|1||2017-10-05 12:00:00Z
+            1|1||2017-10-05 13:31:00+00:00
+        """)
+        watermark = datetime.datetime(2017, 10, 5, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+        page = PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        PageFactory(content_id=2, is_forum=True, course_offering=self.offering)
+        user1 = LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=2, course_offering=self.offering)
+        existing_visit = PageVisitFactory(lms_user=user1, page=page, visited_at=datetime.datetime(2017, 10, 5, 13, 31, 0, tzinfo=datetime.timezone.utc))
+
+        def import_activity(columnar_activity, since):
+            PageVisit.objects.exclude(pk=existing_visit.pk).delete()
+            importer = BlackboardImport('ignore.zip', self.offering, since=since, columnar_activity=columnar_activity)
+            if columnar_activity:
+                header, rows = test_activity.encode('UTF-8').split(b'\n', 1)
+                importer._import_activity_frame(lambda: parse_activity_frame(rows, header.decode('UTF-8').split('|'), importer._activity_window))
+            else:
+                importer._process_access_log(csv.DictReader(io.StringIO(test_activity), delimiter='|'))
+            return (
+                set(PageVisit.objects.values_list('course_offering', 'data_version', 'lms_user', 'page', 'visited_at', *TIME_DIMENSION_FIELDS)),
+                importer.error_list,
+                importer.non_critical_error_list,
+                importer.lookup_stats,
+                importer.insert_stats,
+                importer.skipped_stats,
+                importer.first_new_visit_times,
+                importer.latest_activity_at,
+            )
+
+        for since in (None, watermark, watermark + datetime.timedelta(days=1)):
+            with self.subTest(since=since):
+                self.assertEqual(import_activity(True, since), import_activity(False, since))
+
+    def test_time_dimensions(self):
+        # Daylight saving starts in Melbourne on 2017-10-01, the last Sunday of week 12 of the offering.  The visits
+        # either side of the following midnight are 23 hours after the start of the course plus a whole number of
+        # days, but still in different weeks
+        test_activity = dedent("""\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-01T23:30:00.000000+11:00
+            1|1||2017-10-02T00:30:00.000000+11:00
+        """)
+        PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+
+        for columnar_activity in (False, True):
+            with self.subTest(columnar_activity=columnar_activity):
+                PageVisit.objects.all().delete()
+                importer = BlackboardImport('ignore.zip', self.offering, columnar_activity=columnar_activity)
+                if columnar_activity:
+                    header, rows = test_activity.encode('UTF-8').split(b'\n', 1)
+                    importer._import_activity_frame(lambda: parse_activity_frame(rows, header.decode('UTF-8').split('|'), importer._activity_window))
+                else:
+                    importer._process_access_log(csv.DictReader(io.StringIO(test_activity), delimiter='|'))
+
+                self.assertEqual(list(PageVisit.objects.order_by('visited_at').values_list(*TIME_DIMENSION_FIELDS)), [
+                    (12, datetime.date(2017, 10, 1), 6, 23),
+                    (13, datetime.date(2017, 10, 2), 0, 0),
+                ])
+
+    def test_update_course_weeks(self):
+        page = PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        visit = PageVisitFactory(page=page, visited_at=datetime.datetime(2017, 7, 17, 9, 0, 0, tzinfo=datetime.timezone.utc))
+        self.assertEqual(visit.course_week, 2)
+
+        self.offering.start_date = datetime.date(2017, 7, 10)
+        self.assertEqual(PageVisit.update_course_weeks(self.offering), 1)
+        self.assertEqual(PageVisit.objects.get().course_week, 1)
+
+
+@skipIf(connection.vendor == 'mysql' and not connection.settings_dict['OPTIONS'].get('local_infile'), 'LOAD DATA LOCAL INFILE is not enabled')
+class LoadDataTestCase(TestCase):
+    """
+    Tests to ensure that activity loaded with LOAD DATA LOCAL INFILE (or inserted instead, off MySQL) is stored correctly
+    """
+
+    def setUp(self):
+        self.offering = CourseOfferingFactory(start_date=datetime.date(2017, 7, 3), no_weeks=14)
+        self.page = PageFactory(content_id=1, is_forum=False, course_offering=self.offering)
+        self.user = LMSUserFactory(lms_user_id=1, course_offering=self.offering)
+
+    def test_load_data_line(self):
+        self.assertEqual(load_data_line([1, None, True, 'a\tb\\c\nd']), '1\t\\N\t1\ta\\tb\\\\c\\nd\n')
+
+    def test_duplicate_visits(self):
+        test_activity = """\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:31:00+00:00
+        """
+        PageVisitFactory(lms_user=self.user, page=self.page, visited_at=datetime.datetime(2017, 10, 5, 13, 31, 0, tzinfo=datetime.timezone.utc))
+
+        importer = BlackboardImport('ignore.zip', self.offering, load_data=True)
+        importer._process_access_log(csv.DictReader(io.StringIO(dedent(test_activity)), delimiter='|'))
+
+        self.assertEqual(importer.error_list, [])
+        self.assertEqual(importer.insert_stats['visits inserted'], 1)
+        self.assertEqual(importer.insert_stats['visits duplicates'], 2)
+        self.assertEqual(PageVisit.objects.count(), 2)
+
+    @skipUnless(connection.vendor == 'mysql', 'LOAD DATA is only used on MySQL')
+    def test_bulk_load(self):
+        visited_at = datetime.datetime(2017, 10, 5, 13, 30, 0, tzinfo=datetime.timezone.utc)
+        rows = [
+            (self.user.pk, self.page.pk, visited_at),
+            (self.user.pk, self.page.pk, visited_at),
+            (self.user.pk, self.page.pk, visited_at + datetime.timedelta(microseconds=1)),
+        ]
+
+        self.assertEqual(bulk_load_ignore_values(PageVisit, ['lms_user', 'page', 'visited_at'], rows), (2, 1))
+        self.assertEqual(bulk_load_ignore_values(PageVisit, ['lms_user', 'page', 'visited_at'], rows), (0, 3))
+        self.assertEqual(
+            sorted(PageVisit.objects.values_list('visited_at', flat=True)),
+            [visited_at, visited_at + datetime.timedelta(microseconds=1)],
+        )
+        self.assertFalse(PageVisit.objects.filter(session__isnull=False).exists())
+
+
+class TimestampParserTestCase(SimpleTestCase):
+    """
+    Tests to ensure that timestamps are parsed as dateparse.parse_datetime would
+    """
+
+    def assertParsedLikeDateparse(self, parser, timestamp):
+        try:
+            expected = dateparse.parse_datetime(timestamp)
+            # An out of range UTC offset only raises ValueError once the datetime is used
+            expected = None if expected is None else to_epoch_microseconds(expected)
+        except ValueError:
+            with self.assertRaises(ValueError):
+                parser.parse(timestamp)
+        else:
+            self.assertEqual(parser.parse(timestamp), expected)
+
+    def test_matches_dateparse(self):
+        timestamps = [
+            '2017-10-05 13:30:00+00:00',
+            '2018-05-07T09:29:01.000000+11:00',
+            '2018-05-07T09:29:01.123456-03:30',
+            '2016-05-08T11:15:04Z',
+            '2016-05-08T11:15:04+1100',
+            # Formats left to dateparse
+            '2016-05-08T11:15:04.12+11:00',
+            '2016-5-8T11:15:04+11:00',
+            '2016-05-08T11:15+11:00',
+            'yesterday',
+            '',
+            # Invalid values
+            '2017-02-30 13:30:00+00:00',
+            '2017-01-01 24:00:00+00:00',
+            '2017-01-01 12:00:60+00:00',
+            '2017-01-01 12:00:00+24:00',
+        ]
+
+        parser = TimestampParser()
+        # Twice, so the second pass uses the cached parts
+        for timestamp in timestamps + timestamps:
+            with self.subTest(timestamp=timestamp):
+                self.assertParsedLikeDateparse(parser, timestamp)
+
+
+    def test_column_matches_check_timestamp(self):
+        timestamps = [
+            '2017-10-05 13:30:00+00:00',
+            '2017-10-05T09:29:01.000000+11:00',
+            '2017-10-05T09:29:01.123456-03:30',
+            '2017-10-05T11:15:04Z',
+            '2016-02-29 11:15:04Z',
+            '2018-05-07T09:29:01.000000+11:00',
+            # Formats left to check_timestamp
+            '2017-10-05T11:15:04+1100',
+            '2017-10-05T11:15:04.12+11:00',
+            '2017-10-5T11:15:04+11:00',
+            '2017-10-05T11:15:04.000000+11:00 ',
+            'yesterday',
+            '',
+            # Invalid values
+            '2017-02-29 13:30:00+00:00',
+            '2017-13-01 13:30:00+00:00',
+            '2017-01-01 24:00:00+00:00',
+            '2017-01-01 12:00:60+00:00',
+            '2017-01-01 12:00:00+24:00',
+        ]
+        window = (
+            to_epoch_microseconds(datetime.datetime(2017, 7, 3, tzinfo=datetime.timezone.utc)),
+            to_epoch_microseconds(datetime.datetime(2017, 10, 9, tzinfo=datetime.timezone.utc)),
+        )
+
+        statuses, times = check_timestamp_column(pd.Series(timestamps), window)
+        for timestamp, status, time in zip(timestamps, statuses, times):
+            with self.subTest(timestamp=timestamp):
+                self.assertEqual((status, time), check_timestamp(timestamp, window))
+
+
+class ImportCheckpointTestCase(TestCase):
+    """
+    Tests to ensure that an import which fails part way through can be resumed
+    """
+
+    def setUp(self):
+        self.offering = CourseOfferingFactory(start_date=datetime.date(2017, 7, 3), no_weeks=14)
+        self.import_dir = tempfile.TemporaryDirectory()
+        self.import_path = os.path.join(self.import_dir.name, 'import.zip')
+        self.write_import_file(dedent("""\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 13:30:00+00:00
+            2|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:35:00+00:00
+            2|1||2017-10-05 15:00:00+00:00
+            1|1||2017-10-05 13:40:00+00:00
+        """))
+
+    def write_import_file(self, activity):
+        with zipfile.ZipFile(self.import_path, 'w') as import_zip:
+            import_zip.writestr(BlackboardImport.USERS_FILE, dedent("""\
+                user_key|firstname|lastname|username|email
+                1|Fred|Bloggs|fred|fred@example.com
+                2|Jane|Doe|jane|jane@example.com
+            """))
+            import_zip.writestr(BlackboardImport.RESOURCES_FILE, dedent("""\
+                content_key|parent_content_key|title|resource_type
+                1||Week 1|resource/x-bb-document
+            """))
+            import_zip.writestr(BlackboardImport.POSTS_FILE, "forum_key|user_key|thread|post|timestamp\n")
+            import_zip.writestr(BlackboardImport.SUBMISSIONS_FILE, "user_key|content_key|user_grade|timestamp\n")
+            import_zip.writestr(BlackboardImport.ACTIVITY_FILE, activity)
+
+    def tearDown(self):
+        self.import_dir.cleanup()
+
+    def process_import(self, **kwargs):
+        with redirect_stdout(io.StringIO()):
+            ImportLmsData(self.offering, self.import_path, **kwargs).process()
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    def test_interrupted_import_resumed(self):
+        import_activity_chunk = BlackboardImport._import_activity_chunk
+        chunks_processed = []
+
+        def fail_on_second_chunk(importer, parse_chunk):
+            chunks_processed.append(parse_chunk)
+            if len(chunks_processed) == 2:
+                raise RuntimeError('Import interrupted')
+            import_activity_chunk(importer, parse_chunk)
+
+        with mock.patch.object(BlackboardImport, '_import_activity_chunk', fail_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self.process_import()
+
+        # The first chunk was committed into the published version
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.data_version, checkpoint.phase), (0, ImportCheckpoint.PHASE_ACTIVITY))
+        self.assertEqual(PageVisit.objects.count(), 2)
+        self.assertEqual(LMSUser.objects.count(), 2)
+
+        # A rerun carries on from the second chunk
+        self.process_import()
+
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.assertEqual(PageVisit.objects.count(), 5)
+        self.assertEqual(sorted(LMSSession.objects.values_list('pageviews', flat=True)), [1, 1, 3])
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    def test_interrupted_delta_import(self):
+        self.process_import()
+        self.offering.refresh_from_db()
+        last_activity_at = self.offering.last_activity_at
+        self.write_import_file(dedent("""\
+            user_key|content_key|forum_key|timestamp
+            2|1||2017-10-05 15:05:00+00:00
+            2|1||2017-10-06 13:30:00+00:00
+            1|1||2017-10-06 13:35:00+00:00
+        """))
+
+        def fail_on_sessions(importer):
+            raise RuntimeError('Import interrupted')
+
+        with mock.patch.object(ImportLmsData, '_calculate_import_sessions', fail_on_sessions):
+            with self.assertRaises(RuntimeError):
+                self.process_import(delta=True)
+
+        # The new visits are committed, but not read until last_activity_at moves on past them
+        self.assertEqual(PageVisit.objects.count(), 8)
+        self.offering.refresh_from_db()
+        self.assertEqual(self.offering.last_activity_at, last_activity_at)
+        self.assertEqual(len(OfferingVisits.load(self.offering, self.offering.data_version)), 5)
+
+        self.process_import(delta=True)
+
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.offering.refresh_from_db()
+        self.assertEqual(self.offering.last_activity_at, datetime.datetime(2017, 10, 6, 13, 35, 0, tzinfo=datetime.timezone.utc))
+        self.assertEqual(len(OfferingVisits.load(self.offering, self.offering.data_version)), 8)
+        # The visit 5 minutes after user 2's last one extends their session
+        self.assertEqual(sorted(LMSSession.objects.values_list('pageviews', flat=True)), [1, 1, 1, 2, 3])
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    def test_abandoned_delta_import_removed(self):
+        self.process_import()
+        self.write_import_file(dedent("""\
+            user_key|content_key|forum_key|timestamp
+            2|1||2017-10-05 15:05:00+00:00
+            2|1||2017-10-06 13:30:00+00:00
+        """))
+        with mock.patch.object(ImportLmsData, '_finish_import', side_effect=RuntimeError('Import interrupted')):
+            with self.assertRaises(RuntimeError):
+                self.process_import(delta=True)
+        # User 2's last session was extended over the new visit
+        self.assertEqual(sorted(LMSSession.objects.values_list('pageviews', flat=True)), [1, 1, 2, 3])
+
+        # Importing another file removes the activity the unfinished import added, and recalculates the sessions it
+        # extended
+        self.import_path = os.path.join(self.import_dir.name, 'import2.zip')
+        self.write_import_file("user_key|content_key|forum_key|timestamp\n")
+        self.process_import(delta=True)
+
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.assertEqual(PageVisit.objects.count(), 5)
+        self.assertEqual(sorted(LMSSession.objects.values_list('pageviews', flat=True)), [1, 1, 3])
+        for session in LMSSession.objects.all():
+            self.assertEqual(session.pagevisit_set.count(), session.pageviews)
+
+    def test_changed_file_restarts(self):
+        ImportCheckpoint.objects.create(
+            course_offering=self.offering,
+            filename='import.zip',
+            fingerprint='contents of an earlier file',
+            data_version=1,
+            phase=ImportCheckpoint.PHASE_ACTIVITY,
+            activity_offset=1000,
+        )
+
+        self.process_import(shadow=True)
+
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.offering.refresh_from_db()
+        self.assertEqual(self.offering.data_version, 1)
+        self.assertEqual(PageVisit.objects.for_offering(self.offering).count(), 5)
+
+    def test_import_generation(self):
+        self.process_import()
+        self.offering.refresh_from_db()
+        last_activity_at = self.offering.last_activity_at
+        self.assertEqual(self.offering.import_generation, 1)
+
+        # Reimporting recreates the users and pages, with the same data version and last_activity_at
+        self.process_import(just_clear=True)
+        self.process_import()
+        self.offering.refresh_from_db()
+        self.assertEqual((self.offering.data_version, self.offering.last_activity_at), (0, last_activity_at))
+        self.assertEqual(self.offering.import_generation, 3)
+
+        # Finishing with a copy of the offering from before the import, as the tasks do, leaves the generation alone
+        stale_offering = CourseOffering.objects.get(pk=self.offering.pk)
+        self.process_import(delta=True)
+        stale_offering.is_importing = False
+        stale_offering.save(update_fields=['is_importing'])
+        self.offering.refresh_from_db()
+        self.assertEqual(self.offering.import_generation, 4)
+
+    def test_offering_created_with_pk(self):
+        offering = CourseOffering(pk=9999, code='TEST9999', title='Test', offering='2017', start_date=self.offering.start_date, no_weeks=10)
+        offering.save()
+        CourseOfferingFactory(pk=9998)
+        self.assertEqual(CourseOffering.objects.filter(pk__in=(9998, 9999)).count(), 2)
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    def test_data_errors(self):
+        self.write_import_file(dedent("""\
+            user_key|content_key|forum_key|timestamp
+            1|1||2017-10-05 13:30:00+00:00
+            3|1||2017-10-05 13:30:00+00:00
+            1|1||2017-10-05 13:35:00+00:00
+            4|1||2017-10-05 15:00:00+00:00
+        """))
+
+        for shadow in (False, True):
+            with self.subTest(shadow=shadow):
+                with mock.patch.object(ImportLmsData, 'report_errors') as report_errors:
+                    with self.assertRaises(LMSImportDataError):
+                        self.process_import(shadow=shadow)
+
+                # The errors in both chunks are reported, and none of the import is read
+                self.assertEqual(report_errors.call_args[0][0], {
+                    'Unable to find user 3 for activity',
+                    'Unable to find user 4 for activity',
+                })
+                self.assertFalse(ImportCheckpoint.objects.exists())
+                self.offering.refresh_from_db()
+                self.assertEqual(self.offering.data_version, 0)
+                self.assertIsNone(self.offering.last_activity_at)
+                self.assertFalse(PageVisit.objects.for_offering(self.offering).exists())
+
+        # The abandoned shadow version is left to be removed
+        self.assertEqual(ImportLmsData(self.offering, None).remove_old_data_versions(), [1])
+        self.assertFalse(PageVisit.objects.exists())
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    def test_shadow_import(self):
+        self.process_import()
+        published_visit_ids = set(PageVisit.objects.for_offering(self.offering).values_list('pk', flat=True))
+
+        import_activity_chunk = BlackboardImport._import_activity_chunk
+        chunks_processed = []
+
+        def fail_on_second_chunk(importer, parse_chunk):
+            chunks_processed.append(parse_chunk)
+            if len(chunks_processed) == 2:
+                raise RuntimeError('Import interrupted')
+            import_activity_chunk(importer, parse_chunk)
+
+        with mock.patch.object(BlackboardImport, '_import_activity_chunk', fail_on_second_chunk):
+            with self.assertRaises(RuntimeError):
+                self.process_import(shadow=True)
+
+        # The partly imported version isn't published, so the previous version is still read
+        self.offering.refresh_from_db()
+        self.assertEqual(self.offering.data_version, 0)
+        self.assertEqual(ImportCheckpoint.objects.get(course_offering=self.offering).data_version, 1)
+        self.assertEqual(set(PageVisit.objects.for_offering(self.offering).values_list('pk', flat=True)), published_visit_ids)
+        self.assertEqual(PageVisit.objects.for_offering(self.offering, 1).count(), 2)
+        self.assertEqual(ImportLmsData(self.offering, None).remove_old_data_versions(), [])
+
+        self.process_import(shadow=True)
+
+        self.offering.refresh_from_db()
+        self.assertEqual(self.offering.data_version, 1)
+        self.assertFalse(ImportCheckpoint.objects.exists())
+        self.assertEqual(PageVisit.objects.for_offering(self.offering).count(), 5)
+        self.assertEqual(LMSUser.objects.for_offering(self.offering).count(), 2)
+        self.assertEqual(sorted(LMSSession.objects.for_offering(self.offering).values_list('pageviews', flat=True)), [1, 1, 3])
+        self.assertEqual(self.offering.last_activity_at, datetime.datetime(2017, 10, 5, 15, 0, 0, tzinfo=datetime.timezone.utc))
+
+        # Then the old version is removed
+        self.assertEqual(ImportLmsData(self.offering, None).remove_old_data_versions(), [0])
+        self.assertEqual(PageVisit.objects.count(), 5)
+        self.assertEqual(LMSUser.objects.count(), 2)
+        self.assertEqual(LMSSession.objects.count(), 3)
+
+    def test_cubes(self):
+        self.process_import()
+
+        # The visits are all early on Friday 6 October in Melbourne, in week 13
+        page = Page.objects.get()
+        user1, user2 = LMSUser.objects.order_by('lms_user_id')
+        self.assertEqual(list(PageVisitsByWeekday.objects.values_list('page', 'course_week', 'local_weekday', 'visits')), [(page.pk, 13, 4, 5)])
+        self.assertEqual(set(LMSUserVisitsByWeekday.objects.values_list('lms_user', 'course_week', 'local_weekday', 'visits')), {
+            (user1.pk, 13, 4, 3),
+            (user2.pk, 13, 4, 2),
+        })
+        self.assertEqual(list(PageActivityByWeek.objects.values_list('page', 'course_week', 'visits', 'users', 'posts', 'attempts')), [(page.pk, 13, 5, 2, 0, 0)])
+        self.assertEqual(set(LMSUserActivityByWeek.objects.values_list('lms_user', 'course_week', 'visits', 'posts', 'attempts')), {
+            (user1.pk, 13, 3, 0, 0),
+            (user2.pk, 13, 2, 0, 0),
+        })
+
+        # After a delta import, only the weeks from its watermark are summarised again
+        since = datetime.datetime(2017, 10, 8, 14, 0, 0, tzinfo=datetime.timezone.utc)
+        PageVisitFactory(lms_user=user2, page=page, visited_at=since + datetime.timedelta(hours=1))
+        SubmissionAttemptFactory(lms_user=user1, page=page, attempted_at=since + datetime.timedelta(hours=2))
+        update_cubes(self.offering, since=since)
+
+        def get_cells():
+            return {model: set(model.objects.values_list(*[field.attname for field in model._meta.concrete_fields[1:]])) for model in CUBES}
+
+        cells = get_cells()
+        self.assertEqual(
+            {cell[2:] for cell in cells[PageActivityByWeek]},
+            {(page.pk, 13, 5, 2, 0, 0), (page.pk, 14, 1, 1, 0, 1)},
+        )
+        update_cubes(self.offering)
+        self.assertEqual(get_cells(), cells)
+
+        ImportLmsData(self.offering, None, just_clear=True).remove_olap_data()
+        for model in CUBES:
+            self.assertFalse(model.objects.exists())
+
+    def test_snapshot(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir, override_settings(DATA_SNAPSHOT_DIR=snapshot_dir):
+            self.process_import()
+
+            # The snapshot holds the same columns as the database
+            self.offering.refresh_from_db()
+            columns = load_columns(self.offering, self.offering.data_version)
+            snapshot = open_snapshot(self.offering, self.offering.data_version, columns)
+            for column, values in columns.items():
+                self.assertIsInstance(snapshot[column], np.memmap)
+                self.assertEqual(snapshot[column].tolist(), values.tolist())
+            visits = OfferingVisits.load(self.offering, self.offering.data_version)
+            self.assertEqual((len(visits), visits.nbytes), (5, 0))
+
+            # Once the offering's start date changes, its activity is loaded from the database until a new snapshot
+            self.offering.start_date = datetime.date(2017, 7, 10)
+            self.assertIsNone(open_snapshot(self.offering, self.offering.data_version, columns))
+            self.assertGreater(OfferingVisits.load(self.offering, self.offering.data_version).nbytes, 0)
+            self.offering.refresh_from_db()
+
+            # A reimport recreates the users and pages with the same last_activity_at, and its snapshot replaces the
+            # earlier one, which the offering as it was before the reimport no longer reads
+            stale_offering = CourseOffering.objects.get(pk=self.offering.pk)
+            self.process_import(just_clear=True)
+            self.process_import()
+            self.offering.refresh_from_db()
+            self.assertEqual(self.offering.last_activity_at, stale_offering.last_activity_at)
+            self.assertIsNone(open_snapshot(stale_offering, stale_offering.data_version, columns))
+            snapshot = open_snapshot(self.offering, self.offering.data_version, columns)
+            self.assertEqual(snapshot['user_ids'].tolist(), load_columns(self.offering, self.offering.data_version)['user_ids'].tolist())
+            self.assertEqual(len(os.listdir(os.path.join(snapshot_dir, str(self.offering.pk)))), 1)
+
+            ImportLmsData(self.offering, None, just_clear=True).remove_olap_data()
+            self.assertEqual(os.listdir(snapshot_dir), [])
+
+    def test_snapshot_kept_without_new_activity(self):
+        with tempfile.TemporaryDirectory() as snapshot_dir, override_settings(DATA_SNAPSHOT_DIR=snapshot_dir):
+            self.process_import()
+            self.offering.refresh_from_db()
+            columns = load_columns(self.offering, self.offering.data_version)
+
+            # A delta import adding no activity renames the snapshot for the new import generation, rather than
+            # loading the activity from the database again
+            self.import_path = os.path.join(self.import_dir.name, 'import2.zip')
+            self.write_import_file("user_key|content_key|forum_key|timestamp\n")
+            output = io.StringIO()
+            with mock.patch('olap.snapshots.load_columns') as snapshot_load_columns, redirect_stdout(output):
+                ImportLmsData(self.offering, self.import_path, delta=True).process()
+            snapshot_load_columns.assert_not_called()
+            self.assertIn('Keeping activity snapshot', output.getvalue())
+            self.offering.refresh_from_db()
+            self.assertEqual(self.offering.import_generation, 2)
+            snapshot = open_snapshot(self.offering, self.offering.data_version, columns)
+            self.assertEqual(snapshot['user_ids'].tolist(), columns['user_ids'].tolist())
+            self.assertEqual(len(os.listdir(os.path.join(snapshot_dir, str(self.offering.pk)))), 1)
+
+            # One adding activity writes a new snapshot
+            self.write_import_file("user_key|content_key|forum_key|timestamp\n1|1||2017-10-06 13:30:00+00:00\n")
+            output = io.StringIO()
+            with redirect_stdout(output):
+                ImportLmsData(self.offering, self.import_path, delta=True).process()
+            self.assertIn('Writing activity snapshot', output.getvalue())
+            self.offering.refresh_from_db()
+            visits = OfferingVisits.load(self.offering, self.offering.data_version)
+            self.assertEqual((len(visits), visits.nbytes), (6, 0))
+
+            # Changing the start date recalculates the course weeks, and the snapshot read with it
+            course_weeks = list(PageVisit.objects.order_by('id').values_list('course_week', flat=True))
+            self.offering.start_date = datetime.date(2017, 7, 10)
+            self.offering.save()
+            with redirect_stdout(io.StringIO()):
+                update_course_weeks_task(self.offering.pk)
+            self.assertEqual(list(PageVisit.objects.order_by('id').values_list('course_week', flat=True)), [week - 1 for week in course_weeks])
+            self.offering.refresh_from_db()
+            self.assertEqual(self.offering.import_generation, 4)
+            visits = OfferingVisits.load(self.offering, self.offering.data_version)
+            self.assertEqual((len(visits), visits.nbytes), (6, 0))
+            self.assertEqual(len(os.listdir(os.path.join(snapshot_dir, str(self.offering.pk)))), 1)
+
+        # Nothing is written, or said to be, without a snapshot directory
+        output = io.StringIO()
+        with redirect_stdout(output):
+            ImportLmsData(self.offering, self.import_path, delta=True).process()
+        self.assertNotIn('activity snapshot', output.getvalue())
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    def test_parse_workers(self):
+        for parse_workers in (0, 2):
+            with self.subTest(parse_workers=parse_workers), override_settings(CLOOP_IMPORT_PARSE_WORKERS=parse_workers):
+                ImportLmsData(self.offering, None, just_clear=True).remove_olap_data()
+                self.process_import()
+
+                self.assertEqual(PageVisit.objects.count(), 5)
+                self.assertEqual(sorted(LMSSession.objects.values_list('pageviews', flat=True)), [1, 1, 3])
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    @override_settings(CLOOP_IMPORT_COLUMNAR_ACTIVITY=True)
+    def test_columnar_activity(self):
+        for parse_workers in (0, 2):
+            with self.subTest(parse_workers=parse_workers), override_settings(CLOOP_IMPORT_PARSE_WORKERS=parse_workers):
+                ImportLmsData(self.offering, None, just_clear=True).remove_olap_data()
+                self.process_import()
+
+                self.assertEqual(PageVisit.objects.count(), 5)
+                self.assertEqual(sorted(LMSSession.objects.values_list('pageviews', flat=True)), [1, 1, 3])
+                self.offering.refresh_from_db()
+                self.assertEqual(self.offering.last_activity_at, datetime.datetime(2017, 10, 5, 15, 0, 0, tzinfo=datetime.timezone.utc))
+
+    @mock.patch.object(BlackboardImport, 'ACTIVITY_CHUNK_ROWS', 2)
+    def test_import_file_opened_once(self):
+        # Members are streamed when none fit in memory, otherwise read into memory
+        for memory_member_size in (0, 1024 * 1024):
+            with self.subTest(memory_member_size=memory_member_size), override_settings(CLOOP_IMPORT_MEMORY_MEMBER_SIZE=memory_member_size):
+                ImportLmsData(self.offering, None, just_clear=True).remove_olap_data()
+                output = io.StringIO()
+                with mock.patch('olap.lms_import.ZipFile', wraps=zipfile.ZipFile) as zip_file, redirect_stdout(output):
+                    ImportLmsData(self.offering, self.import_path).process()
+
+                # Once to fingerprint the file for its checkpoint, and once for the rest of the import
+                self.assertEqual(zip_file.call_count, 2)
+                self.assertEqual(PageVisit.objects.count(), 5)
+                self.assertIn('Read {}: 2 rows'.format(BlackboardImport.USERS_FILE), output.getvalue())
+                self.assertIn('Read {}: 5 rows'.format(BlackboardImport.ACTIVITY_FILE), output.getvalue())
+
+                importer = BlackboardImport(self.import_path, self.offering)
+                chunks = list(importer._iter_activity_chunks())
+                self.assertEqual(list(importer._iter_activity_chunks(chunks[0][2])), chunks[1:])
+                importer.close()
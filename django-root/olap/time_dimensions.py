@@ -0,0 +1,55 @@
+"""
+    Time dimensions of LMS activity
+
+    The views group visits, attempts and posts by the week of the course they fall in, and by their local date,
+    weekday and hour.  These are stored on each row (see olap.models.TimeDimensionsMixin), so they can be grouped by in
+    the database rather than worked out from each row's time in Python.
+
+    Local times are in settings.TIME_ZONE (Django's default time zone), as are the offering's start and end datetimes
+    (see CourseOffering.start_datetime).  This is the canonical time zone of the dimensions: they're stored when the
+    activity is imported, so they don't follow a time zone activated for a request.  (The views used to convert to
+    get_current_timezone(), which is the default, as the site never activates another.)
+"""
+from django.utils import timezone
+import numpy as np
+import pandas as pd
+
+TIME_DIMENSION_FIELDS = ('course_week', 'local_date', 'local_weekday', 'local_hour')
+
+
+def course_week(course_offering, local_date):
+    """
+    Returns the week of course_offering that local_date is in.  The week the course starts is week 0, and dates before
+    it give negative weeks.  Weeks are counted in local dates, so they start at local midnight even across a daylight
+    saving change.
+    """
+    return (local_date - course_offering.start_date).days // 7
+
+
+def time_dimensions(course_offering, dt):
+    """
+    Returns a dict of the time dimensions of activity at dt (an aware datetime) in course_offering
+    """
+    local_dt = timezone.localtime(dt, timezone.get_default_timezone())
+    local_date = local_dt.date()
+    return {
+        'course_week': course_week(course_offering, local_date),
+        'local_date': local_date,
+        'local_weekday': local_date.weekday(),
+        'local_hour': local_dt.hour,
+    }
+
+
+def time_dimension_columns(course_offering, epoch_microseconds):
+    """
+    As time_dimensions, but for an array of times in microseconds since the epoch.  Returns a dict of arrays, with the
+    local dates as datetime.date objects.
+    """
+    local_times = pd.to_datetime(epoch_microseconds, unit='us', utc=True).tz_convert(timezone.get_default_timezone())
+    local_days = local_times.tz_localize(None).values.astype('datetime64[D]')
+    return {
+        'course_week': (local_days - np.datetime64(course_offering.start_date, 'D')).astype(np.int64) // 7,
+        'local_date': local_days.astype(object),
+        'local_weekday': np.asarray(local_times.weekday),
+        'local_hour': np.asarray(local_times.hour),
+    }
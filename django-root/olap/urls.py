@@ -2,11 +2,13 @@ from decorator_include import decorator_include
 from django.conf.urls import url
 from stronghold.decorators import public
 
-from django_site.permissions import course_access_url_wrapper
+from olap.response_cache import cache_olap_response
+from olap.response_cache import olap_course_access_url_wrapper
 from olap.views.assessment import AssessmentAccessesView
 from olap.views.assessment import AssessmentEventsView
 from olap.views.assessment import AssessmentGradesView
 from olap.views.assessment import AssessmentStudentsView
+from olap.views.cache_stats import CacheStatsApiView
 from olap.views.common import CoursePageVisitsView
 from olap.views.common import StudentPageVisitsView
 from olap.views.communication import CommunicationAccessesView
@@ -32,8 +34,9 @@ from olap.views.students import StudentsEventsView
 urlpatterns = [
     # This endpoint is protected with Token Authentication
     url(r'^course_imports/$', public(CourseImportsApiView.as_view()), name='course_imports'),
+    url(r'^cache_stats/$', CacheStatsApiView.as_view(), name='cache_stats'),
 
-    url(r'^(?P<course_id>\d+)/', decorator_include(course_access_url_wrapper, [
+    url(r'^(?P<course_id>\d+)/', decorator_include((olap_course_access_url_wrapper, cache_olap_response), [
         url(r'^assessment_accesses/$', AssessmentAccessesView.as_view(), name='assessment_accesses'),
         url(r'^assessment_grades/$', AssessmentGradesView.as_view(), name='assessment_grades'),
         url(r'^assessment_students/$', AssessmentStudentsView.as_view(), name='assessment_students'),
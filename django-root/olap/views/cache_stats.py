@@ -0,0 +1,23 @@
+import os
+
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from olap.response_cache import response_cache_info
+from olap.visit_cache import cache_info
+
+
+class CacheStatsApiView(APIView):
+    """
+    The hits and misses of the visit and response caches in the web process answering the request (each process counts
+    its own), for staff to monitor
+    """
+    permission_classes = (IsAdminUser,)
+
+    def get(self, request, format=None):
+        return Response({
+            'pid': os.getpid(),
+            'visitCache': cache_info()._asdict(),
+            'responseCache': {url_name: info._asdict() for url_name, info in response_cache_info().items()},
+        })
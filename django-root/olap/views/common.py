@@ -1,17 +1,19 @@
 from datetime import timedelta
 
-from django.db.models import Count
-from django.utils.timezone import get_current_timezone
+import numpy as np
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from dashboard.models import CourseOffering
 from dashboard.models import CourseSingleEvent
 from dashboard.models import CourseSubmissionEvent
 from olap.models import LMSUser
-from olap.models import PageVisit
 from olap.serializers import DailyPageVisitsSerializer
 from olap.serializers import StudentPageVisitsHistogramSerializer
+from olap.snapshots import PAGE_TYPE_ASSESSMENT
+from olap.snapshots import PAGE_TYPE_COMMUNICATION
+from olap.snapshots import PAGE_TYPE_CONTENT
+from olap.snapshots import PAGE_TYPES
+from olap.visit_cache import get_offering_visits
 
 
 class CoursePageVisitsView(APIView):
@@ -21,7 +23,6 @@ class CoursePageVisitsView(APIView):
         resource_id = request.GET.get('resource_id')
 
         day_dict = {}
-        our_tz = get_current_timezone()
         course_span = request.course_offering.end_date - request.course_offering.start_date
         for day_offset in range(course_span.days + 1):
             day = request.course_offering.start_date + timedelta(days=day_offset)
@@ -34,22 +35,26 @@ class CoursePageVisitsView(APIView):
                 'submission_events': [],
             }
 
-        # Get page visits optionally filtered by student and page
-        page_visit_qs = PageVisit.objects.filter(page__course_offering=request.course_offering)
+        # Count the page visits by day and page type, optionally only those by a student or to a page
+        visits = get_offering_visits(request.course_offering)
+        counted = np.ones(len(visits), dtype=bool)
         if student_id:
-            page_visit_qs = page_visit_qs.filter(lms_user_id=student_id)
+            counted &= visits.by_user(int(student_id))
         if resource_id:
-            page_visit_qs = page_visit_qs.filter(page_id=resource_id)
+            counted &= visits.to_page(int(resource_id))
+        days = visits.course_day[counted]
+        in_course = (days >= 0) & (days <= course_span.days)
+        visits_by_day = np.bincount(
+            days[in_course] * PAGE_TYPES + visits.page_type[counted][in_course],
+            minlength=(course_span.days + 1) * PAGE_TYPES,
+        ).reshape(-1, PAGE_TYPES)
 
         # Add the page visits to their corresponding entry
-        for page_visit in page_visit_qs.values('visited_at', 'page__content_type'):
-            visit_date = page_visit['visited_at'].astimezone(our_tz).date()
-            if page_visit['page__content_type'] in CourseOffering.communication_types():
-                day_dict[visit_date]['communication_visits'] += 1
-            elif page_visit['page__content_type'] in CourseOffering.assessment_types():
-                day_dict[visit_date]['assessment_visits'] += 1
-            else:
-                day_dict[visit_date]['content_visits'] += 1
+        for day_offset, day_visits in enumerate(visits_by_day.tolist()):
+            day = request.course_offering.start_date + timedelta(days=day_offset)
+            day_dict[day]['content_visits'] = day_visits[PAGE_TYPE_CONTENT]
+            day_dict[day]['communication_visits'] = day_visits[PAGE_TYPE_COMMUNICATION]
+            day_dict[day]['assessment_visits'] = day_visits[PAGE_TYPE_ASSESSMENT]
 
         # Add the single and submission events to their corresponding entry
         for single_event in CourseSingleEvent.objects.filter(course_offering=request.course_offering):
@@ -73,7 +78,7 @@ class StudentPageVisitsView(APIView):
         resource_id = request.GET.get('resource_id')
 
         # Setup the initial collection of all users
-        lms_user_qs = LMSUser.objects.filter(course_offering=request.course_offering)
+        lms_user_qs = LMSUser.objects.for_offering(request.course_offering)
         user_dict = {}
         for lms_user in lms_user_qs:
             user_dict[lms_user.id] = {
@@ -81,21 +86,19 @@ class StudentPageVisitsView(APIView):
                 'num_visits': 0,
             }
 
-        # Filter the list of page visits
-        page_visit_qs = PageVisit.objects.filter(page__course_offering=request.course_offering)
+        # Count the page visits by each user, optionally only those to a page or in a week
+        visits = get_offering_visits(request.course_offering)
+        counted = np.ones(len(visits), dtype=bool)
         if resource_id:
-            page_visit_qs = page_visit_qs.filter(page_id=resource_id)
+            counted &= visits.to_page(int(resource_id))
         if week_num:
-            range_start = request.course_offering.start_datetime + timedelta(weeks=int(week_num) - 1)
-            range_end = range_start + timedelta(weeks=1)
-            page_visit_qs = page_visit_qs.filter(visited_at__range=(range_start, range_end))
-
-        # Count the filtered page visits grouped by LMSUser
-        page_visit_qs = page_visit_qs.values('lms_user_id').annotate(num_visits=Count('lms_user_id'))
+            # Course weeks are 0-based
+            counted &= visits.course_week == int(week_num) - 1
+        visits_by_user = np.bincount(visits.user_index[counted], minlength=len(visits.user_ids))
 
         # Update the user collection
-        for lms_user in page_visit_qs:
-            user_dict[lms_user['lms_user_id']]['num_visits'] = lms_user['num_visits']
+        for lms_user_id, num_visits in zip(visits.user_ids.tolist(), visits_by_user.tolist()):
+            user_dict[lms_user_id]['num_visits'] = num_visits
 
         # Convert to array and serialize
         data = [v for v in user_dict.values()]
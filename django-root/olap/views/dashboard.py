@@ -2,7 +2,9 @@ import datetime
 
 from django.db.models import Avg
 from django.db.models import Count
-from django.utils.timezone import get_current_timezone
+from django.db.models import Sum
+from django.db.models.functions import Coalesce
+import numpy as np
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 from rest_framework.views import APIView
@@ -12,15 +14,35 @@ from dashboard.models import CourseRepeatingEvent
 from olap.models import LMSSession
 from olap.models import LMSUser
 from olap.models import Page
-from olap.models import PageVisit
+from olap.models import PageActivityByWeek
 from olap.models import SubmissionAttempt
-from olap.models import SummaryPost
 from olap.serializers import TopAccessedContentSerializer
 from olap.serializers import TopAssessmentAccessSerializer
 from olap.serializers import TopCommunicationAccessSerializer
 from olap.serializers import TopCourseUsersSerializer
 from olap.serializers import WeeklyMetricsSerializer
 from olap.serializers import WeeklyPageVisitsSerializer
+from olap.snapshots import PAGE_TYPE_ASSESSMENT
+from olap.snapshots import PAGE_TYPE_COMMUNICATION
+from olap.snapshots import PAGE_TYPE_CONTENT
+from olap.snapshots import PAGE_TYPES
+from olap.visit_cache import count_distinct
+from olap.visit_cache import get_offering_visits
+
+
+def count_page_users(course_offering, page_ids, weeks):
+    """
+    Returns the number of distinct users to visit each of page_ids in the (first, last) course weeks, by page id
+    """
+    if weeks[0] == weeks[1]:
+        # A week's users are summarised in its cube cells
+        cells = PageActivityByWeek.objects.for_offering(course_offering).filter(page_id__in=page_ids, course_week=weeks[0])
+        return dict(cells.values_list('page_id', 'users'))
+    visits = get_offering_visits(course_offering)
+    visit_pages = visits.page_positions(page_ids)[visits.page_index]
+    counted = (visit_pages >= 0) & (visits.course_week >= weeks[0]) & (visits.course_week <= weeks[1])
+    users = count_distinct(visit_pages[counted], visits.user_index[counted], len(page_ids))
+    return dict(zip(page_ids, users.tolist()))
 
 
 class TopCourseUsersViewSet(ListAPIView):
@@ -28,7 +50,7 @@ class TopCourseUsersViewSet(ListAPIView):
     max_rows_to_return = 10
 
     def get_queryset(self):
-        qs = LMSUser.objects.annotate(pageviews=Count("pagevisit")).filter(course_offering=self.request.course_offering).order_by('-pageviews')[0:self.max_rows_to_return]
+        qs = LMSUser.objects.for_offering(self.request.course_offering).annotate(pageviews=Coalesce(Sum('lmsuseractivitybyweek__visits'), 0)).order_by('-pageviews')[0:self.max_rows_to_return]
 
         return qs
 
@@ -39,25 +61,24 @@ class TopAccessedContentView(ListAPIView):
 
     def get_queryset(self):
         course_offering = self.request.course_offering
-        # Was a week number specified? (week number is 1-based)
+        # Was a week number specified? (week number is 1-based, course weeks are 0-based)
         week_num = self.kwargs.get('week_num')
         if week_num is not None:
             # Filter for pagevisits within the week
-            range_start = course_offering.start_datetime + datetime.timedelta(weeks=int(week_num) - 1)
-            range_end = range_start + datetime.timedelta(weeks=1)
+            weeks = (int(week_num) - 1, int(week_num) - 1)
         else:
             # Filter for pagevisits within the extent of the courseoffering
-            range_start = course_offering.start_datetime
-            range_end = range_start + datetime.timedelta(weeks=course_offering.no_weeks)
-        dt_range = (range_start, range_end)
+            weeks = (0, course_offering.no_weeks - 1)
 
         # Get the page list.  pageviews can be done in the query.
-        page_qs = Page.objects.filter(course_offering=course_offering, pagevisit__visited_at__range=dt_range).values('id', 'title', 'content_type').annotate(pageviews=Count("pagevisit")).order_by('-pageviews')[0:self.max_rows_to_return]
+        page_qs = Page.objects.for_offering(course_offering).filter(
+            pageactivitybyweek__course_week__range=weeks, pageactivitybyweek__visits__gt=0,
+        ).values('id', 'title', 'content_type').annotate(pageviews=Sum('pageactivitybyweek__visits')).order_by('-pageviews')[0:self.max_rows_to_return]
 
         # Now calculate the data for the userviews column by finding the number of distinct users to access each page in the time period.
-        # FIXME: This isn't a great way to do it.  Would be good to do it as part of the query above, in a way that didn't involve iteration or sets.
+        users_by_page = count_page_users(course_offering, [page['id'] for page in page_qs], weeks)
         for page in page_qs:
-            page['userviews'] = len(set(LMSUser.objects.filter(pagevisit__page=page['id'], pagevisit__visited_at__range=dt_range)))
+            page['userviews'] = users_by_page.get(page['id'], 0)
 
         return page_qs
 
@@ -68,36 +89,32 @@ class TopCommunicationAccessView(ListAPIView):
 
     def get_queryset(self):
         course_offering = self.request.course_offering
-        # Was a week number specified? (week number is 1-based)
+        # Was a week number specified? (week number is 1-based, course weeks are 0-based)
         week_num = self.kwargs.get('week_num')
         if week_num is not None:
             # Filter for pagevisits within the week
-            range_start = course_offering.start_datetime + datetime.timedelta(weeks=int(week_num) - 1)
-            range_end = range_start + datetime.timedelta(weeks=1)
+            weeks = (int(week_num) - 1, int(week_num) - 1)
         else:
             # Filter for pagevisits within the extent of the courseoffering
-            range_start = course_offering.start_datetime
-            range_end = range_start + datetime.timedelta(weeks=course_offering.no_weeks)
-        dt_range = (range_start, range_end)
+            weeks = (0, course_offering.no_weeks - 1)
 
         # Get the page list.  If only we could do all this at the db level.
-        page_qs = Page.objects.filter(course_offering=course_offering, content_type__in=CourseOffering.communication_types()).values('id', 'title', 'content_type')
+        page_qs = Page.objects.for_offering(course_offering).filter(content_type__in=CourseOffering.communication_types()).values('id', 'title', 'content_type')
 
-        # Augment all the pages with how many page views related to that page for the window of interest.
+        # Augment all the pages with how many page views and posts related to that page for the window of interest.
+        cells = PageActivityByWeek.objects.for_offering(course_offering).filter(course_week__range=weeks)
+        counts_by_page = {page_id: (visits, posts) for page_id, visits, posts in cells.values_list('page_id').annotate(Sum('visits'), Sum('posts')).order_by()}
         for page in page_qs:
-            page['pageviews'] = PageVisit.objects.filter(page=page['id'], visited_at__range=dt_range).count()
+            page['pageviews'], page['posts'] = counts_by_page.get(page['id'], (0, 0))
 
         # Sort by number of page views and trim down to top 10 rows
         # WARNING: This is messing with the internals of the query set
         page_qs._result_cache = sorted(page_qs._result_cache, key=lambda p: p['pageviews'], reverse=True)[0:self.max_rows_to_return]
 
-        # Now calculate the data for the userviews and posts columns.
-        # FIXME: This isn't a great way to do it.  Would be good to do it as part of the query above, in a way that didn't involve iteration or sets.
+        # Now calculate the data for the userviews column: the number of distinct users to access each page in the time period.
+        users_by_page = count_page_users(course_offering, [page['id'] for page in page_qs], weeks)
         for page in page_qs:
-            # The userviews value is the number of distinct users to access this page in the time period.
-            page['userviews'] = LMSUser.objects.filter(pagevisit__page=page['id'], pagevisit__visited_at__range=dt_range).distinct().count()
-            # The posts value is the number of posts to this page in the window of interest.
-            page['posts'] = SummaryPost.objects.filter(page=page['id'], posted_at__range=dt_range).count()
+            page['userviews'] = users_by_page.get(page['id'], 0)
 
         return page_qs
 
@@ -108,38 +125,38 @@ class TopAssessmentAccessView(ListAPIView):
 
     def get_queryset(self):
         course_offering = self.request.course_offering
-        # Was a week number specified? (week number is 1-based)
+        # Was a week number specified? (week number is 1-based, course weeks are 0-based)
         week_num = self.kwargs.get('week_num')
         if week_num is not None:
             # Filter for assessment accesses within the week
-            range_start = course_offering.start_datetime + datetime.timedelta(weeks=int(week_num) - 1)
-            range_end = range_start + datetime.timedelta(weeks=1)
+            weeks = (int(week_num) - 1, int(week_num) - 1)
         else:
             # Filter for assessment accesses within the extent of the courseoffering
-            range_start = course_offering.start_datetime
-            range_end = range_start + datetime.timedelta(weeks=course_offering.no_weeks)
-        dt_range = (range_start, range_end)
+            weeks = (0, course_offering.no_weeks - 1)
 
         # Get the page list.  If only we could do all this at the db level.
-        page_qs = Page.objects.filter(course_offering=course_offering, content_type__in=CourseOffering.assessment_types()).values('id', 'title', 'content_type')
+        page_qs = Page.objects.for_offering(course_offering).filter(content_type__in=CourseOffering.assessment_types()).values('id', 'title', 'content_type')
 
         # Augment all the pages with how many submission attempts related to that page for the window of interest.
+        cells = PageActivityByWeek.objects.for_offering(course_offering).filter(course_week__range=weeks)
+        attempts_by_page = dict(cells.values_list('page_id').annotate(Sum('attempts')).order_by())
         for page in page_qs:
-            page['attempts'] = SubmissionAttempt.objects.filter(page=page['id'], attempted_at__range=dt_range).count()
+            page['attempts'] = attempts_by_page.get(page['id'], 0)
 
         # Sort by number of submission attempts and trim down to top 10 rows
         # WARNING: This is messing with the internals of the query set
         page_qs._result_cache = sorted(page_qs._result_cache, key=lambda p: p['attempts'], reverse=True)[0:self.max_rows_to_return]
 
-        # Now calculate the data for the userviews and average score columns.
-        # FIXME: This isn't a great way to do it.  Would be good to do it as part of the query above, in a way that didn't involve iteration or sets.
+        # Now calculate the data for the userviews and average score columns.  The userviews value is the number of
+        # distinct users to make a submission attempt in the time period, and the average score is the average of
+        # scores for submission attempts in the time period.
+        attempts = SubmissionAttempt.objects.for_offering(course_offering).filter(page_id__in=[page['id'] for page in page_qs], course_week__range=weeks)
+        attempt_stats_by_page = {
+            page_id: (users, average_score)
+            for page_id, users, average_score in attempts.values_list('page_id').annotate(Count('lms_user', distinct=True), Avg('grade')).order_by()
+        }
         for page in page_qs:
-            # The userviews value is the number of distinct users to make a submission attempt in the time period.
-            page['userviews'] = LMSUser.objects.values('id').filter(submissionattempt__page=page['id'], submissionattempt__attempted_at__range=dt_range).distinct().count()
-            # The average score is the average of scores for submission attempts in the time period.
-            # FIXME: Check for average-related exceptions here.
-            avg = SubmissionAttempt.objects.filter(page=page['id'], attempted_at__range=dt_range).aggregate(Avg('grade'))
-            page['average_score'] = avg['grade__avg']
+            page['userviews'], page['average_score'] = attempt_stats_by_page.get(page['id'], (0, None))
 
         return page_qs
 
@@ -148,20 +165,13 @@ class PerWeekPageVisitsView(APIView):
     def get(self, request, *args, **kwargs):
 
         week_num = kwargs.get('week_num')
-        week_start = request.course_offering.start_datetime + datetime.timedelta(weeks=int(week_num) - 1)
-        dt_range = (week_start, week_start + datetime.timedelta(weeks=1))
-        our_tz = get_current_timezone()
+        week_start = request.course_offering.start_date + datetime.timedelta(weeks=int(week_num) - 1)
 
         day_dict = {}
         for day_offset in range(7):
-            day = (week_start + datetime.timedelta(days=day_offset)).date()
+            day = week_start + datetime.timedelta(days=day_offset)
             day_dict[day] = {
                 'day': day,
-
-                # Temporary values to calculate final data - will be stripped out by the serializer
-                'page_list': [],
-
-                # Final calculated values returned by the endpoint
                 'unique_visits': 0,
                 'content_visits': 0,
                 'communication_visits': 0,
@@ -169,25 +179,24 @@ class PerWeekPageVisitsView(APIView):
                 'repeating_events': [],
             }
 
-        # Add the page visits to their corresponding entry
-        for page_visit in PageVisit.objects.filter(page__course_offering=request.course_offering, visited_at__range=dt_range).values('page_id', 'visited_at', 'page__content_type'):
-            visit_date = page_visit['visited_at'].astimezone(our_tz).date()
-            day_dict[visit_date]['page_list'].append(page_visit['page_id'])
-            if page_visit['page__content_type'] in CourseOffering.communication_types():
-                day_dict[visit_date]['communication_visits'] += 1
-            elif page_visit['page__content_type'] in CourseOffering.assessment_types():
-                day_dict[visit_date]['assessment_visits'] += 1
-            else:
-                day_dict[visit_date]['content_visits'] += 1
+        # Count the week's page visits by day and page type, and the distinct pages visited each day (course weeks are
+        # 0-based)
+        visits = get_offering_visits(request.course_offering)
+        in_week = visits.course_week == int(week_num) - 1
+        week_days = visits.course_day[in_week] % 7
+        visits_by_day = np.bincount(week_days * PAGE_TYPES + visits.page_type[in_week], minlength=7 * PAGE_TYPES).reshape(7, PAGE_TYPES)
+        pages_by_day = count_distinct(week_days, visits.page_index[in_week], 7)
+        for day_offset, (day_visits, unique_visits) in enumerate(zip(visits_by_day.tolist(), pages_by_day.tolist())):
+            day = week_start + datetime.timedelta(days=day_offset)
+            day_dict[day]['unique_visits'] = unique_visits
+            day_dict[day]['content_visits'] = day_visits[PAGE_TYPE_CONTENT]
+            day_dict[day]['communication_visits'] = day_visits[PAGE_TYPE_COMMUNICATION]
+            day_dict[day]['assessment_visits'] = day_visits[PAGE_TYPE_ASSESSMENT]
 
         # Add the repeating events to their corresponding entry
         for repeating_event in CourseRepeatingEvent.objects.filter(course_offering=request.course_offering, start_week__lte=week_num, end_week__gte=week_num):
             repeat_event_date = week_start + datetime.timedelta(days=repeating_event.day_of_week)
-            day_dict[repeat_event_date.date()]['repeating_events'].append(repeating_event.title)
-
-        # Turn the list of pages visited for each day into a count of unique visits
-        for day in day_dict:
-            day_dict[day]['unique_visits'] = len(set(day_dict[day]['page_list']))
+            day_dict[repeat_event_date]['repeating_events'].append(repeating_event.title)
 
         # Convert to array and serialize
         data = [v for v in day_dict.values()]
@@ -200,19 +209,15 @@ class PerWeekMetricsView(APIView):
     def get(self, request, *args, **kwargs):
 
         week_num = kwargs.get('week_num')
-        week_start = request.course_offering.start_datetime + datetime.timedelta(weeks=int(week_num) - 1)
-        dt_range = (week_start, week_start + datetime.timedelta(weeks=1))
-        our_tz = get_current_timezone()
+        week_start = request.course_offering.start_date + datetime.timedelta(weeks=int(week_num) - 1)
 
         day_dict = {}
         for day_offset in range(7):
-            day = (week_start + datetime.timedelta(days=day_offset)).date()
+            day = week_start + datetime.timedelta(days=day_offset)
             day_dict[day] = {
                 'day': day,
 
                 # Temporary values to calculate final data - will be stripped out by the serializer
-                'page_list': [],
-                'student_list': [],
                 'total_session_pageviews': 0,
                 'total_session_duration': 0,
 
@@ -224,23 +229,26 @@ class PerWeekMetricsView(APIView):
                 'avg_session_pageviews': 0,
             }
 
-        # Add the page visit data to their corresponding entries
-        for page_visit in PageVisit.objects.filter(page__course_offering=request.course_offering, visited_at__range=dt_range).values('page_id', 'lms_user_id', 'visited_at'):
-            visit_date = page_visit['visited_at'].astimezone(our_tz).date()
-            day_dict[visit_date]['page_list'].append(page_visit['page_id'])
-            day_dict[visit_date]['student_list'].append(page_visit['lms_user_id'])
+        # Add the distinct pages and students visited each day (course weeks are 0-based)
+        visits = get_offering_visits(request.course_offering)
+        in_week = visits.course_week == int(week_num) - 1
+        week_days = visits.course_day[in_week] % 7
+        pages_by_day = count_distinct(week_days, visits.page_index[in_week], 7)
+        students_by_day = count_distinct(week_days, visits.user_index[in_week], 7)
+        for day_offset, (unique_visits, students) in enumerate(zip(pages_by_day.tolist(), students_by_day.tolist())):
+            day = week_start + datetime.timedelta(days=day_offset)
+            day_dict[day]['unique_visits'] = unique_visits
+            day_dict[day]['students'] = students
 
         # Add the session data to their corresponding entries
-        for session in LMSSession.objects.filter(course_offering=request.course_offering, first_visit__visited_at__range=dt_range).values('first_visit__visited_at', 'session_length_in_mins', 'pageviews'):
-            session_date = session['first_visit__visited_at'].astimezone(our_tz).date()
-            day_dict[session_date]['sessions'] += 1
-            day_dict[session_date]['total_session_duration'] += session['session_length_in_mins']
-            day_dict[session_date]['total_session_pageviews'] += session['pageviews']
+        session_qs = LMSSession.objects.for_offering(request.course_offering).filter(first_visit__course_week=int(week_num) - 1)
+        for session_date, sessions, total_duration, total_pageviews in session_qs.values_list('first_visit__local_date').annotate(Count('id'), Sum('session_length_in_mins'), Sum('pageviews')).order_by():
+            day_dict[session_date]['sessions'] = sessions
+            day_dict[session_date]['total_session_duration'] = total_duration
+            day_dict[session_date]['total_session_pageviews'] = total_pageviews
 
         # Post-processing of days to get final calculated values
         for day in day_dict:
-            day_dict[day]['unique_visits'] = len(set(day_dict[day]['page_list']))
-            day_dict[day]['students'] = len(set(day_dict[day]['student_list']))
             day_dict[day]['avg_session_duration'] = day_dict[day]['total_session_duration'] // day_dict[day]['sessions'] if day_dict[day]['sessions'] else 0
             day_dict[day]['avg_session_pageviews'] = day_dict[day]['total_session_pageviews'] // day_dict[day]['sessions'] if day_dict[day]['sessions'] else 0
 
@@ -4,20 +4,22 @@ from rest_framework.views import APIView
 
 from dashboard.models import CourseOffering
 from olap.models import Page
-from olap.models import PageVisit
 from olap.models import SubmissionAttempt
 from olap.models import SummaryPost
 from olap.serializers import StudentAssessmentSerializer
 from olap.serializers import StudentCommunicationSerializer
+from olap.visit_cache import get_offering_visits
 
 
 class StudentCommunicationView(APIView):
 
     def get(self, request, student_id, format=None):
-        communications = Page.objects.filter(course_offering=self.request.course_offering, content_type__in=CourseOffering.communication_types()).values('id', 'title', 'content_type')
+        communications = Page.objects.for_offering(self.request.course_offering).filter(content_type__in=CourseOffering.communication_types()).values('id', 'title', 'content_type')
 
+        visits = get_offering_visits(self.request.course_offering)
+        views_by_page = visits.count_by_page(visits.by_user(int(student_id)))
         for communication in communications:
-            communication['user_views'] = PageVisit.objects.filter(lms_user_id=student_id, page_id=communication['id']).count()
+            communication['user_views'] = views_by_page.get(communication['id'], 0)
             communication['posts'] = SummaryPost.objects.filter(lms_user_id=student_id, page_id=communication['id']).count()
 
         serializer = StudentCommunicationSerializer(data=communications, many=True)
@@ -29,10 +31,12 @@ class StudentCommunicationView(APIView):
 class StudentAssessmentView(APIView):
 
     def get(self, request, student_id, format=None):
-        assessments = Page.objects.filter(course_offering=self.request.course_offering, content_type__in=CourseOffering.assessment_types()).values('id', 'title', 'content_type')
+        assessments = Page.objects.for_offering(self.request.course_offering).filter(content_type__in=CourseOffering.assessment_types()).values('id', 'title', 'content_type')
 
+        visits = get_offering_visits(self.request.course_offering)
+        views_by_page = visits.count_by_page(visits.by_user(int(student_id)))
         for assessment in assessments:
-            assessment['user_views'] = PageVisit.objects.filter(lms_user_id=student_id, page_id=assessment['id']).count()
+            assessment['user_views'] = views_by_page.get(assessment['id'], 0)
             attempts = SubmissionAttempt.objects.filter(lms_user_id=student_id, page_id=assessment['id']).values_list('grade', flat=True)
             assessment['attempts'] = len(attempts)
             assessment['average_grade'] = Decimal(sum(attempts) / assessment['attempts']) if assessment['attempts'] else 0
@@ -0,0 +1,196 @@
+"""
+    A cache, in each process, of course offerings' page visits as numpy arrays
+
+    The views that can't read their counts from the summaries kept by olap.cubes (eg. the distinct students to visit
+    pages over several weeks, or visits by day) count an offering's visits from these arrays with np.bincount, rather
+    than fetching and grouping them again for each request.  An offering's arrays are memory mapped from its snapshot
+    (see olap.snapshots), or loaded from the database if it has none, the first time they're used.  They're kept until
+    its data changes (its import generation, data version or start date) or they're the least recently used when the
+    cache needs room.  The cache is kept within settings.CLOOP_OLAP_VISIT_CACHE_BYTES of memory, and cache_info()
+    reports its size.
+"""
+from collections import namedtuple
+from collections import OrderedDict
+import logging
+import threading
+
+from django.conf import settings
+import numpy as np
+
+from olap.snapshots import ACTIVITY_COLUMNS
+from olap.snapshots import load_columns
+from olap.snapshots import open_snapshot
+
+logger = logging.getLogger(__name__)
+
+CacheInfo = namedtuple('CacheInfo', ('hits', 'misses', 'offerings', 'bytes', 'max_bytes'))
+
+
+def count_distinct(groups, values, no_groups):
+    """
+    Returns the number of distinct values (non-negative ints) in each of no_groups groups, given the group of each
+    value.
+    """
+    groups = np.asarray(groups, dtype=np.int64)
+    values = np.asarray(values, dtype=np.int64)
+    no_values = int(values.max()) + 1 if len(values) else 1
+    pairs = np.unique(groups * no_values + values)
+    return np.bincount(pairs // no_values, minlength=no_groups)
+
+
+class OfferingVisits(object):
+    """
+        The page visits in a version of a course offering's data, as the arrays of olap.snapshots.load_columns with
+        an element for each visit:
+         - user_index: the index of its visitor in user_ids (the ids of the offering's LMSUsers)
+         - page_index: the index of its page in page_ids (the ids of the offering's pages)
+         - page_type: the PAGE_TYPE_* of its page
+         - course_week and local_weekday: as stored on the visit
+
+        Visits are counted by course week and weekday rather than by their times, as course weeks start at local
+        midnight even across a daylight saving change.
+    """
+    ARRAYS = ('user_ids', 'page_ids') + ACTIVITY_COLUMNS
+
+    def __init__(self, course_offering, columns):
+        self.start_weekday = course_offering.start_date.weekday()
+        self.user_ids = columns['user_ids']
+        self.page_ids = columns['page_ids']
+        for column in ACTIVITY_COLUMNS:
+            setattr(self, column, columns['visits_' + column])
+
+    @classmethod
+    def load(cls, course_offering, data_version):
+        """
+        Returns the OfferingVisits of the given version of course_offering's data, memory mapped from its snapshot if
+        it has one, otherwise loaded from the database
+        """
+        columns = open_snapshot(course_offering, data_version, ['user_ids', 'page_ids'] + ['visits_' + column for column in ACTIVITY_COLUMNS])
+        if columns is None:
+            columns = load_columns(course_offering, data_version, activities=('visits',))
+        return cls(course_offering, columns)
+
+    def __len__(self):
+        return len(self.user_index)
+
+    @property
+    def nbytes(self):
+        """
+        The bytes of the arrays in this process's memory.  (Those memory mapped from a snapshot are shared with other
+        processes through the OS page cache.)
+        """
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS if not isinstance(getattr(self, name), np.memmap))
+
+    @property
+    def course_day(self):
+        """
+        The day of the course of each visit, counting the start date as day 0
+        """
+        return self.course_week.astype(np.int32) * 7 + (self.local_weekday.astype(np.int32) - self.start_weekday) % 7
+
+    def page_positions(self, page_ids):
+        """
+        Returns, for each of the offering's pages, its position in page_ids, or -1 if it isn't there.  Index the result
+        with page_index to get each visit's.
+        """
+        page_ids = np.asarray(page_ids, dtype=np.int64)
+        positions = np.full(len(self.page_ids), -1, dtype=np.int64)
+        indexes = np.searchsorted(self.page_ids, page_ids)
+        found = indexes < len(self.page_ids)
+        found[found] = self.page_ids[indexes[found]] == page_ids[found]
+        positions[indexes[found]] = np.flatnonzero(found)
+        return positions
+
+    def count_by_page(self, counted):
+        """
+        Returns the number of visits to each page of those where counted (an array of bools for each visit), by page id
+        """
+        return dict(zip(self.page_ids.tolist(), np.bincount(self.page_index[counted], minlength=len(self.page_ids)).tolist()))
+
+    def by_user(self, lms_user_id):
+        """
+        Returns whether each visit is by the LMSUser with id lms_user_id
+        """
+        index = np.searchsorted(self.user_ids, lms_user_id)
+        if index == len(self.user_ids) or self.user_ids[index] != lms_user_id:
+            return np.zeros(len(self), dtype=bool)
+        return self.user_index == index
+
+    def to_page(self, page_id):
+        """
+        Returns whether each visit is to the Page with id page_id
+        """
+        return self.page_positions([page_id])[self.page_index] == 0
+
+
+class VisitCache(object):
+    """
+        A least recently used cache of OfferingVisits, by course offering and data version, kept within max_bytes
+    """
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (stamp, OfferingVisits) by (course offering id, data version)
+        self._lock = threading.Lock()
+
+    def get(self, course_offering, data_version=None):
+        if data_version is None:
+            data_version = course_offering.data_version
+        key = (course_offering.pk, data_version)
+        stamp = (course_offering.import_generation, course_offering.start_date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == stamp:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # Other requests carry on while the visits are loaded
+        visits = OfferingVisits.load(course_offering, data_version)
+        with self._lock:
+            self._discard(key)
+            if visits.nbytes <= self.max_bytes:
+                self._entries[key] = (stamp, visits)
+                self.bytes += visits.nbytes
+                while self.bytes > self.max_bytes:
+                    self._discard(next(iter(self._entries)))
+            logger.info('Loaded %d visits of %s (%d bytes); caching %d offerings in %d of %d bytes', len(visits), course_offering, visits.nbytes, len(self._entries), self.bytes, self.max_bytes)
+        return visits
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = self.hits = self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, len(self._entries), self.bytes, self.max_bytes)
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1].nbytes
+
+
+_cache = VisitCache(settings.CLOOP_OLAP_VISIT_CACHE_BYTES)
+
+
+def get_offering_visits(course_offering, data_version=None):
+    """
+    Returns the OfferingVisits of the given version of course_offering's data (by default the published version)
+    """
+    return _cache.get(course_offering, data_version)
+
+
+def cache_info():
+    """
+    Returns the hits, misses, number of offerings and bytes of this process's cache, and its limit, as a CacheInfo
+    """
+    return _cache.info()
+
+
+def clear_cache():
+    _cache.clear()
@@ -0,0 +1,112 @@
+"""
+    Warming of the OLAP views' cached responses
+
+    After an import, warm_responses computes the responses of an offering's OLAP views, so they're in the response cache
+    (see olap.response_cache) before the first lecturer opens its dashboards.  Each view is requested for every course
+    week and repeating event its URL takes; views of a single student or resource are left to be cached when they're
+    first opened.  It's only done if settings.CLOOP_OLAP_WARM_RESPONSES is set, and the responses are cached.
+"""
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+import time
+
+from django.conf import settings
+from django.db import connection
+from django.http.request import HttpRequest
+from django.urls import NoReverseMatch
+from django.urls import RegexURLResolver
+from django.urls import resolve
+from django.urls import reverse
+
+from dashboard.models import CourseRepeatingEvent
+from olap import urls
+from olap.response_cache import get_response_cache
+
+
+def _course_url_patterns():
+    """
+    Returns the URL patterns of the views of an offering's OLAP data
+    """
+    course_urls = next(pattern for pattern in urls.urlpatterns if isinstance(pattern, RegexURLResolver))
+    return course_urls.url_patterns
+
+
+def warming_enabled():
+    """
+    Returns whether the responses are to be warmed after an import
+    """
+    return settings.CLOOP_OLAP_WARM_RESPONSES and get_response_cache() is not None
+
+
+def get_warm_paths(course_offering):
+    """
+    Returns a list of (URL name, path) of the responses to warm for course_offering
+    """
+    kwarg_values = {
+        'week_num': range(1, course_offering.no_weeks + 1),
+        'event_id': CourseRepeatingEvent.objects.filter(course_offering=course_offering).values_list('id', flat=True).order_by('id'),
+    }
+    paths = []
+    for pattern in _course_url_patterns():
+        kwarg_names = sorted(pattern.regex.groupindex)
+        if set(kwarg_names) - set(kwarg_values):
+            # A view of a single student or resource
+            continue
+        url_name = 'olap:' + pattern.name
+        try:
+            # Views with an optional week are also shown for the whole course
+            paths.append((pattern.name, reverse(url_name, kwargs={'course_id': course_offering.id})))
+        except NoReverseMatch:
+            pass
+        if kwarg_names:
+            for values in itertools.product(*(kwarg_values[name] for name in kwarg_names)):
+                kwargs = dict(zip(kwarg_names, values), course_id=course_offering.id)
+                paths.append((pattern.name, reverse(url_name, kwargs=kwargs)))
+    return paths
+
+
+def _warm_response(user, path):
+    """
+    Requests path as the frontend would (as user, accepting JSON), so its response is cached.  Returns how long it took
+    in seconds.
+    """
+    start = time.perf_counter()
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = path
+    request.META = {'HTTP_ACCEPT': 'application/json', 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80'}
+    request.user = user
+    request.resolver_match = resolve(path)
+    request.resolver_match.func(request, *request.resolver_match.args, **request.resolver_match.kwargs)
+    return time.perf_counter() - start
+
+
+def warm_responses(course_offering, concurrency=1):
+    """
+    Computes and caches the responses of course_offering's OLAP views, concurrency at a time, as one of its owners.
+    Returns the seconds spent on each view, by URL name.
+    """
+    seconds_by_view = OrderedDict()
+    user = course_offering.owners.first()
+    if user is None:
+        # No one can see the offering's dashboards
+        return seconds_by_view
+    paths = get_warm_paths(course_offering)
+
+    if concurrency > 1:
+        def warm_in_thread(path):
+            try:
+                return _warm_response(user, path)
+            finally:
+                # Each thread has its own connection
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            seconds = list(executor.map(warm_in_thread, [path for url_name, path in paths]))
+    else:
+        seconds = [_warm_response(user, path) for url_name, path in paths]
+
+    for (url_name, path), path_seconds in zip(paths, seconds):
+        seconds_by_view[url_name] = seconds_by_view.get(url_name, 0) + path_seconds
+    return seconds_by_view